@@ -2,77 +2,175 @@ import ast
 import datetime
 import db.mongodb_controller as db_controller
 
-from flask import jsonify
+from flask import current_app
 from marshmallow import ValidationError
-from api.schemas import BoulderFields
+from api.encoding import JSON_MIMETYPE, MSGPACK_MIMETYPE, get_mimetype, get_packer, make_api_response
+from api.schemas import BoulderFields, BoulderListRequestArgs, CircuitListRequestArgs
+from api.schemas import CreateBoulderBatchRequestValidator, CreateBoulderRequestValidator
+from api.schemas import HoldsAtBatchRequestBody, HoldsAtRequestArgs
 from api.validation import is_bson_id_valid, is_gym_valid, is_rating_valid, are_gym_and_section_valid
 
 from src.config import *
 from src import ticklist_handler
 from src.models import User
-from src.utils import load_data
+from src.utils import find_holds_at, load_data
+from werkzeug.wrappers.response import Response
 
 
 def process_get_gyms_request(db):
-    return jsonify(dict(gyms=db_controller.get_gyms(db))), 200
+    return make_api_response(dict(gyms=db_controller.get_gyms(db))), 200
 
 
 def process_get_gym_walls_request(request, db, gym_id):
     valid, errors = is_gym_valid(gym_id, db)
     if not valid:
-        return jsonify(errors=errors), 404
+        return make_api_response(errors=errors), 404
     latest = request.args.get('latest', False)
-    return jsonify(dict(walls=db_controller.get_gym_walls(gym_id, db, latest=latest))), 200
+    return make_api_response(dict(walls=db_controller.get_gym_walls(gym_id, db, latest=latest))), 200
 
 
 def process_get_gym_pretty_name(db, gym_id):
     valid, errors = is_gym_valid(gym_id, db)
     if not valid:
-        return jsonify(errors=errors), 404
-    return jsonify(dict(name=db_controller.get_gym_pretty_name(gym_id, db))), 200
+        return make_api_response(errors=errors), 404
+    return make_api_response(dict(name=db_controller.get_gym_pretty_name(gym_id, db))), 200
 
 
 def process_get_gym_wall_name(db, gym_id, wall_section):
     valid, errors = are_gym_and_section_valid(gym_id, wall_section, db)
     if not valid:
-        return jsonify(dict(errors=errors)), 404
-    return jsonify(dict(name=db_controller.get_wall_name(gym_id, wall_section, db))), 200
+        return make_api_response(dict(errors=errors)), 404
+    return make_api_response(dict(name=db_controller.get_wall_name(gym_id, wall_section, db))), 200
 
 
-def process_get_gym_circuits_request(db, gym_id):
+def process_get_holds_at_request(request, db, gym_id, wall_section, static_folder):
+    valid, errors = are_gym_and_section_valid(gym_id, wall_section, db)
+    if not valid:
+        return make_api_response(dict(errors=errors)), 404
+    try:
+        # Will raise ValidationError if not valid
+        args = HoldsAtRequestArgs().load(request.args)
+    except ValidationError as err:
+        return make_api_response(dict(errors=err.normalized_messages())), 400
+    point = (args['x'], args['y'])
+    holds = find_holds_at(gym_id, wall_section, static_folder, [point])
+    if holds is None:
+        return make_api_response(dict(errors=dict(wall_section=f'Wall section {wall_section} has no hold data'))), 404
+    return make_api_response(dict(holds=holds[0])), 200
+
+
+def process_get_holds_at_batch_request(request, db, gym_id, wall_section, static_folder):
+    valid, errors = are_gym_and_section_valid(gym_id, wall_section, db)
+    if not valid:
+        return make_api_response(dict(errors=errors)), 404
+    try:
+        # Will raise ValidationError if not valid
+        points = HoldsAtBatchRequestBody().load(request.get_json(silent=True) or {})['points']
+    except ValidationError as err:
+        return make_api_response(dict(errors=err.normalized_messages())), 400
+    holds = find_holds_at(gym_id, wall_section, static_folder, points)
+    if holds is None:
+        return make_api_response(dict(errors=dict(wall_section=f'Wall section {wall_section} has no hold data'))), 404
+    return make_api_response(dict(points=[
+        dict(x=x, y=y, holds=point_holds) for (x, y), point_holds in zip(points, holds)
+    ])), 200
+
+
+def pack_page_response(key, page):
+    """
+    MessagePack response whose body is a page of a problem list. Arrays
+    are prefixed with their length, so unlike the JSON one the page is
+    sent once it has been read, but problems are still encoded as they
+    are read from the DDBB.
+    """
+    packer = get_packer()
+    items = [packer.pack(item) for item in page[ITEMS]]
+    body = [
+        packer.pack_map_header(2 if db_controller.NEXT_PAGE in page else 1),
+        packer.pack(key),
+        packer.pack_array_header(len(items)),
+        *items
+    ]
+    if db_controller.NEXT_PAGE in page:
+        body += [packer.pack(db_controller.NEXT_PAGE), packer.pack(page[db_controller.NEXT_PAGE])]
+    response = Response(b''.join(body), mimetype=MSGPACK_MIMETYPE)
+    response.vary.add('Accept')
+    return response
+
+
+def stream_page_response(key, page):
+    """
+    Response whose body is a page of a problem list. Problems are
+    encoded as they are read from the DDBB and sent in chunks of about
+    JSON_STREAM_CHUNK_SIZE characters, so the list is never built in
+    memory and the first bytes are sent before the last problem is read.
+    """
+    if get_mimetype() != JSON_MIMETYPE:
+        return pack_page_response(key, page)
+    encoder = current_app.json
+
+    def generate():
+        chunk = ['{', encoder.dumps(key), ':[']
+        size = 0
+        for index, item in enumerate(page[ITEMS]):
+            encoded = encoder.dumps(item)
+            chunk.append(f',{encoded}' if index else encoded)
+            size += len(encoded)
+            if size >= JSON_STREAM_CHUNK_SIZE:
+                yield ''.join(chunk)
+                chunk, size = [], 0
+        chunk.append(']')
+        # only known once the items have been read
+        if db_controller.NEXT_PAGE in page:
+            chunk += [',', encoder.dumps(db_controller.NEXT_PAGE), ':', encoder.dumps(page[db_controller.NEXT_PAGE])]
+        chunk.append('}\n')
+        yield ''.join(chunk)
+
+    # generate does not need the request context, which is gone by the time it runs
+    response = Response(generate(), mimetype=encoder.mimetype)
+    response.vary.add('Accept')
+    return response
+
+
+def process_get_gym_circuits_request(request, db, gym_id):
     valid, errors = is_gym_valid(gym_id, db)
     if not valid:
-        return jsonify(errors=errors), 404
-    return jsonify(dict(circuits=db_controller.get_circuits(gym_id, db).get(ITEMS, []))), 200
+        return make_api_response(errors=errors), 404
+    try:
+        page_args = CircuitListRequestArgs().load(request.args)
+    except ValidationError as err:
+        return make_api_response(dict(errors=err.normalized_messages())), 400
+    page = db_controller.iter_circuits_page(gym_id, db, **page_args)
+    return stream_page_response('circuits', page), 200
 
 def process_get_circuit_by_id_request(db, gym_id, circuit_id):
     valid, errors = is_gym_valid(gym_id, db)
     if not valid:
-        return jsonify(errors=errors), 404
+        return make_api_response(errors=errors), 404
 
     circuit = db_controller.get_circuit_by_id(gym_id, circuit_id, db)
     if not bool(circuit):
-        return jsonify(errors=dict(circuit_id=f'Circuit with id {circuit_id} not found on gym {gym_id}')), 404
+        return make_api_response(errors=dict(circuit_id=f'Circuit with id {circuit_id} not found on gym {gym_id}')), 404
 
-    return jsonify(dict(circuit=circuit)), 200
+    return make_api_response(dict(circuit=circuit)), 200
 
 
 def process_get_circuit_by_name_request(db, gym_id, circuit_name):
     valid, errors = is_gym_valid(gym_id, db)
     if not valid:
-        return jsonify(errors=errors), 404
+        return make_api_response(errors=errors), 404
 
     circuit = db_controller.get_circuit_by_name(gym_id, circuit_name, db)
     if not bool(circuit):
-        return jsonify(errors=dict(circuit_id=f'circuit with name {circuit_name} not found on gym {gym_id}')), 404
+        return make_api_response(errors=dict(circuit_id=f'circuit with name {circuit_name} not found on gym {gym_id}')), 404
 
-    return jsonify(dict(circuit=circuit)), 200
+    return make_api_response(dict(circuit=circuit)), 200
 
 
 def process_circuit_create_request(request, db, gym_id, wall_section):
     valid, errors = are_gym_and_section_valid(gym_id, wall_section, db)
     if not valid:
-        return jsonify(dict(errors=errors)), 404
+        return make_api_response(dict(errors=errors)), 404
 
     if request.method == 'POST':
         circuit_fields = BoulderFields()
@@ -96,46 +194,51 @@ def process_circuit_create_request(request, db, gym_id, wall_section):
           _ = CreateCircuitRequestValidator().load(base_data)
           resp = db_controller.put_circuit(base_data, gym=gym_id, database=db)
           if resp is None:
-              return jsonify(dict(errors=dict(message='Something went wrong creating the circuit'))), 500
-          return jsonify(dict(created=True, _id=resp)), 201
+              return make_api_response(dict(errors=dict(message='Something went wrong creating the circuit'))), 500
+          return make_api_response(dict(created=True, _id=resp)), 201
         except ValidationError as err:
-          return jsonify(dict(errors=err.normalized_messages())), 400
+          return make_api_response(dict(errors=err.normalized_messages())), 400
 
-def process_get_gym_boulders_request(db, gym_id):
+def process_get_gym_boulders_request(request, db, gym_id):
     valid, errors = is_gym_valid(gym_id, db)
     if not valid:
-        return jsonify(errors=errors), 404
-    return jsonify(dict(boulders=db_controller.get_boulders(gym_id, db).get(ITEMS, []))), 200
+        return make_api_response(errors=errors), 404
+    try:
+        page_args = BoulderListRequestArgs().load(request.args)
+    except ValidationError as err:
+        return make_api_response(dict(errors=err.normalized_messages())), 400
+    page = db_controller.iter_boulders_page(gym_id, db, **page_args)
+    return stream_page_response('boulders', page), 200
 
 
 def process_get_boulder_by_id_request(db, gym_id, boulder_id):
     valid, errors = is_gym_valid(gym_id, db)
     if not valid:
-        return jsonify(errors=errors), 404
+        return make_api_response(errors=errors), 404
 
     boulder = db_controller.get_boulder_by_id(gym_id, boulder_id, db)
     if not bool(boulder):
-        return jsonify(errors=dict(boulder_id=f'Boulder with id {boulder_id} not found on gym {gym_id}')), 404
+        return make_api_response(errors=dict(boulder_id=f'Boulder with id {boulder_id} not found on gym {gym_id}')), 404
 
-    return jsonify(dict(boulder=boulder)), 200
+    return make_api_response(dict(boulder=boulder)), 200
 
 
 def process_get_boulder_by_name_request(db, gym_id, boulder_name):
     valid, errors = is_gym_valid(gym_id, db)
     if not valid:
-        return jsonify(errors=errors), 404
+        return make_api_response(errors=errors), 404
 
     boulder = db_controller.get_boulder_by_name(gym_id, boulder_name, db)
     if not bool(boulder):
-        return jsonify(errors=dict(boulder_id=f'Boulder with name {boulder_name} not found on gym {gym_id}')), 404
+        return make_api_response(errors=dict(boulder_id=f'Boulder with name {boulder_name} not found on gym {gym_id}')), 404
 
-    return jsonify(dict(boulder=boulder)), 200
+    return make_api_response(dict(boulder=boulder)), 200
 
 
 def process_boulder_create_request(request, db, gym_id, wall_section):
     valid, errors = are_gym_and_section_valid(gym_id, wall_section, db)
     if not valid:
-        return jsonify(dict(errors=errors)), 404
+        return make_api_response(dict(errors=errors)), 404
 
     if request.method == 'POST':
         boulder_fields = BoulderFields()
@@ -159,51 +262,95 @@ def process_boulder_create_request(request, db, gym_id, wall_section):
           _ = CreateBoulderRequestValidator().load(base_data)
           resp = db_controller.put_boulder(base_data, gym=gym_id, database=db)
           if resp is None:
-              return jsonify(dict(errors=dict(message='Something went wrong creating the boulder'))), 500
-          return jsonify(dict(created=True, _id=resp)), 201
+              return make_api_response(dict(errors=dict(message='Something went wrong creating the boulder'))), 500
+          return make_api_response(dict(created=True, _id=resp)), 201
+        except ValidationError as err:
+          return make_api_response(dict(errors=err.normalized_messages())), 400
+
+
+def process_boulder_batch_create_request(request, db, gym_id, wall_section):
+    valid, errors = are_gym_and_section_valid(gym_id, wall_section, db)
+    if not valid:
+        return make_api_response(dict(errors=errors)), 404
+    try:
+        boulders = CreateBoulderBatchRequestValidator().load(request.get_json(silent=True) or {})['boulders']
+    except ValidationError as err:
+        return make_api_response(dict(errors=err.normalized_messages())), 400
+
+    boulder_fields = BoulderFields()
+    validator = CreateBoulderRequestValidator()
+    now = datetime.datetime.now().isoformat()
+    results = [None] * len(boulders)
+    valid_indexes, valid_boulders = [], []
+    for index, request_data in enumerate(boulders):
+        base_data = {
+            boulder_fields.rating: 0,
+            boulder_fields.raters: 0,
+            boulder_fields.section: wall_section,
+            boulder_fields.time: now}
+        for key, val in request_data.items():
+            base_data[key.lower()] = val
+        try:
+            validator.load(base_data)
         except ValidationError as err:
-          return jsonify(dict(errors=err.normalized_messages())), 400
+            results[index] = dict(index=index, created=False, errors=err.normalized_messages())
+            continue
+        valid_indexes.append(index)
+        valid_boulders.append(base_data)
+
+    if valid_boulders:
+        stored = db_controller.put_boulders(valid_boulders, gym=gym_id, database=db)
+        for index, (boulder_id, error) in zip(valid_indexes, stored):
+            if boulder_id is None:
+                results[index] = dict(index=index, created=False, errors=dict(message=error))
+            else:
+                results[index] = dict(index=index, created=True, _id=boulder_id)
+
+    created = sum(result['created'] for result in results)
+    if created == len(results):
+        status = 201
+    elif created:
+        status = 207
+    elif valid_boulders:
+        # valid boulders could not be stored
+        status = 500
+    else:
+        status = 400
+    return make_api_response(dict(created=created, results=results)), status
 
 
 def process_rate_boulder_request(request, db, gym_id, boulder_id):
     valid, errors = is_gym_valid(gym_id, db)
     if not valid:
-        return jsonify(errors=errors), 404
+        return make_api_response(errors=errors), 404
 
     if request.method == 'POST':
         data, _ = load_data(request)
         # validate gym
         valid, errors = is_gym_valid(gym_id, db)
         if not valid:
-            return jsonify(dict(errors=errors)), 404
+            return make_api_response(dict(errors=errors)), 404
         # validate rating
         valid, errors = is_rating_valid(data.get('rating', ''))
         if not valid:
-            return jsonify(dict(errors=errors)), 400
+            return make_api_response(dict(errors=errors)), 400
         # validate id
         valid, errors = is_bson_id_valid(boulder_id)
         if not valid:
-            return jsonify(dict(errors=errors)), 400
+            return make_api_response(dict(errors=errors)), 400
 
-        boulder = db_controller.get_boulder_by_id(gym_id, boulder_id, db)
-
-        if not bool(boulder):  # boulder is empty -> it wasn't found
-            return jsonify(dict(errors={'boulder_id': f'Boulder with id {boulder_id} not found'})), 404
-
-        # rate boulder, update stats
-        boulder['rating'] = (boulder['rating'] * boulder['raters'] +
-                             int(data.get('rating'))) / (boulder['raters'] + 1)
-        boulder['raters'] += 1
-
-        db_controller.update_boulder_by_id(
+        result = db_controller.rate_boulder_by_id(
             gym=gym_id,
             boulder_id=boulder_id,
-            boulder_data=boulder,
+            rating=data.get('rating'),
             database=db
         )
 
-        return jsonify(dict(rated=True, _id=boulder_id)), 200
-    return jsonify(dict(errors={'method': 'Invalid HTTP method. This endpoint only accepts POST requests'})), 400
+        if result.matched_count == 0:  # boulder wasn't found
+            return make_api_response(dict(errors={'boulder_id': f'Boulder with id {boulder_id} not found'})), 404
+
+        return make_api_response(dict(rated=True, _id=boulder_id)), 200
+    return make_api_response(dict(errors={'method': 'Invalid HTTP method. This endpoint only accepts POST requests'})), 400
 
 
 def process_new_user_request(request, db):
@@ -218,16 +365,16 @@ def process_new_user_request(request, db):
         'email': 'Email is required'
     }
     if username is None or password is None or email is None:
-        return jsonify(dict(errors={key: errors[key] for key in errors.keys() if data.get(key, None) is None})), 400
+        return make_api_response(dict(errors={key: errors[key] for key in errors.keys() if data.get(key, None) is None})), 400
     if User.get_user_by_username(username, db) is not None:
-        return jsonify(dict(errors={'username': f'Username {username} already exists'})), 400
+        return make_api_response(dict(errors={'username': f'Username {username} already exists'})), 400
     if User.get_user_by_email(email, db) is not None:
-        return jsonify(dict(errors={'email': f'Email {email} already exists'})), 400
+        return make_api_response(dict(errors={'email': f'Email {email} already exists'})), 400
     # Create and save user
     user = User(name=username, email=email)
     user.set_password(password)
     user.save(db)
-    return jsonify({'username': user.name}), 201
+    return make_api_response({'username': user.name}), 201
 
 
 def process_get_auth_token_request(request, db, current_app):
@@ -242,8 +389,8 @@ def process_get_auth_token_request(request, db, current_app):
       user = User.get_user_by_email(email, db)
     if user is not None and user.check_password(password):
         token = user.generate_auth_token(current_app)
-        return jsonify(dict(token=token.decode('ascii'))), 200
-    return jsonify(dict(errors={'message': 'Authentication error. Invalid credentials'})), 400
+        return make_api_response(dict(token=token)), 200
+    return make_api_response(dict(errors={'message': 'Authentication error. Invalid credentials'})), 400
 
 
 def process_mark_boulder_as_done_request(request, db, user):
@@ -257,40 +404,38 @@ def process_mark_boulder_as_done_request(request, db, user):
       if not data.get('gym', ''):
         errors['gym'] = 'Gym is required'
       if bool(errors):
-          return jsonify(dict(errors=errors)), 400
+          return make_api_response(dict(errors=errors)), 400
 
       valid, errors = is_gym_valid(data.get('gym', ''), db)
       if not valid:
-        return jsonify(errors=errors), 404
+        return make_api_response(errors=errors), 404
 
       db_boulder = db_controller.get_boulder_by_id(
           data.get('gym'), data.get('boulder_id'), db)
 
       if not bool(db_boulder):
-          return jsonify(
+          return make_api_response(
               dict(
                   errors=dict(
                       boulder_id=f'Boulder {data.get("boulder_id")} for gym {data.get("gym")} not found'
                   ))), 404
 
       db_boulder['iden'] = db_boulder.pop('_id')
+      db_boulder['gym'] = data.get('gym')
       db_boulder['is_done'] = True
 
       # adds the boulder, it doesn't check if it exists
-      updated_ticklist = db_controller.put_boulder_in_ticklist(
+      updated_boulder = db_controller.put_boulder_in_ticklist(
           db_boulder,
           user.id,
           db,
           mark_as_done_clicked=True
       )
 
-      updated_boulder = [
-          b for b in updated_ticklist if b['iden'] == db_boulder['iden']]
-
-      if updated_boulder and updated_boulder[0]['is_done']:
-          return jsonify(dict(boulder_id=db_boulder.get('iden'), marked_as_done=True)), 200
+      if updated_boulder and updated_boulder['is_done']:
+          return make_api_response(dict(boulder_id=db_boulder.get('iden'), marked_as_done=True)), 200
       else:
-          return jsonify(dict(errors=dict(boulder_id=f'Could not update boulder with id {data.get("boulder_id")}'))), 500
+          return make_api_response(dict(errors=dict(boulder_id=f'Could not update boulder with id {data.get("boulder_id")}'))), 500
 
 
 def process_get_user_ticklist_request(db, user):
@@ -299,12 +444,12 @@ def process_get_user_ticklist_request(db, user):
     # while processing the request
     ticklist_boulders, _ = ticklist_handler.load_user_ticklist(
         user, db)
-    return jsonify(dict(boulders=ticklist_boulders)), 200
+    return make_api_response(dict(boulders=ticklist_boulders)), 200
 
 
 def process_test_auth_request(user):
-    return jsonify(dict(data=f'Hello {user.name}')), 200
+    return make_api_response(dict(data=f'Hello {user.name}')), 200
 
 
 def process_get_user_preferences_request(user):
-    return jsonify(user.preferences.serialize(ignore_keys=('_id', 'user_id'))), 200
+    return make_api_response(user.preferences.serialize(ignore_keys=('_id', 'user_id'))), 200
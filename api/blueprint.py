@@ -6,6 +6,7 @@ from src.models import User
 from src.config import *
 
 import api.api_request_processor as api_request_processor
+from api.conditional import conditional, get_boulders_version, get_circuits_version
 
 API_VERSION = 'v1'
 
@@ -40,9 +41,9 @@ def verify_token(token: str) -> bool:
 @api_blueprint.before_request
 def open_database_connection():
     """
-    Open a new database connection before processing the request and store 
+    Get the pooled database handle before processing the request and store
     it in the global request g object so that it can be accessed from within
-    the request
+    the request. No connection is opened or closed per request.
     """
     g.db = get_db_connection()
 
@@ -56,6 +57,7 @@ def api_docs() -> Response:
 
 
 @api_blueprint.route('/gym/list', methods=['GET'])
+@conditional()
 def get_gyms() -> Response:
     """Gym list.
     ---
@@ -73,6 +75,9 @@ def get_gyms() -> Response:
               schema: GymListSchema
             text/json:
               schema: GymListSchema
+        304:
+          description:
+            Not modified
         400:
           description:
             Bad request
@@ -101,6 +106,7 @@ def get_gyms() -> Response:
 
 
 @api_blueprint.route('/gym/<string:gym_id>/walls', methods=['GET'])
+@conditional()
 def get_gym_walls(gym_id: str) -> Response:
     """Walls associated to the given gym.
     ---
@@ -126,6 +132,9 @@ def get_gym_walls(gym_id: str) -> Response:
               schema: WallListSchema
             text/json:
               schema: WallListSchema
+        304:
+          description:
+            Not modified
         400:
           description:
             Bad request
@@ -154,6 +163,7 @@ def get_gym_walls(gym_id: str) -> Response:
 
 
 @api_blueprint.route('/gym/<string:gym_id>/name', methods=['GET'])
+@conditional()
 def get_gym_pretty_name(gym_id: str) -> Response:
     """Given a gym id get its display name
     ---
@@ -174,6 +184,9 @@ def get_gym_pretty_name(gym_id: str) -> Response:
               schema: GymNameSchema
             text/json:
               schema: GymNameSchema
+        304:
+          description:
+            Not modified
         400:
           description:
             Bad request
@@ -202,6 +215,7 @@ def get_gym_pretty_name(gym_id: str) -> Response:
 
 
 @api_blueprint.route('/gym/<string:gym_id>/<string:wall_section>/name', methods=['GET'])
+@conditional()
 def get_gym_wall_name(gym_id: str, wall_section: str) -> Response:
     """Get a wall name given the gym and the section
     ---
@@ -224,6 +238,9 @@ def get_gym_wall_name(gym_id: str, wall_section: str) -> Response:
               schema: WallNameSchema
             text/json:
               schema: WallNameSchema
+        304:
+          description:
+            Not modified
         400:
           description:
             Bad request
@@ -250,16 +267,140 @@ def get_gym_wall_name(gym_id: str, wall_section: str) -> Response:
     """
     return api_request_processor.process_get_gym_wall_name(g.db, gym_id, wall_section)
 
+
+@api_blueprint.route('/gym/<string:gym_id>/<string:wall_section>/holds/at', methods=['GET'])
+def get_holds_at(gym_id: str, wall_section: str) -> Response:
+    """Find the holds of a wall at a point
+    ---
+    get:
+      tags:
+        - Gyms
+      description:
+        Coordinates are in pixels of the wall image at its natural size
+      parameters:
+      - in: path
+        schema: GymIDParameter
+      - in: path
+        schema: WallSectionParameter
+      - in: query
+        schema: PointXParameter
+      - in: query
+        schema: PointYParameter
+      responses:
+        200:
+          description:
+            Holds whose polygon contains the point
+          content:
+            application/json:
+              schema: HoldsAtResponseBody
+            text/plain:
+              schema: HoldsAtResponseBody
+            text/json:
+              schema: HoldsAtResponseBody
+        400:
+          description:
+            Bad request
+          content:
+            application/json:
+              schema: ErrorResponse
+            text/plain:
+              schema: ErrorResponse
+            text/json:
+              schema: ErrorResponse
+        404:
+          description:
+            Not found
+          content:
+            application/json:
+              schema: ErrorResponse
+            text/plain:
+              schema: ErrorResponse
+            text/json:
+              schema: ErrorResponse
+        500:
+          description:
+            Server Error
+    """
+    return api_request_processor.process_get_holds_at_request(
+        request, g.db, gym_id, wall_section, current_app.static_folder)
+
+
+@api_blueprint.route('/gym/<string:gym_id>/<string:wall_section>/holds/at', methods=['POST'])
+def get_holds_at_batch(gym_id: str, wall_section: str) -> Response:
+    """Find the holds of a wall at several points
+    ---
+    post:
+      tags:
+        - Gyms
+      description:
+        Coordinates are in pixels of the wall image at its natural size
+      parameters:
+      - in: path
+        schema: GymIDParameter
+      - in: path
+        schema: WallSectionParameter
+      requestBody:
+        description: Points to look up
+        required: true
+        content:
+          application/json:
+            schema: HoldsAtBatchRequestBody
+      responses:
+        200:
+          description:
+            Holds whose polygon contains each point, in the same order as the request
+          content:
+            application/json:
+              schema: HoldsAtBatchResponseBody
+            text/plain:
+              schema: HoldsAtBatchResponseBody
+            text/json:
+              schema: HoldsAtBatchResponseBody
+        400:
+          description:
+            Bad request
+          content:
+            application/json:
+              schema: ErrorResponse
+            text/plain:
+              schema: ErrorResponse
+            text/json:
+              schema: ErrorResponse
+        404:
+          description:
+            Not found
+          content:
+            application/json:
+              schema: ErrorResponse
+            text/plain:
+              schema: ErrorResponse
+            text/json:
+              schema: ErrorResponse
+        500:
+          description:
+            Server Error
+    """
+    return api_request_processor.process_get_holds_at_batch_request(
+        request, g.db, gym_id, wall_section, current_app.static_folder)
+
 @api_blueprint.route('/circuits/<string:gym_id>/list', methods=['GET'])
+@conditional(get_circuits_version)
 def get_gym_circuits(gym_id: str) -> Response:
     """Circuits associated to the given gym.
     ---
     get:
       tags:
         - Circuits
+      description:
+        Circuits are listed in creation order. Pass a limit to get them
+        by pages, and the next cursor of each page as the after parameter
+        of the following request. Use fields or summary to leave out the
+        fields that are not needed, such as the holds.
       parameters:
       - in: path
         schema: GymIDParameter
+      - in: query
+        schema: CircuitListRequestArgs
       responses:
         200:
           description:
@@ -271,6 +412,9 @@ def get_gym_circuits(gym_id: str) -> Response:
               schema: GymCircuitListSchema
             text/json:
               schema: GymCircuitListSchema
+        304:
+          description:
+            Not modified
         400:
           description:
             Bad request
@@ -295,9 +439,10 @@ def get_gym_circuits(gym_id: str) -> Response:
           description:
             Server Error
     """
-    return api_request_processor.process_get_gym_circuits_request(g.db, gym_id)
+    return api_request_processor.process_get_gym_circuits_request(request, g.db, gym_id)
 
 @api_blueprint.route('/circuits/<string:gym_id>/<string:circuit_id>', methods=['GET'])
+@conditional(get_circuits_version)
 def get_circuit_by_id(gym_id: str, circuit_id: str) -> Response:
     """Get circuit by id.
     ---
@@ -320,6 +465,9 @@ def get_circuit_by_id(gym_id: str, circuit_id: str) -> Response:
               schema: CircuitSchema
             text/json:
               schema: CircuitSchema
+        304:
+          description:
+            Not modified
         400:
           description:
             Bad request
@@ -348,6 +496,7 @@ def get_circuit_by_id(gym_id: str, circuit_id: str) -> Response:
 
 
 @api_blueprint.route('/circuits/<string:gym_id>/name/<string:circuit_name>', methods=['GET'])
+@conditional(get_circuits_version)
 def get_circuit_by_name(gym_id: str, circuit_name: str) -> Response:
     """Get circuit by name.
     ---
@@ -370,6 +519,9 @@ def get_circuit_by_name(gym_id: str, circuit_name: str) -> Response:
               schema: CircuitSchema
             text/json:
               schema: CircuitSchema
+        304:
+          description:
+            Not modified
         400:
           description:
             Bad request
@@ -459,15 +611,23 @@ def circuit_create(gym_id: str, wall_section: str) -> Response:
     return api_request_processor.process_circuit_create_request(request, g.db, gym_id, wall_section)
 
 @api_blueprint.route('/boulders/<string:gym_id>/list', methods=['GET'])
+@conditional(get_boulders_version)
 def get_gym_boulders(gym_id: str) -> Response:
     """Boulders associated to the given gym.
     ---
     get:
       tags:
         - Boulders
+      description:
+        Boulders are listed in creation order. Pass a limit to get them
+        by pages, and the next cursor of each page as the after parameter
+        of the following request. Use fields or summary to leave out the
+        fields that are not needed, such as the holds.
       parameters:
       - in: path
         schema: GymIDParameter
+      - in: query
+        schema: BoulderListRequestArgs
       responses:
         200:
           description:
@@ -479,6 +639,9 @@ def get_gym_boulders(gym_id: str) -> Response:
               schema: GymBoulderListSchema
             text/json:
               schema: GymBoulderListSchema
+        304:
+          description:
+            Not modified
         400:
           description:
             Bad request
@@ -503,10 +666,11 @@ def get_gym_boulders(gym_id: str) -> Response:
           description:
             Server Error
     """
-    return api_request_processor.process_get_gym_boulders_request(g.db, gym_id)
+    return api_request_processor.process_get_gym_boulders_request(request, g.db, gym_id)
 
 
 @api_blueprint.route('/boulders/<string:gym_id>/<string:boulder_id>', methods=['GET'])
+@conditional(get_boulders_version)
 def get_boulder_by_id(gym_id: str, boulder_id: str) -> Response:
     """Get boulder by id.
     ---
@@ -529,6 +693,9 @@ def get_boulder_by_id(gym_id: str, boulder_id: str) -> Response:
               schema: BoulderSchema
             text/json:
               schema: BoulderSchema
+        304:
+          description:
+            Not modified
         400:
           description:
             Bad request
@@ -557,6 +724,7 @@ def get_boulder_by_id(gym_id: str, boulder_id: str) -> Response:
 
 
 @api_blueprint.route('/boulders/<string:gym_id>/name/<string:boulder_name>', methods=['GET'])
+@conditional(get_boulders_version)
 def get_boulder_by_name(gym_id: str, boulder_name: str) -> Response:
     """Get boulder by name.
     ---
@@ -579,6 +747,9 @@ def get_boulder_by_name(gym_id: str, boulder_name: str) -> Response:
               schema: BoulderSchema
             text/json:
               schema: BoulderSchema
+        304:
+          description:
+            Not modified
         400:
           description:
             Bad request
@@ -668,6 +839,63 @@ def boulder_create(gym_id: str, wall_section: str) -> Response:
     return api_request_processor.process_boulder_create_request(request, g.db, gym_id, wall_section)
 
 
+@api_blueprint.route('/boulders/<string:gym_id>/<string:wall_section>/create/batch', methods=['POST'])
+def boulder_batch_create(gym_id: str, wall_section: str) -> Response:
+    """Create several boulders linked to the given gym and wall section
+    ---
+    post:
+      tags:
+        - Boulders
+      description:
+        Each boulder is validated and created on its own, so some of them
+        may be created even if others are not
+      parameters:
+      - in: path
+        schema: GymIDParameter
+      - in: path
+        schema: WallSectionParameter
+      requestBody:
+        description: Boulders to create
+        required: true
+        content:
+          application/json:
+            schema: CreateBoulderBatchRequestBody
+      responses:
+        201:
+          description:
+            All the boulders were created
+          content:
+            application/json:
+              schema: CreateBoulderBatchResponseBody
+        207:
+          description:
+            Some of the boulders were created. See the result of each one
+          content:
+            application/json:
+              schema: CreateBoulderBatchResponseBody
+        400:
+          description:
+            Bad request, or none of the boulders was valid
+          content:
+            application/json:
+              schema: CreateBoulderBatchResponseBody
+        404:
+          description:
+            Not found
+          content:
+            application/json:
+              schema: ErrorResponse
+            text/plain:
+              schema: ErrorResponse
+            text/json:
+              schema: ErrorResponse
+        500:
+          description:
+            Server Error
+    """
+    return api_request_processor.process_boulder_batch_create_request(request, g.db, gym_id, wall_section)
+
+
 @api_blueprint.route('/boulders/<string:gym_id>/<string:boulder_id>/rate', methods=['POST'])
 def rate_boulder(gym_id: str, boulder_id: str) -> Response:
     """Rate a boulder problem
@@ -0,0 +1,96 @@
+import functools
+import hashlib
+from typing import Callable, Optional
+
+from flask import g, make_response, request
+from werkzeug.wrappers.response import Response
+
+import db.mongodb_controller as db_controller
+from api.encoding import get_mimetype
+from db import catalog as gym_catalog
+from src.compression import get_etag_variants
+from src.config import *
+
+
+def get_boulders_version(gym_id: str, **kwargs) -> str:
+    """
+    Version of the boulders of a gym. The catalog version is part
+    of it, as the response depends on the gym being listed.
+    """
+    return '{}-{}'.format(
+        gym_catalog.get_catalog(g.db).version,
+        db_controller.get_problems_version(gym_id, 'boulders', g.db)
+    )
+
+
+def get_circuits_version(gym_id: str, **kwargs) -> str:
+    """
+    Version of the circuits of a gym, see get_boulders_version
+    """
+    return '{}-{}'.format(
+        gym_catalog.get_catalog(g.db).version,
+        db_controller.get_problems_version(gym_id, 'circuits', g.db)
+    )
+
+
+def get_etag(version: str) -> str:
+    """
+    Strong ETag of the response to the current request given the
+    version of the data it is built from. It depends on the encoding
+    of the response as well.
+    """
+    return hashlib.sha1(f'{version} {get_mimetype()} {request.full_path}'.encode()).hexdigest()
+
+
+def get_not_modified_response(etag: str, cache_control: str) -> Optional[Response]:
+    """
+    Get a 304 response if the client already has the response with the
+    given ETag, in any of the content codings it may have been sent with
+    """
+    for variant in get_etag_variants(etag):
+        if request.if_none_match.contains(variant):
+            response = Response(status=304)
+            response.set_etag(variant)
+            response.headers['Cache-Control'] = cache_control
+            response.vary.add('Accept')
+            return response
+    return None
+
+
+def conditional(get_version: Optional[Callable[..., str]] = None) -> Callable:
+    """
+    Make a read-only view answer conditional GET requests and set
+    its Cache-Control header from API_CACHE_CONTROL.
+
+    When get_version is given, it is called with the view arguments
+    and the ETag is computed from the version it returns, so that a
+    request with a matching If-None-Match is answered with a 304
+    without running the view. Otherwise the ETag is the digest of the
+    response body, which saves sending it but not building it, so
+    that is only meant for views served from memory.
+    """
+    def decorator(view: Callable) -> Callable:
+        cache_control = API_CACHE_CONTROL.get(view.__name__, DEFAULT_API_CACHE_CONTROL)
+
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs) -> Response:
+            etag = get_etag(get_version(**kwargs)) if get_version is not None else None
+            if etag is not None:
+                not_modified = get_not_modified_response(etag, cache_control)
+                if not_modified is not None:
+                    return not_modified
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+            if etag is None:
+                response.add_etag()
+                etag, _ = response.get_etag()
+                not_modified = get_not_modified_response(etag, cache_control)
+                if not_modified is not None:
+                    return not_modified
+            else:
+                response.set_etag(etag)
+            response.headers['Cache-Control'] = cache_control
+            return response
+        return wrapper
+    return decorator
@@ -1,9 +1,11 @@
-from src.config import PORT, DOCKER_ENV
+from src.config import PORT, DOCKER_ENV, HOLDS_AT_MAX_POINTS, LIST_MAX_PAGE_SIZE
+from src.config import BOULDER_BATCH_MAX_SIZE, BOULDER_DIFFICULTY_MAP
 
 from apispec import APISpec
 from apispec.ext.marshmallow import MarshmallowPlugin
 from apispec_webframeworks.flask import FlaskPlugin
-from marshmallow import Schema, fields
+from bson.objectid import ObjectId
+from marshmallow import EXCLUDE, Schema, ValidationError, fields, post_load, validate, validates
 
 
 host = 'http://localhost:'
@@ -80,6 +82,7 @@ class BoulderSchema(BaseBoulderSchema):
     _id = fields.Str()
     raters = fields.Int()
     rating = fields.Float()
+    repetitions = fields.Int()
     section = fields.Str()
 
 
@@ -111,6 +114,7 @@ class CreateBoulderRequestValidator(BaseBoulderSchema):
     """
     Data Schema to validate a create boulder request
     """
+    difficulty = fields.Str(required=True, validate=validate.OneOf(BOULDER_DIFFICULTY_MAP.values()))
     raters = fields.Int(required=True)
     rating = fields.Float(required=True)
     section = fields.Str(required=True)
@@ -137,6 +141,45 @@ class CreateBoulderResponseBody(Schema):
     _id = fields.Str()
 
 
+class CreateBoulderBatchRequestBody(Schema):
+    """
+    Data Schema to create several boulders at once
+    """
+    boulders = fields.List(fields.Nested(CreateBoulderRequestBody), required=True)
+
+
+class CreateBoulderBatchRequestValidator(Schema):
+    """
+    Data Schema to validate a create boulder batch request. Each
+    boulder is validated on its own, so that the valid ones can
+    be created even if others are not.
+    """
+    boulders = fields.List(
+        fields.Dict(),
+        required=True,
+        validate=validate.Length(min=1, max=BOULDER_BATCH_MAX_SIZE)
+    )
+
+
+class CreateBoulderResultSchema(Schema):
+    """
+    Data schema of the result of creating one of the boulders of a batch
+    """
+    index = fields.Int()
+    created = fields.Bool()
+    _id = fields.Str()
+    errors = fields.Dict()
+
+
+class CreateBoulderBatchResponseBody(Schema):
+    """
+    Data schema of the response to a create boulder batch request,
+    with the results in the same order as the request boulders
+    """
+    created = fields.Int()
+    results = fields.List(fields.Nested(CreateBoulderResultSchema))
+
+
 class CreateCircuitResponseBody(Schema):
     """
     Data schema of the response to a successful create circuit request
@@ -266,6 +309,20 @@ class WallSectionParameter(Schema):
     wall_section = fields.Str()
 
 
+class PointXParameter(Schema):
+    """
+    Data Schema of the x coordinate of a point of a wall image
+    """
+    x = fields.Float(required=True)
+
+
+class PointYParameter(Schema):
+    """
+    Data Schema of the y coordinate of a point of a wall image
+    """
+    y = fields.Float(required=True)
+
+
 class GymListSchema(Schema):
     """
     Gym List Data Schema
@@ -280,11 +337,72 @@ class WallListSchema(Schema):
     walls = fields.List(fields.Nested(WallSchema))
 
 
+class ProblemListRequestArgs(Schema):
+    """
+    Query parameters of the problem lists: pagination, fields
+    to return and summary mode (no holds)
+    """
+    class Meta:
+        unknown = EXCLUDE
+
+    # schema of the listed problems, whose fields can be selected
+    problem_schema = BoulderSchema
+
+    limit = fields.Int(
+        validate=validate.Range(min=1, max=LIST_MAX_PAGE_SIZE),
+        metadata={'description': 'Maximum number of problems to return'}
+    )
+    after = fields.Str(
+        metadata={'description': 'Return the problems after this one, given the next cursor of the previous page'}
+    )
+    projection = fields.Str(
+        data_key='fields',
+        metadata={'description': 'Comma-separated problem fields to return. The id is always returned'}
+    )
+    summary = fields.Bool(
+        load_default=False,
+        metadata={'description': 'Leave the holds out'}
+    )
+
+    @validates('after')
+    def validate_after(self, value, **kwargs):
+        if not ObjectId.is_valid(value):
+            raise ValidationError(f'Invalid cursor: {value}')
+
+    @validates('projection')
+    def validate_projection(self, value, **kwargs):
+        known = self.problem_schema().fields
+        unknown = [field for field in value.split(',') if field.strip() not in known]
+        if unknown:
+            raise ValidationError(f'Unknown fields: {", ".join(unknown)}')
+
+    @post_load
+    def split_projection(self, data, **kwargs):
+        if 'projection' in data:
+            data['projection'] = [field.strip() for field in data['projection'].split(',')]
+        return data
+
+
+class BoulderListRequestArgs(ProblemListRequestArgs):
+    """
+    Query parameters of the boulder list
+    """
+    problem_schema = BoulderSchema
+
+
+class CircuitListRequestArgs(ProblemListRequestArgs):
+    """
+    Query parameters of the circuit list
+    """
+    problem_schema = CircuitSchema
+
+
 class GymBoulderListSchema(Schema):
     """
     Boulder List Data Schema
     """
     boulders = fields.List(fields.Nested(BoulderSchema))
+    next = fields.Str(metadata={'description': 'Cursor of the next page, if there is one'})
 
 
 class GymCircuitListSchema(Schema):
@@ -292,6 +410,7 @@ class GymCircuitListSchema(Schema):
     Circuit List Data Schema
     """
     circuits = fields.List(fields.Nested(BoulderSchema))
+    next = fields.Str(metadata={'description': 'Cursor of the next page, if there is one'})
 
 
 class TicklistBoulderSchema(BoulderSchema):
@@ -309,6 +428,61 @@ class TicklistResponseBody(Schema):
     boulders = fields.List(fields.Nested(TicklistBoulderSchema))
 
 
+class HoldPolygonSchema(Schema):
+    """
+    Data schema of a hold polygon of a wall, in pixels of the wall image
+    """
+    index = fields.Int()
+    polygon = fields.List(fields.List(fields.Int()))
+
+
+class HoldsAtResponseBody(Schema):
+    """
+    Data schema of the holds found at a point of a wall
+    """
+    holds = fields.List(fields.Nested(HoldPolygonSchema))
+
+
+class HoldsAtRequestArgs(Schema):
+    """
+    Query parameters to find the holds at a point of a wall,
+    in pixels of the wall image
+    """
+    class Meta:
+        unknown = EXCLUDE
+
+    x = fields.Float(required=True, allow_nan=False)
+    y = fields.Float(required=True, allow_nan=False)
+
+
+class HoldsAtBatchRequestBody(Schema):
+    """
+    Data schema to find the holds at several points of a wall,
+    given as [x, y] pairs in pixels of the wall image
+    """
+    points = fields.List(
+        fields.List(fields.Float(), validate=validate.Length(equal=2)),
+        required=True,
+        validate=validate.Length(min=1, max=HOLDS_AT_MAX_POINTS)
+    )
+
+
+class PointHoldsSchema(Schema):
+    """
+    Data schema of the holds found at one of the points of a batch
+    """
+    x = fields.Float()
+    y = fields.Float()
+    holds = fields.List(fields.Nested(HoldPolygonSchema))
+
+
+class HoldsAtBatchResponseBody(Schema):
+    """
+    Data schema of the holds found at several points of a wall
+    """
+    points = fields.List(fields.Nested(PointHoldsSchema))
+
+
 class ErrorResponse(Schema):
     """
     Base error response data schema
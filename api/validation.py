@@ -1,7 +1,8 @@
 
 from typing import List, Tuple
 from pymongo.database import Database
-from db.mongodb_controller import get_gyms, get_gym_walls
+from db import catalog as gym_catalog
+from db import wall_index
 import bson
 
 
@@ -12,7 +13,7 @@ def is_gym_valid(gym_id: str, db: Database) -> Tuple[bool, dict]:
     """
     if not gym_id:
         return False, dict(gym_id=f'Gym id is required')
-    if not gym_id in [gym.get('id', '') for gym in get_gyms(db)]:
+    if gym_catalog.get_gym(gym_id, db) is None:
         return False, dict(gym_id=f'Gym {gym_id} not found')
     return True, dict()
 
@@ -24,7 +25,7 @@ def is_section_valid(gym_id: str, wall_section: str, db: Database) -> Tuple[bool
     """
     if not wall_section:
         return False, dict(wall_section=f'Wall section is required')        
-    if not wall_section in [wall.get('image', '') for wall in get_gym_walls(gym_id, db)]:
+    if wall_index.get_wall(gym_id, wall_section, db) is None:
         return False, dict(wall_section=f'Wall section {wall_section} not found')
     return True, dict()
 
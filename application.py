@@ -1,9 +1,13 @@
+import contextvars
 import glob
+import hmac
 import json
 import os
+import time
 from typing import NoReturn, Union
 
-from flask import Flask, g, render_template, request, send_from_directory, session
+from flask import Flask, abort, g, jsonify, render_template, request, send_from_directory, session
+from flask import before_render_template, template_rendered
 from flask_caching import Cache
 from flask_cors import CORS
 from flask_login import (
@@ -14,11 +18,16 @@ from flask_login import (
     logout_user,
 )
 from flask_swagger_ui import get_swaggerui_blueprint
+from pymongo.errors import PyMongoError
 from werkzeug.wrappers.response import Response
 
 import db.mongodb_controller as db_controller
+from db import indexes
+from db import instrumentation
 import src.request_processor as request_processor
 import src.utils as utils
+from src import metrics
+from src.compression import compress_response
 from api.blueprint import api_blueprint
 from src.config import *
 from src.generate_open_api_spec import generate_api_docs
@@ -41,30 +50,128 @@ app.secret_key = b"\xf7\x81Q\x89}\x02\xff\x98<et^"
 cache = Cache(app, config={"CACHE_TYPE": "simple"})
 login_manager = LoginManager(app)
 login_manager.login_view = "login"
+app.logger.setLevel(LOG_LEVEL)
+
+REQUEST_DURATION = metrics.Histogram(
+    "rocolib_request_duration_seconds",
+    "Duration of the requests until their response is sent, by endpoint and route",
+    ("endpoint", "route", "method"),
+)
+REQUESTS = metrics.Counter(
+    "rocolib_requests_total", "Finished requests, by endpoint and status", ("endpoint", "method", "status")
+)
+REQUESTS_IN_PROGRESS = metrics.Gauge(
+    "rocolib_worker_requests_in_progress", "Requests being handled by the worker"
+)
+TEMPLATE_RENDER_DURATION = metrics.Histogram(
+    "rocolib_template_render_duration_seconds", "Duration of the template renders, by template", ("template",)
+)
+# Start times of the templates being rendered by the current thread
+_template_starts: contextvars.ContextVar[tuple[float, ...]] = contextvars.ContextVar(
+    "template_starts", default=()
+)
 
 
 # def make_cache_key_create() -> str:
 #     return (request.path + get_gym()).encode('utf-8')
 
 
+@app.before_request
+def start_instrumentation() -> None:
+    """Attribute the DDBB commands sent from now on to the request"""
+    instrumentation.start()
+    REQUESTS_IN_PROGRESS.inc()
+
+
+@before_render_template.connect_via(app)
+def start_template_timer(sender, template, context, **extra) -> None:
+    _template_starts.set(_template_starts.get() + (time.perf_counter(),))
+
+
+@template_rendered.connect_via(app)
+def record_template_render(sender, template, context, **extra) -> None:
+    starts = _template_starts.get()
+    if starts:
+        _template_starts.set(starts[:-1])
+        TEMPLATE_RENDER_DURATION.observe(time.perf_counter() - starts[-1], template=template.name)
+
+
+def ensure_indexes() -> None:
+    """Create the missing indexes of the DDBB before serving any
+    request, so that no request waits for them. The application
+    starts anyway if the DDBB cannot be reached."""
+    # the credentials are read as a request would read them
+    with app.test_request_context():
+        try:
+            indexes.ensure_indexes_once(utils.get_db_connection())
+        except PyMongoError as error:
+            app.logger.warning("Could not ensure the indexes of the DDBB: %s", error)
+
+
 @app.before_request
 def open_database_connection() -> None:
-    """Open DDBB connection before request so that
+    """Attach the pooled DDBB handle to the request so that
     it can be accessed during the request processing"""
     g.db = utils.get_db_connection()
 
 
 @app.teardown_appcontext
-def close_db_connection(exception) -> None:
-    """Closes the database again at the end of the request."""
-    if "database" in g:
-        g.database.client.close()
+def release_db_connection(exception) -> None:
+    """Drop the request reference to the DDBB. The pooled client
+    stays open and is reused by the following requests."""
+    g.pop("database", None)
+
+
+@app.after_request
+def compress(response: Response) -> Response:
+    """Compress the responses the client accepts compressed"""
+    return compress_response(response)
+
+
+@app.after_request
+def report_request(response: Response) -> Response:
+    """Log the DDBB commands sent by the request, add them to the
+    totals of its endpoint and record its metrics once the response
+    has been sent, since streamed responses keep querying the DDBB
+    after this. In debug mode, the time spent so far is sent as
+    Server-Timing headers."""
+    stats = instrumentation.get_current()
+    if stats is None:
+        return response
+    if app.debug:
+        response.headers.add("Server-Timing", instrumentation.get_server_timing(stats))
+    endpoint = request.endpoint or "unknown"
+    route = request.url_rule.rule if request.url_rule else ""
+    record = {
+        "method": request.method,
+        "path": request.path,
+        "endpoint": endpoint,
+        "status": response.status_code,
+    }
+
+    def finish() -> None:
+        finished = instrumentation.finish(endpoint)
+        if finished is not None:
+            REQUESTS_IN_PROGRESS.dec()
+            REQUEST_DURATION.observe(
+                finished.elapsed / 1000, endpoint=endpoint, route=route, method=record["method"]
+            )
+            REQUESTS.inc(endpoint=endpoint, method=record["method"], status=record["status"])
+            record["duration_ms"] = round(finished.elapsed, 3)
+            record["db"] = finished.to_dict()
+            app.logger.info(json.dumps(record))
+
+    if response.is_streamed:
+        response.call_on_close(finish)
+    else:
+        finish()
+    return response
 
 
 # user loading callback
 @login_manager.user_loader
 def load_user(user_id: str) -> Union[User, None]:
-    return User.get_by_id(user_id, utils.get_db_connection())
+    return User.get_cached_by_id(user_id, utils.get_db_connection())
 
 
 # Load favicon
@@ -302,6 +409,32 @@ def show_contact() -> Union[Response, NoReturn]:
     return render_template("contact.html")
 
 
+def check_metrics_token() -> None:
+    """
+    Only serve the metrics to the clients that send METRICS_TOKEN
+    as a bearer token. Without a token they are not served at all.
+    """
+    if not METRICS_TOKEN:
+        abort(404)
+    authorization = request.headers.get("Authorization", "")
+    if not hmac.compare_digest(authorization.encode(), f"Bearer {METRICS_TOKEN}".encode()):
+        abort(401)
+
+
+@app.route("/metrics", methods=["GET"])
+def show_metrics() -> Response:
+    """Metrics of every worker in the Prometheus text format"""
+    check_metrics_token()
+    return app.response_class(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+
+@app.route("/metrics/db", methods=["GET"])
+def show_database_metrics() -> Response:
+    """DDBB usage of the requests finished by this process, by endpoint"""
+    check_metrics_token()
+    return jsonify({"pid": os.getpid(), "endpoints": instrumentation.get_totals()})
+
+
 @app.errorhandler(404)
 def page_not_found(error) -> tuple[str, int]:
     # pylint: disable=no-member
@@ -323,7 +456,9 @@ if __name__ == "__main__":
     if RUN_SERVER:
         if DOCKER_ENV == "True":
             utils.set_creds_file(CREDS_DEV)
+            ensure_indexes()
             app.run(debug=DEBUG, host="0.0.0.0", port=80)
         else:
             utils.set_creds_file(CREDS)
+            ensure_indexes()
             app.run(debug=DEBUG, port=PORT)
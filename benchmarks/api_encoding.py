@@ -0,0 +1,111 @@
+"""
+API response encoding: JSON vs MessagePack
+
+Compares, for boulder lists of several sizes and for the hold polygons
+of every wall of the static folder, the time needed to encode the API
+response body and its size, both as sent and gzipped:
+
+* json: jsonify, as the API did before content negotiation
+* msgpack: the packer of the application/msgpack responses (api/encoding.py)
+
+Boulders are generated with the fields the API returns and holds at
+the centroids of the polygons of a real wall, so their coordinates are
+as long as the real ones. No DDBB is needed:
+
+    python -m benchmarks.api_encoding
+"""
+import argparse
+import datetime
+import glob
+import gzip
+import json
+import os
+import random
+
+from bson.objectid import ObjectId
+
+from api.encoding import get_packer
+from application import app
+from benchmarks.utils import print_table, summarize, time_calls
+from flask import jsonify
+from src.config import BOULDER_COLOR_MAP, BOULDER_DIFFICULTY_MAP, FEET_MAPPINGS, WALLS_PATH
+
+LIST_SIZES = [100, 1000, 5000]
+HOLD_COLORS = ['#00ff00', '#0000ff', '#ff0000']
+
+
+def get_centroid(polygon: list[list[int]]) -> tuple[float, float]:
+    return (sum(x for x, _ in polygon) / len(polygon), sum(y for _, y in polygon) / len(polygon))
+
+
+def make_boulders(count: int, polygons: list, section: str) -> list[dict]:
+    """
+    Boulders as returned by the API, with 4 to 15 holds of the given wall
+    """
+    rng = random.Random(count)
+    boulders = []
+    for index in range(count):
+        holds = []
+        for polygon in rng.sample(polygons, min(len(polygons), rng.randint(4, 15))):
+            x, y = get_centroid(polygon)
+            holds.append({'color': rng.choice(HOLD_COLORS), 'x': x, 'y': y})
+        raters = rng.randint(0, 40)
+        boulders.append({
+            '_id': str(ObjectId()),
+            'name': f'Boulder {index}',
+            'creator': f'climber_{rng.randint(0, 500)}',
+            'difficulty': BOULDER_DIFFICULTY_MAP[rng.randint(0, 3)],
+            'feet': rng.choice(list(FEET_MAPPINGS)),
+            'holds': holds,
+            'is_project': rng.random() < 0.1,
+            'notes': '' if rng.random() < 0.7 else 'Start sitting, no big pink volume',
+            'rating': rng.uniform(0, 5) if raters else 0,
+            'raters': raters,
+            'repetitions': rng.randint(0, 200),
+            'section': section,
+            'time': (datetime.datetime(2024, 1, 1) + datetime.timedelta(minutes=index)).isoformat(),
+        })
+    return boulders
+
+
+def get_payloads() -> list[tuple[str, dict]]:
+    """
+    Response bodies to encode: boulder lists and wall holds
+    """
+    walls = sorted(glob.glob(os.path.join('static', WALLS_PATH, '*', '*.json')))
+    payloads = []
+    with open(walls[0]) as f:
+        polygons = json.load(f)['holds']
+    section = os.path.splitext(os.path.basename(walls[0]))[0]
+    for count in LIST_SIZES:
+        payloads.append((f'{count} boulders', {'boulders': make_boulders(count, polygons, section)}))
+    for filename in walls:
+        with open(filename) as f:
+            payloads.append((
+                f'holds {os.path.relpath(filename, os.path.join("static", WALLS_PATH))}',
+                {'holds': json.load(f)['holds']}
+            ))
+    return payloads
+
+
+def main(repeat: int) -> None:
+    packer = get_packer()
+    rows = []
+    with app.test_request_context():
+        for name, payload in get_payloads():
+            for encoding, encode in (
+                ('json', lambda: jsonify(payload).get_data()),
+                ('msgpack', lambda: packer.pack(payload)),
+            ):
+                body = encode()
+                stats = summarize(time_calls(encode, repeat))
+                rows.append([name, encoding, len(body), len(gzip.compress(body)),
+                             stats['p50'], stats['p95']])
+    print_table(['payload', 'encoding', 'bytes', 'gzip bytes', 'p50 (ms)', 'p95 (ms)'], rows)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('-r', '--repeat', type=int, default=20,
+                        help='Encodings measured per payload and encoding')
+    main(parser.parse_args().repeat)
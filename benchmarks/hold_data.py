@@ -0,0 +1,87 @@
+"""
+Hold data loading: JSON vs binary format
+
+Compares, for every wall of the static folder, the time needed to load
+its hold polygons and the Python heap memory they take:
+
+* json: json.load of the original file
+* json + serialized: the above along with the JSON the templates embed, as
+  src/hold_data_store.py serves a wall without a binary file
+* binary: memory-mapped arrays of the `.holds` file (src/hold_format.py)
+* binary + serialized: the above along with the JSON the templates embed, built
+  from the flat arrays as src/hold_data_store.py does
+
+The binary files are written to a temporary folder, so the static folder
+is left untouched. No DDBB is needed:
+
+    python -m benchmarks.hold_data
+"""
+import argparse
+import glob
+import json
+import os
+import tempfile
+import tracemalloc
+
+from benchmarks.utils import print_table, summarize, time_calls
+from src import hold_format
+from src.config import WALLS_PATH
+
+
+def retained_memory(load) -> int:
+    """
+    Bytes allocated by load that are still alive when it returns
+    """
+    tracemalloc.start()
+    data = load()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del data
+    return size
+
+
+def main(repeat: int) -> None:
+    rows = []
+    with tempfile.TemporaryDirectory() as folder:
+        for json_filename in sorted(glob.glob(os.path.join('static', WALLS_PATH, '*', '*.json'))):
+            with open(json_filename) as f:
+                polygons = json.load(f)['holds']
+            holds_filename = os.path.join(
+                folder, os.path.basename(hold_format.get_holds_filename(json_filename)))
+            hold_format.dump(polygons, holds_filename)
+
+            def load_json():
+                with open(json_filename) as f:
+                    return json.load(f)
+
+            def load_json_serialized():
+                data = load_json()
+                return data, json.dumps(data)
+
+            def load_binary():
+                return hold_format.load(holds_filename)
+
+            def load_binary_serialized():
+                polygons = hold_format.load(holds_filename)
+                return polygons, polygons.to_json()
+
+            for name, load, filename in (
+                ('json', load_json, json_filename),
+                ('json + serialized', load_json_serialized, json_filename),
+                ('binary', load_binary, holds_filename),
+                ('binary + serialized', load_binary_serialized, holds_filename),
+            ):
+                stats = summarize(time_calls(load, repeat))
+                rows.append([
+                    os.path.relpath(json_filename, os.path.join('static', WALLS_PATH)),
+                    name, os.path.getsize(filename), stats['p50'], stats['p95'],
+                    retained_memory(load) // 1024,
+                ])
+    print_table(['wall', 'format', 'file bytes', 'p50 (ms)', 'p95 (ms)', 'heap (KiB)'], rows)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('-r', '--repeat', type=int, default=20,
+                        help='Loads measured per wall and format')
+    main(parser.parse_args().repeat)
@@ -0,0 +1,266 @@
+"""
+Load test of the hot routes of the application
+
+Seeds a synthetic gym (see benchmarks/query_plans.py) and a logged in
+user with a ticklist, then requests every hot page and API list
+endpoint, one route after the other, from several concurrent clients.
+For each route it reports the throughput, the latency percentiles and
+the number of DDBB round trips per request, so that N+1 query
+regressions show up as a growing number of round trips.
+
+Requests go through the WSGI test client by default, or over the
+loopback interface to a local gunicorn with --gunicorn. Round trips are
+always counted in this process, on a first pass through the test client.
+
+Run from the project root with the local DDBB up (see docs/testing),
+or against a throwaway mongod launched in a temporary directory:
+
+    python -m benchmarks.load_test [--mongod] [--gunicorn]
+"""
+import argparse
+import contextlib
+import http.client
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, Optional
+from urllib.parse import urlencode
+
+from pymongo import monitoring
+
+import db.mongodb_controller as mongodb_controller
+from application import app
+from benchmarks import query_plans
+from benchmarks.utils import CommandCounter, get_benchmark_database, get_free_port, launch_mongod
+from benchmarks.utils import print_table, summarize
+from src.config import CREDS, CREDS_LOCAL
+from src.models import User
+from src.utils import set_creds_file
+
+API_PREFIX = '/api/v1'
+
+
+def get_routes(db, data: dict) -> list[tuple[str, str, Optional[dict]]]:
+    """
+    Hot routes of the application, as name, URL and the form to post
+    to it, if it is not requested with a GET
+    """
+    gym = data['gym']
+    boulder = data['boulder']
+    # problems are opened from the lists with a form that carries them
+    boulder_form = {
+        'boulder_data': str(dict(mongodb_controller.get_boulder_by_name(gym, boulder['name'], db), gym=gym)),
+        'origin': 'explore_boulders',
+        'list_id': gym,
+        'is_user_list': 'False',
+    }
+    # the list of a gym is identified by its code
+    navigation = f'list_id={gym}&is_user_list=false&sort_by=difficulty&is_ascending=True&to_show=all'
+    return [
+        ('home', '/', None),
+        ('explore boulders', '/explore_boulders', None),
+        ('load boulder', '/load_boulder', boulder_form),
+        ('load next', f'/load_next?id={boulder["_id"]}&{navigation}', None),
+        ('tick list', '/tick_list', None),
+        ('api gyms', f'{API_PREFIX}/gym/list', None),
+        ('api walls', f'{API_PREFIX}/gym/{gym}/walls', None),
+        ('api boulders', f'{API_PREFIX}/boulders/{gym}/list', None),
+        ('api boulders page', f'{API_PREFIX}/boulders/{gym}/list?limit=100', None),
+        ('api circuits', f'{API_PREFIX}/circuits/{gym}/list', None),
+        ('api ticklist', f'{API_PREFIX}/user/ticklist', None),
+    ]
+
+
+def get_headers(data: dict) -> dict[str, str]:
+    """
+    Headers of a browser of the logged in benchmark user whose
+    selected gym is the benchmark one. They carry its API token too.
+    """
+    user_id = data['user']['id']
+    session = app.session_interface.get_signing_serializer(app).dumps(
+        {'_user_id': user_id, '_fresh': True, 'gym': data['gym']})
+    with app.app_context():
+        token = User(id=user_id).generate_auth_token(app)
+    return {
+        'Cookie': f'{app.config["SESSION_COOKIE_NAME"]}={session}',
+        'Authorization': f'Bearer {token}',
+        'Accept-Encoding': 'gzip',
+        'Accept-Language': 'en-US,en;q=0.9',
+    }
+
+
+def request_with_test_client(url: str, form: Optional[dict], headers: dict, count: int) -> tuple[list[float], int]:
+    """
+    Request a URL count times through the WSGI test client and
+    return the duration of each request in ms and the errors
+    """
+    # the session cookie is sent in the headers
+    client = app.test_client(use_cookies=False)
+    samples, errors = [], 0
+    for _ in range(count):
+        start = time.perf_counter()
+        if form is None:
+            response = client.get(url, headers=headers)
+        else:
+            response = client.post(url, data=form, headers=headers)
+        response.get_data()
+        samples.append((time.perf_counter() - start) * 1000)
+        errors += response.status_code >= 400
+    return samples, errors
+
+
+def request_over_http(port: int, url: str, form: Optional[dict], headers: dict, count: int) -> tuple[list[float], int]:
+    """
+    Request a URL count times from a local server and return
+    the duration of each request in ms and the errors
+    """
+    connection = http.client.HTTPConnection('127.0.0.1', port)
+    method, body = 'GET', None
+    if form is not None:
+        method, body = 'POST', urlencode(form)
+        headers = dict(headers, **{'Content-Type': 'application/x-www-form-urlencoded'})
+    samples, errors = [], 0
+    for _ in range(count):
+        start = time.perf_counter()
+        connection.request(method, url, body=body, headers=headers)
+        response = connection.getresponse()
+        response.read()
+        samples.append((time.perf_counter() - start) * 1000)
+        errors += response.status >= 400
+        if response.will_close:
+            connection.close()
+    connection.close()
+    return samples, errors
+
+
+@contextlib.contextmanager
+def launch_gunicorn(workers: int, timeout: float = 30) -> Iterator[int]:
+    """
+    Serve the application with gunicorn on a free local port,
+    and yield the port
+    """
+    port = get_free_port()
+    process = subprocess.Popen([
+        sys.executable, '-m', 'gunicorn', '--workers', str(workers),
+        '--bind', f'127.0.0.1:{port}', '--log-level', 'warning', 'application:app'
+    ])
+    try:
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                http.client.HTTPConnection('127.0.0.1', port, timeout=1).connect()
+                break
+            except OSError:
+                if process.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError('gunicorn did not start')
+                time.sleep(0.1)
+        yield port
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def count_round_trips(counter: CommandCounter, url: str, form: Optional[dict], headers: dict, count: int) -> float:
+    """
+    Mean number of DDBB commands sent per request
+    """
+    counter.reset()
+    request_with_test_client(url, form, headers, count)
+    return counter.count / count
+
+
+def load(
+        url: str,
+        form: Optional[dict],
+        headers: dict,
+        requests: int,
+        concurrency: int,
+        port: Optional[int]) -> tuple[list[float], int, float]:
+    """
+    Send requests to a URL from concurrent clients and return the
+    duration of every request in ms, the errors and the throughput
+    """
+    per_client = [requests // concurrency + (index < requests % concurrency) for index in range(concurrency)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        if port is None:
+            results = list(executor.map(
+                lambda count: request_with_test_client(url, form, headers, count), per_client))
+        else:
+            results = list(executor.map(
+                lambda count: request_over_http(port, url, form, headers, count), per_client))
+    elapsed = time.perf_counter() - start
+    samples = [sample for client_samples, _ in results for sample in client_samples]
+    return samples, sum(errors for _, errors in results), requests / elapsed
+
+
+def run(args: argparse.Namespace, uri: Optional[str]) -> list[list]:
+    counter = CommandCounter()
+    # the application builds its clients after this, so they report
+    # their commands to the counter
+    monitoring.register(counter)
+    db = get_benchmark_database(uri=uri)
+    rows = []
+    try:
+        data = query_plans.seed(db, args.boulders)
+        headers = get_headers(data)
+        routes = get_routes(db, data)
+        round_trips = {}
+        for name, url, form in routes:
+            # warm up the caches and the connection pool first
+            request_with_test_client(url, form, headers, 1)
+            round_trips[name] = count_round_trips(counter, url, form, headers, args.round_trip_requests)
+        with contextlib.ExitStack() as stack:
+            port = stack.enter_context(launch_gunicorn(args.workers)) if args.gunicorn else None
+            for name, url, form in routes:
+                if port is not None:
+                    request_over_http(port, url, form, headers, args.workers)
+                samples, errors, throughput = load(url, form, headers, args.requests, args.concurrency, port)
+                stats = summarize(samples)
+                rows.append([name, args.requests, errors, throughput,
+                             stats['p50'], stats['p95'], stats['p99'], round_trips[name]])
+    finally:
+        query_plans.cleanup(db, args.boulders)
+        db.client.close()
+    return rows
+
+
+def main(args: argparse.Namespace) -> None:
+    with contextlib.ExitStack() as stack:
+        uri, creds_file = None, CREDS_LOCAL
+        if args.mongod:
+            uri = stack.enter_context(launch_mongod(args.mongod_binary))
+            # the application reads its connection string from a file
+            with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as creds:
+                creds.write(uri)
+            creds_file = creds.name
+            stack.callback(os.remove, creds_file)
+        set_creds_file(creds_file)
+        stack.callback(set_creds_file, CREDS)
+        rows = run(args, uri)
+    print_table(
+        ['route', 'requests', 'errors', 'req/s', 'p50 (ms)', 'p95 (ms)', 'p99 (ms)', 'round trips'], rows)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('-n', '--requests', type=int, default=200,
+                        help='Requests measured per route')
+    parser.add_argument('-c', '--concurrency', type=int, default=4,
+                        help='Concurrent clients')
+    parser.add_argument('-b', '--boulders', type=int, default=2000,
+                        help='Number of boulders of the synthetic gym')
+    parser.add_argument('--round-trip-requests', type=int, default=5,
+                        help='Requests per route whose DDBB round trips are counted')
+    parser.add_argument('--gunicorn', action='store_true',
+                        help='Serve the application with a local gunicorn instead of the test client')
+    parser.add_argument('-w', '--workers', type=int, default=2,
+                        help='gunicorn workers')
+    parser.add_argument('--mongod', action='store_true',
+                        help='Run against a throwaway mongod instead of the local DDBB')
+    parser.add_argument('--mongod-binary', type=str, default='mongod',
+                        help='mongod executable to run with --mongod')
+    main(parser.parse_args())
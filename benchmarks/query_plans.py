@@ -0,0 +1,415 @@
+"""
+Query plan and latency regressions of the controller
+
+Seeds synthetic gyms of 1k, 10k and 100k boulders, calls every public
+function of db/mongodb_controller.py that takes the DDBB, and records,
+for each gym size and function, its latency percentiles and a summary
+of the plan MongoDB picks for every command it sends (see
+db/indexes.py). The results are compared against a stored baseline,
+and the benchmark exits with an error when a plan changes, for instance
+an index scan that became a COLLSCAN, when a function got slower than
+its baseline, when a function or gym size is missing from the baseline,
+or when a public function has no case below.
+
+Run from the project root with the local DDBB up (see docs/testing),
+or against a throwaway mongod launched in a temporary directory:
+
+    python -m benchmarks.query_plans [--mongod] [--save]
+
+The gyms are seeded in a DDBB of their own, dropped at the end, so the
+one of the application is left untouched. Save the baseline with --save
+on a known good version, and again whenever a change of plan or latency
+is intended.
+"""
+import argparse
+import inspect
+import json
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+from typing import Any, Callable, Optional
+
+from pymongo import monitoring
+
+import db.mongodb_controller as mongodb_controller
+from db import catalog as gym_catalog
+from db import indexes
+from db import user_cache
+from benchmarks.utils import get_benchmark_database, launch_mongod
+from benchmarks.utils import print_table, summarize, time_calls
+from src.config import DB_NAME, ITEMS
+from src.models import TickListProblem
+
+GYM_SIZES = [1000, 10000, 100000]
+SECTIONS = ['wall_0', 'wall_1', 'wall_2', 'wall_3']
+LATEST_SECTIONS = SECTIONS[:2]
+USER_ID = 'bench_plan_user'
+TICKLIST_SIZE = 200
+BASELINE = os.path.join(os.path.dirname(__file__), 'baselines', 'query_plans.json')
+# DDBB the gyms are seeded in, dropped when the benchmark ends
+DATABASE = 'RocoLib_query_plans'
+# Commands whose plan can be explained. Inserts have none, and the
+# plan of a getMore is the one of the command that opened the cursor.
+EXPLAINABLE_COMMANDS = ('find', 'aggregate', 'count', 'distinct', 'update', 'delete', 'findAndModify')
+
+
+class CommandRecorder(monitoring.CommandListener):
+    """
+    Record the commands sent to the DDBB while recording is on
+    """
+
+    def __init__(self) -> None:
+        self.recording = False
+        self.commands = []
+
+    def start(self) -> None:
+        self.commands = []
+        self.recording = True
+
+    def stop(self) -> list[dict]:
+        self.recording = False
+        return self.commands
+
+    def started(self, event) -> None:
+        if self.recording and event.command_name in EXPLAINABLE_COMMANDS:
+            self.commands.append(dict(event.command))
+
+    def succeeded(self, event) -> None:
+        pass
+
+    def failed(self, event) -> None:
+        pass
+
+
+def get_gym(size: int) -> str:
+    return f'bench_plan_{size}'
+
+
+def make_boulder(index: int, rng: random.Random) -> dict:
+    """
+    Boulder document as stored in the DDBB
+    """
+    raters = rng.randint(0, 20)
+    return {
+        'creator': f'setter_{index % 50}',
+        'difficulty': rng.randint(0, 3),
+        'feet': 'free',
+        'holds': [{'color': '#00ff00', 'x': rng.random(), 'y': rng.random()} for _ in range(8)],
+        'is_project': False,
+        'name': f'bench_{index}',
+        'notes': '',
+        'rating': rng.uniform(0, 5) if raters else 0,
+        'raters': raters,
+        'repetitions': rng.randint(0, 100),
+        'section': rng.choice(SECTIONS),
+        # as the application stores it, with microseconds
+        'time': (datetime(2020, 1, 1) + timedelta(minutes=index)).isoformat(timespec='microseconds'),
+    }
+
+
+def seed(db, size: int) -> dict:
+    """
+    Create a gym with size boulders, a circuit per hundred boulders and
+    a user whose ticklist has entries of the gym, along with the indexes
+    of the application. Return the documents the cases work with.
+    """
+    cleanup(db, size)
+    gym = get_gym(size)
+    rng = random.Random(size)
+    db['walls'].insert_one({'id': gym, 'name': gym, 'coordinates': [0, 0]})
+    db[f'{gym}_walls'].insert_many([
+        {'image': section, 'name': section, 'radius': 0.02, 'latest': section in LATEST_SECTIONS}
+        for section in SECTIONS
+    ])
+    gym_catalog.invalidate()
+    for start in range(0, size, 10000):
+        db[f'{gym}_boulders'].insert_many(
+            [make_boulder(index, rng) for index in range(start, min(size, start + 10000))])
+    db[f'{gym}_circuits'].insert_many(
+        [dict(make_boulder(index, rng), name=f'circuit_{index}') for index in range(max(10, size // 100))])
+    indexes.ensure_indexes(db, [gym])
+    boulder = db[f'{gym}_boulders'].find_one({'name': f'bench_{size // 2}'})
+    circuit = db[f'{gym}_circuits'].find_one({'name': 'circuit_0'})
+    # the boulder the cases work with goes first
+    ticked = [boulder] + list(db[f'{gym}_boulders'].aggregate([
+        {'$match': {'_id': {'$ne': boulder['_id']}}},
+        {'$sample': {'size': TICKLIST_SIZE - 1}},
+        {'$project': {'section': 1}},
+    ]))
+    db[mongodb_controller.TICKLIST_COLLECTION].insert_many([
+        {'user_id': USER_ID, 'gym': gym, 'iden': str(problem['_id']), 'section': problem['section'],
+         'is_done': rng.random() < 0.5, 'date_climbed': []}
+        for problem in ticked
+    ])
+    db['users'].insert_one({'id': USER_ID, 'name': USER_ID, 'email': f'{USER_ID}@rocolib.test'})
+    db['user_preferences'].insert_one({'user_id': USER_ID, 'show_only_latest_wall_sets': True})
+    return {
+        'gym': gym,
+        'boulder': boulder,
+        'circuit': circuit,
+        'user': db['users'].find_one({'id': USER_ID}),
+        'preferences': db['user_preferences'].find_one({'user_id': USER_ID}),
+    }
+
+
+def cleanup(db, size: int) -> None:
+    gym = get_gym(size)
+    for suffix in ('walls', 'boulders', 'circuits', 'routes'):
+        db[f'{gym}_{suffix}'].drop()
+    db['walls'].delete_many({'id': gym})
+    db['versions'].delete_many({'_id': {'$regex': f'^{gym}_'}})
+    db['users'].delete_many({'id': USER_ID})
+    db['user_preferences'].delete_many({'user_id': USER_ID})
+    db[mongodb_controller.TICKLIST_COLLECTION].delete_many({'user_id': USER_ID})
+    gym_catalog.invalidate()
+
+
+def get_cases(db, data: dict) -> dict[str, Callable[[], Any]]:
+    """
+    A representative call of every public controller function,
+    by function name
+    """
+    gym = data['gym']
+    boulder_id = str(data['boulder']['_id'])
+    boulder_name = data['boulder']['name']
+    section = data['boulder']['section']
+    circuit_id = str(data['circuit']['_id'])
+    tick = {'gym': gym, 'iden': boulder_id, 'section': section, 'is_done': True}
+    ticklist = [TickListProblem(entry) for entry in mongodb_controller.get_ticklist(USER_ID, db)]
+    navigation = (boulder_id, gym, USER_ID, True, 'difficulty', True, 'to_do', db)
+    list_navigation = (boulder_id, 'ticklist', USER_ID, True, 'difficulty', True, 'all', db)
+    new_boulder = {
+        'creator': 'benchmark', 'difficulty': 'green', 'feet': 'free', 'holds': [],
+        'name': 'bench_new', 'notes': '', 'section': section, 'time': datetime.now().isoformat(),
+    }
+
+    def get_cached_user_data():
+        # measure the DDBB query, not the cache
+        user_cache.invalidate(USER_ID)
+        return mongodb_controller.get_cached_user_data(USER_ID, db)
+
+    return {
+        'get_gyms': lambda: mongodb_controller.get_gyms(db),
+        'get_gym_walls': lambda: mongodb_controller.get_gym_walls(gym, db, True),
+        'get_gym_pretty_name': lambda: mongodb_controller.get_gym_pretty_name(gym, db),
+        'get_wall_name': lambda: mongodb_controller.get_wall_name(gym, section, db),
+        'get_gym_section_name': lambda: mongodb_controller.get_gym_section_name(gym, section, db),
+        'get_walls_radius_all': lambda: mongodb_controller.get_walls_radius_all(db),
+        'get_circuits': lambda: mongodb_controller.get_circuits(gym, db),
+        'get_boulders': lambda: mongodb_controller.get_boulders(gym, db),
+        'iter_circuits_page': lambda: list(
+            mongodb_controller.iter_circuits_page(gym, db, limit=100, after=circuit_id)[ITEMS]),
+        'iter_boulders_page': lambda: list(
+            mongodb_controller.iter_boulders_page(gym, db, limit=100, after=boulder_id, summary=True)[ITEMS]),
+        'get_routes': lambda: mongodb_controller.get_routes(gym, db),
+        'count_boulders': lambda: mongodb_controller.count_boulders(gym, db),
+        'count_routes': lambda: mongodb_controller.count_routes(gym, db),
+        'get_problems_version': lambda: mongodb_controller.get_problems_version(gym, 'boulders', db),
+        'put_boulder': lambda: mongodb_controller.put_boulder(dict(new_boulder), gym, db),
+        'put_boulders': lambda: mongodb_controller.put_boulders(
+            [dict(new_boulder) for _ in range(10)], gym, db),
+        'put_circuit': lambda: mongodb_controller.put_circuit(dict(new_boulder), gym, db),
+        'put_route': lambda: mongodb_controller.put_route(dict(new_boulder), gym, db),
+        'put_boulder_in_ticklist': lambda: mongodb_controller.put_boulder_in_ticklist(
+            dict(tick), USER_ID, db, mark_as_done_clicked=True),
+        'delete_boulder_in_ticklist': lambda: mongodb_controller.delete_boulder_in_ticklist(
+            dict(tick, iden='bench_missing'), USER_ID, db),
+        'get_ticklist': lambda: mongodb_controller.get_ticklist(USER_ID, db, gym=gym),
+        'get_done_boulder_ids': lambda: mongodb_controller.get_done_boulder_ids(USER_ID, gym, db),
+        'get_user_problem_list_by_id': lambda: mongodb_controller.get_user_problem_list_by_id(
+            USER_ID, 'ticklist', db),
+        'get_ticklist_boulder': lambda: mongodb_controller.get_ticklist_boulder(ticklist[0], db),
+        'get_ticklist_boulders': lambda: mongodb_controller.get_ticklist_boulders(ticklist, db),
+        'get_boulder_by_name': lambda: mongodb_controller.get_boulder_by_name(gym, boulder_name, db),
+        'get_boulder_by_id': lambda: mongodb_controller.get_boulder_by_id(gym, boulder_id, db),
+        'get_circuit_by_name': lambda: mongodb_controller.get_circuit_by_name(gym, 'circuit_0', db),
+        'get_circuit_by_id': lambda: mongodb_controller.get_circuit_by_id(gym, circuit_id, db),
+        'get_random_boulder': lambda: mongodb_controller.get_random_boulder(gym, db),
+        'get_adjacent_boulder': lambda: mongodb_controller.get_adjacent_boulder(*navigation),
+        'get_next_boulder': lambda: mongodb_controller.get_next_boulder(*navigation),
+        'get_previous_boulder': lambda: mongodb_controller.get_previous_boulder(*navigation),
+        'get_user_list_navigation': lambda: mongodb_controller.get_user_list_navigation(
+            USER_ID, 'ticklist', 'all', 'difficulty', True, db),
+        'get_adjacent_boulder_from_user_list': lambda: mongodb_controller.get_adjacent_boulder_from_user_list(
+            *list_navigation),
+        'get_next_boulder_from_user_list': lambda: mongodb_controller.get_next_boulder_from_user_list(
+            *list_navigation),
+        'get_previous_boulder_from_user_list': lambda: mongodb_controller.get_previous_boulder_from_user_list(
+            *list_navigation),
+        'update_boulder_by_id': lambda: mongodb_controller.update_boulder_by_id(
+            gym, boulder_id, {'notes': 'benchmark', 'difficulty': 'blue'}, db),
+        'rate_boulder_by_id': lambda: mongodb_controller.rate_boulder_by_id(gym, boulder_id, 4, db),
+        'rate_boulder_by_name': lambda: mongodb_controller.rate_boulder_by_name(gym, boulder_name, 4, db),
+        'add_boulder_repetition_by_id': lambda: mongodb_controller.add_boulder_repetition_by_id(
+            gym, boulder_id, db),
+        'get_boulders_filtered': lambda: mongodb_controller.get_boulders_filtered(
+            gym, db, True, {'difficulty': 2, 'rating': 4},
+            mongodb_controller.EQUALS, mongodb_controller.RANGE, mongodb_controller.CONTAINS),
+        'get_circuits_filtered': lambda: mongodb_controller.get_circuits_filtered(gym, db, True),
+        'save_user': lambda: mongodb_controller.save_user(
+            dict(data['user'], _id=str(data['user']['_id'])), db),
+        'get_user_data_by_id': lambda: mongodb_controller.get_user_data_by_id(USER_ID, db),
+        'get_user_data_with_preferences': lambda: mongodb_controller.get_user_data_with_preferences(
+            'id', USER_ID, db),
+        'get_cached_user_data': get_cached_user_data,
+        'get_user_data_by_email': lambda: mongodb_controller.get_user_data_by_email(data['user']['email'], db),
+        'get_user_data_by_username': lambda: mongodb_controller.get_user_data_by_username(USER_ID, db),
+        'get_user_preferences': lambda: mongodb_controller.get_user_preferences(USER_ID, db),
+        'save_user_preferences': lambda: mongodb_controller.save_user_preferences(
+            dict(data['preferences'], _id=str(data['preferences']['_id'])), db),
+    }
+
+
+def get_public_functions() -> list[str]:
+    """
+    Names of the public controller functions that query the DDBB
+    """
+    return sorted(
+        name for name, func in inspect.getmembers(mongodb_controller, inspect.isfunction)
+        if func.__module__ == mongodb_controller.__name__ and not name.startswith('_')
+        and 'database' in inspect.signature(func).parameters
+    )
+
+
+def explain_command(db, command: dict, gym: str) -> str:
+    """
+    Plan summary of a recorded command, with the gym of the collection
+    left out so that gyms of different sizes can be compared
+    """
+    # leave out the session and cluster fields the driver adds
+    command = {key: value for key, value in command.items() if not key.startswith('$') and key != 'lsid'}
+    name = next(iter(command))
+    explanation = db.command({'explain': command, 'verbosity': 'queryPlanner'})
+    collection = str(command[name]).replace(gym, '<gym>')
+    return f'{name} {collection}: {indexes.describe_explanation(explanation)}'
+
+
+def measure(db, recorder: CommandRecorder, data: dict, repeat: int) -> dict[str, dict]:
+    """
+    Plans and latency summary of every case
+    """
+    results = {}
+    for name, call in get_cases(db, data).items():
+        recorder.start()
+        call()
+        commands = recorder.stop()
+        plans = [explain_command(db, command, data['gym']) for command in commands]
+        results[name] = {'plans': plans, **summarize(time_calls(call, repeat))}
+    return results
+
+
+def compare(
+        results: dict,
+        baseline: dict,
+        tolerance: float,
+        min_delta: float,
+        allow_new: bool = False) -> tuple[list[list], list[str]]:
+    """
+    Compare the results of every gym size against the baseline. A
+    function regresses when its plans differ or when its p95 latency
+    exceeds the baseline one by more than tolerance (a fraction of it)
+    and min_delta ms, and unless allow_new, when the baseline has no
+    results for it. Return the table rows and the regressions.
+    """
+    rows, regressions = [], []
+    for size, functions in results.items():
+        for name, result in functions.items():
+            expected = baseline.get(size, {}).get(name)
+            status = 'new'
+            if expected is None and not allow_new:
+                regressions.append(f'{name} ({size} boulders) is not in the baseline')
+            if expected is not None:
+                status = 'ok'
+                limit = max(expected['p95'] * (1 + tolerance), expected['p95'] + min_delta)
+                if result['plans'] != expected['plans']:
+                    status = 'PLAN'
+                    regressions.append(
+                        f'{name} ({size} boulders) plans changed:\n'
+                        + '\n'.join(f'  - {plan}' for plan in expected['plans'])
+                        + '\n' + '\n'.join(f'  + {plan}' for plan in result['plans'])
+                    )
+                elif result['p95'] > limit:
+                    status = 'SLOWER'
+                    regressions.append(
+                        f'{name} ({size} boulders) p95 {result["p95"]:.2f} ms, '
+                        f'baseline {expected["p95"]:.2f} ms')
+            rows.append([size, name, result['p50'], result['p95'],
+                         expected['p95'] if expected else '-', status])
+    return rows, regressions
+
+
+def run(uri: Optional[str], database: str, sizes: list[int], repeat: int) -> dict[str, dict]:
+    recorder = CommandRecorder()
+    db = get_benchmark_database([recorder], uri, database)
+    results = {}
+    try:
+        for size in sizes:
+            data = seed(db, size)
+            results[str(size)] = measure(db, recorder, data, repeat)
+            cleanup(db, size)
+    finally:
+        for size in sizes:
+            cleanup(db, size)
+        db.client.drop_database(db.name)
+        db.client.close()
+    return results
+
+
+def main(args: argparse.Namespace) -> int:
+    if args.database == DB_NAME:
+        print(f'The benchmark drops its DDBB at the end, use another one than {DB_NAME}')
+        return 1
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    elif not (args.save or args.allow_new):
+        print(f'No baseline at {args.baseline}, save one with --save or pass --allow-new')
+        return 1
+    if args.mongod:
+        with launch_mongod(args.mongod_binary) as uri:
+            results = run(uri, args.database, args.sizes, args.repeat)
+    else:
+        results = run(None, args.database, args.sizes, args.repeat)
+    if args.save:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(f'Baseline saved to {args.baseline}')
+        return 0
+    rows, regressions = compare(results, baseline, args.tolerance, args.min_delta, args.allow_new)
+    print_table(['boulders', 'function', 'p50 (ms)', 'p95 (ms)', 'baseline p95 (ms)', 'status'], rows)
+    for regression in regressions:
+        print(regression)
+    uncovered = set(get_public_functions())
+    for functions in results.values():
+        uncovered -= set(functions)
+    for name in sorted(uncovered):
+        print(f'{name} has no case, add one to get_cases')
+    return 1 if regressions or uncovered else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('-s', '--sizes', type=int, nargs='+', default=GYM_SIZES,
+                        help='Number of boulders of each synthetic gym')
+    parser.add_argument('-r', '--repeat', type=int, default=10,
+                        help='Calls measured per function and gym size')
+    parser.add_argument('-b', '--baseline', type=str, default=BASELINE,
+                        help='Baseline file to compare against or save')
+    parser.add_argument('--save', action='store_true',
+                        help='Save the results as the baseline instead of comparing them')
+    parser.add_argument('--allow-new', action='store_true',
+                        help='Do not fail on results missing from the baseline, or without a baseline')
+    parser.add_argument('-d', '--database', type=str, default=DATABASE,
+                        help='DDBB to seed the gyms in, dropped at the end')
+    parser.add_argument('--tolerance', type=float, default=0.5,
+                        help='Slowdown of the p95 latency allowed, as a fraction of the baseline')
+    parser.add_argument('--min-delta', type=float, default=2,
+                        help='Slowdown of the p95 latency always allowed, in ms')
+    parser.add_argument('--mongod', action='store_true',
+                        help='Run against a throwaway mongod instead of the local DDBB')
+    parser.add_argument('--mongod-binary', type=str, default='mongod',
+                        help='mongod executable to run with --mongod')
+    sys.exit(main(parser.parse_args()))
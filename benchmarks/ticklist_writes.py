@@ -0,0 +1,120 @@
+"""
+Tick latency: embedded ticklist vs ticklist entries collection
+
+Measures how long it takes to mark a problem as done and to add a new
+problem to the ticklist of users with 1000 and 5000 entries, both with
+the embedded list the user document used to carry (read the user,
+update the list in memory and $set the whole document back) and with
+the ticklist_entries collection (a single upsert).
+
+Run from the project root with the local DDBB up (see docs/testing):
+
+    python -m benchmarks.ticklist_writes
+"""
+import argparse
+import itertools
+from datetime import datetime
+
+import bson
+from bson.objectid import ObjectId
+
+import db.mongodb_controller as mongodb_controller
+from db import indexes
+from benchmarks.utils import CommandCounter, get_benchmark_database
+from benchmarks.utils import print_table, summarize, time_calls
+
+GYM = 'bench_tick'
+USER_ID = 'bench_tick_user'
+LIST_SIZES = [1000, 5000]
+
+
+def seed(db, list_size: int) -> list[dict]:
+    """
+    Store a ticklist of list_size entries both embedded in the
+    benchmark user and in the ticklist entries collection
+    """
+    cleanup(db)
+    ticklist = [
+        {
+            'iden': str(ObjectId()),
+            'gym': GYM,
+            'section': 'wall',
+            'is_done': bool(index % 2),
+            'date_climbed': ['2022-01-01'] if index % 2 else [],
+        }
+        for index in range(list_size)
+    ]
+    db['users'].insert_one({'id': USER_ID, 'name': USER_ID, 'ticklist': ticklist})
+    indexes.ensure_collection_indexes(mongodb_controller.TICKLIST_COLLECTION, db)
+    db[mongodb_controller.TICKLIST_COLLECTION].insert_many(
+        [dict(problem, user_id=USER_ID) for problem in ticklist])
+    return ticklist
+
+
+def cleanup(db) -> None:
+    db['users'].delete_many({'id': USER_ID})
+    db[mongodb_controller.TICKLIST_COLLECTION].delete_many({'user_id': USER_ID})
+
+
+def embedded_tick(db, problem: dict) -> None:
+    """
+    Reference implementation: how ticks were stored in the user document
+    """
+    user = db['users'].find_one({'id': USER_ID})
+    ticklist = user.get('ticklist', [])
+    for entry in ticklist:
+        if entry['iden'] == problem['iden']:
+            entry['is_done'] = True
+            entry['date_climbed'] = entry.get('date_climbed', []) + [
+                datetime.today().strftime('%Y-%m-%d')]
+            break
+    else:
+        ticklist.append(problem)
+    user['ticklist'] = ticklist
+    db['users'].update_one({'id': USER_ID}, {'$set': user})
+
+
+def collection_tick(db, problem: dict) -> None:
+    mongodb_controller.put_boulder_in_ticklist(
+        problem, USER_ID, db, mark_as_done_clicked=problem['is_done'])
+
+
+def main(repeat: int) -> None:
+    counter = CommandCounter()
+    db = get_benchmark_database([counter])
+    rows = []
+    try:
+        for list_size in LIST_SIZES:
+            ticklist = seed(db, list_size)
+            document_size = len(bson.encode(db['users'].find_one({'id': USER_ID})))
+            existing = itertools.cycle(ticklist)
+            for operation, next_problem in (
+                ('mark as done', lambda: dict(next(existing), is_done=True)),
+                ('add new', lambda: {'iden': str(ObjectId()), 'gym': GYM,
+                                     'section': 'wall', 'is_done': False}),
+            ):
+                for storage, tick in (
+                    ('embedded', embedded_tick),
+                    ('collection', collection_tick),
+                ):
+                    counter.reset()
+                    tick(db, next_problem())
+                    round_trips = counter.count
+                    stats = summarize(time_calls(lambda: tick(db, next_problem()), repeat))
+                    rows.append([list_size, document_size // 1024, operation, storage,
+                                 round_trips, stats['p50'], stats['p95']])
+    finally:
+        cleanup(db)
+        db.client.close()
+    print_table(
+        ['entries', 'user doc (KiB)', 'operation', 'storage', 'round trips',
+         'p50 (ms)', 'p95 (ms)'],
+        rows
+    )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('-r', '--repeat', type=int, default=50,
+                        help='Ticks measured per list size, operation and storage')
+    main(parser.parse_args().repeat)
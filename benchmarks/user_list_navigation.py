@@ -0,0 +1,108 @@
+"""
+Swipe latency on user lists
+
+Measures how long it takes to get the next and previous problem of a
+user ticklist of 10, 100 and 1000 entries spread over several gyms, and
+how many DDBB round trips each swipe needs.
+
+Run from the project root with the local DDBB up (see docs/testing):
+
+    python -m benchmarks.user_list_navigation
+"""
+import argparse
+import random
+from datetime import datetime, timedelta
+
+import db.mongodb_controller as mongodb_controller
+from db import catalog as gym_catalog
+from benchmarks.utils import CommandCounter, get_benchmark_database
+from benchmarks.utils import print_table, summarize, time_calls
+
+GYMS = ['bench_nav_1', 'bench_nav_2', 'bench_nav_3']
+SECTIONS = ['latest_wall', 'old_wall']
+USER_ID = 'bench_nav_user'
+LIST_SIZES = [10, 100, 1000]
+
+
+def seed(db, list_size: int) -> list[str]:
+    """
+    Create the benchmark gyms and a user whose ticklist has list_size entries
+    """
+    cleanup(db)
+    ticklist = []
+    for gym in GYMS:
+        db[f'{gym}_walls'].insert_many([
+            {'image': SECTIONS[0], 'name': SECTIONS[0], 'radius': 0.02, 'latest': True},
+            {'image': SECTIONS[1], 'name': SECTIONS[1], 'radius': 0.02, 'latest': False},
+        ])
+    gym_catalog.invalidate()
+    for index in range(list_size):
+        gym = GYMS[index % len(GYMS)]
+        boulder = {
+            'creator': 'benchmark',
+            'difficulty': random.randint(0, 3),
+            'feet': 'free',
+            'holds': [{'color': '#00ff00', 'x': random.random(), 'y': random.random()}
+                      for _ in range(10)],
+            'name': f'bench_{index}',
+            'notes': '',
+            'rating': random.randint(0, 5),
+            'raters': 1,
+            'repetitions': random.randint(0, 10),
+            'section': random.choice(SECTIONS),
+            'time': (datetime(2022, 1, 1) + timedelta(minutes=index)).isoformat(),
+        }
+        boulder_id = db[f'{gym}_boulders'].insert_one(boulder).inserted_id
+        ticklist.append({
+            'user_id': USER_ID,
+            'iden': str(boulder_id),
+            'gym': gym,
+            'is_done': random.random() < 0.5,
+            'section': boulder['section'],
+        })
+    db['users'].insert_one({'id': USER_ID})
+    db[mongodb_controller.TICKLIST_COLLECTION].insert_many(ticklist)
+    return [problem['iden'] for problem in ticklist]
+
+
+def cleanup(db) -> None:
+    for gym in GYMS:
+        db[f'{gym}_walls'].drop()
+        db[f'{gym}_boulders'].drop()
+    db['users'].delete_many({'id': USER_ID})
+    db[mongodb_controller.TICKLIST_COLLECTION].delete_many({'user_id': USER_ID})
+
+
+def main(repeat: int) -> None:
+    counter = CommandCounter()
+    db = get_benchmark_database([counter])
+    rows = []
+    try:
+        for list_size in LIST_SIZES:
+            ids = seed(db, list_size)
+            current = ids[len(ids) // 2]
+            for name, navigate in (
+                ('next', mongodb_controller.get_next_boulder_from_user_list),
+                ('previous', mongodb_controller.get_previous_boulder_from_user_list),
+            ):
+                def swipe():
+                    navigate(current, 'ticklist', USER_ID, True,
+                             'difficulty', True, 'all', db)
+                counter.reset()
+                swipe()
+                round_trips = counter.count
+                stats = summarize(time_calls(swipe, repeat))
+                rows.append([list_size, name, round_trips,
+                             stats['p50'], stats['p95'], stats['mean']])
+    finally:
+        cleanup(db)
+        db.client.close()
+    print_table(
+        ['entries', 'swipe', 'round trips', 'p50 (ms)', 'p95 (ms)', 'mean (ms)'], rows)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('-r', '--repeat', type=int, default=50,
+                        help='Swipes measured per list size')
+    main(parser.parse_args().repeat)
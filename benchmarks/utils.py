@@ -0,0 +1,143 @@
+import contextlib
+import shutil
+import socket
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
+from typing import Callable, Iterator, Optional
+
+from pymongo import MongoClient, monitoring
+from pymongo.errors import ConnectionFailure
+from pymongo.database import Database
+
+from src.config import CREDS_LOCAL, DB_NAME
+
+
+class CommandCounter(monitoring.CommandListener):
+    """
+    Count the commands sent to the DDBB, to make round trips visible.
+    Commands may be sent from several threads.
+    """
+
+    def __init__(self) -> None:
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.count = 0
+
+    def started(self, event) -> None:
+        with self._lock:
+            self.count += 1
+
+    def succeeded(self, event) -> None:
+        pass
+
+    def failed(self, event) -> None:
+        pass
+
+
+def get_creds(file: str = CREDS_LOCAL) -> str:
+    """
+    Get the connection string of the local benchmarking DDBB
+    """
+    with open(file, 'r') as f:
+        return f.readline().strip()
+
+
+def get_benchmark_database(
+        listeners: Optional[list] = None, uri: Optional[str] = None, name: str = DB_NAME) -> Database:
+    """
+    Connect to the local DDBB (the one launched with docker-compose),
+    or to the one at uri
+    """
+    client = MongoClient(uri or get_creds(), event_listeners=listeners or [])
+    return client[name]
+
+
+def get_free_port() -> int:
+    """
+    A local port nobody is listening on
+    """
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@contextlib.contextmanager
+def launch_mongod(binary: str = 'mongod', timeout: float = 30) -> Iterator[str]:
+    """
+    Run a throwaway mongod on a free local port with its data in a
+    temporary directory, and yield its connection string. The server
+    and its data are removed on exit.
+    """
+    port = get_free_port()
+    dbpath = tempfile.mkdtemp(prefix='rocolib_bench_')
+    process = subprocess.Popen(
+        [binary, '--dbpath', dbpath, '--port', str(port), '--bind_ip', '127.0.0.1', '--quiet'],
+        stdout=subprocess.DEVNULL
+    )
+    uri = f'mongodb://127.0.0.1:{port}'
+    try:
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                with MongoClient(uri, serverSelectionTimeoutMS=500) as client:
+                    client.admin.command('ping')
+                break
+            except ConnectionFailure:
+                if process.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError(f'{binary} did not start')
+        yield uri
+    finally:
+        process.terminate()
+        process.wait()
+        shutil.rmtree(dbpath, ignore_errors=True)
+
+
+def time_calls(func: Callable, repeat: int) -> list[float]:
+    """
+    Call func repeat times and return the duration of each call in ms
+    """
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def percentile(samples: list[float], pct: float) -> float:
+    """
+    Nearest-rank percentile of a list of samples
+    """
+    ordered = sorted(samples)
+    rank = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def summarize(samples: list[float]) -> dict[str, float]:
+    """
+    Latency summary of a list of samples in ms
+    """
+    return {
+        'mean': statistics.mean(samples),
+        'p50': percentile(samples, 50),
+        'p95': percentile(samples, 95),
+        'p99': percentile(samples, 99),
+    }
+
+
+def print_table(headers: list[str], rows: list[list]) -> None:
+    """
+    Print rows as an aligned plain text table
+    """
+    def fmt(value):
+        return f'{value:.2f}' if isinstance(value, float) else str(value)
+    cells = [headers] + [[fmt(value) for value in row] for row in rows]
+    widths = [max(len(row[i]) for row in cells) for i in range(len(headers))]
+    for row in cells:
+        print('  '.join(cell.rjust(width) for cell, width in zip(row, widths)))
@@ -0,0 +1,149 @@
+import copy
+import threading
+import time
+from typing import Optional
+
+from pymongo.database import Database
+
+from db import versions
+from src import metrics
+from src.config import *
+from src.typing import Data
+
+# The admin scripts increase the version of the catalog every time they
+# add or remove a gym, so that every worker reloads it.
+CATALOG_VERSION_ID = 'catalog'
+
+
+class Catalog:
+    """
+    Snapshot of the gyms and their walls at a given catalog version.
+
+    Gyms are read when the snapshot is built. Walls are read the first
+    time each gym is asked for, as some gyms may never be visited.
+    """
+
+    def __init__(self, version: int, gyms: list[Data]) -> None:
+        self.version = version
+        self.gyms = gyms
+        self.gyms_by_id = {gym.get('id', ''): gym for gym in gyms}
+        self.walls: dict[str, list[Data]] = {}
+
+
+# Catalog of each DDBB used by this process and the last time its
+# version was checked, keyed by DDBB name
+_catalogs: dict[str, Catalog] = {}
+_checked_at: dict[str, float] = {}
+_lock = threading.Lock()
+
+
+def _serialize(document: Data) -> Data:
+    document['_id'] = str(document['_id'])
+    return document
+
+
+def get_version(database: Database) -> int:
+    """
+    Get the catalog version stored in the DDBB
+    """
+    return versions.get_version(CATALOG_VERSION_ID, database)
+
+
+def bump_version(database: Database) -> None:
+    """
+    Mark the catalog as modified, so that every process reloads it
+    """
+    versions.bump_version(CATALOG_VERSION_ID, database)
+    invalidate(database.name)
+
+
+def invalidate(database_name: Optional[str] = None) -> None:
+    """
+    Drop the catalog of a DDBB, or of every DDBB, so that it is
+    read again on next use
+    """
+    with _lock:
+        if database_name is None:
+            _catalogs.clear()
+        else:
+            _catalogs.pop(database_name, None)
+
+
+def get_catalog(database: Database) -> Catalog:
+    """
+    Get the catalog of a DDBB, reloading it when its version has
+    changed. The version is checked at most once every
+    CATALOG_CHECK_INTERVAL seconds.
+
+    The returned catalog is shared and must not be modified.
+    """
+    name = database.name
+    catalog = _catalogs.get(name)
+    if catalog is not None and time.monotonic() - _checked_at.get(name, 0.0) < CATALOG_CHECK_INTERVAL:
+        metrics.count_cache_lookup('catalog', True)
+        return catalog
+    with _lock:
+        # another thread may have checked it while waiting for the lock
+        reloaded = False
+        catalog = _catalogs.get(name)
+        if catalog is None or time.monotonic() - _checked_at.get(name, 0.0) >= CATALOG_CHECK_INTERVAL:
+            version = get_version(database)
+            if catalog is None or catalog.version != version:
+                gyms = [_serialize(gym) for gym in database['walls'].find()]
+                catalog = _catalogs[name] = Catalog(version, gyms)
+                reloaded = True
+            _checked_at[name] = time.monotonic()
+        metrics.count_cache_lookup('catalog', not reloaded)
+        return catalog
+
+
+def _get_walls(catalog: Catalog, gym: str, database: Database) -> list[Data]:
+    # unknown gyms are not cached, so that clients cannot fill the cache
+    if gym not in catalog.gyms_by_id:
+        return []
+    walls = catalog.walls.get(gym)
+    metrics.count_cache_lookup('walls', walls is not None)
+    if walls is None:
+        walls = [_serialize(wall) for wall in database[f'{gym}_walls'].find()]
+        catalog.walls[gym] = walls
+    return walls
+
+
+def get_gyms(database: Database) -> list[Data]:
+    """
+    Get the list of available gyms
+    """
+    return copy.deepcopy(get_catalog(database).gyms)
+
+
+def get_gym(gym: str, database: Database) -> Optional[Data]:
+    """
+    Get a gym by its id, or None if it does not exist
+    """
+    data = get_catalog(database).gyms_by_id.get(gym)
+    return copy.deepcopy(data) if data else None
+
+
+def get_gym_walls(gym: str, database: Database, latest: bool = False) -> list[Data]:
+    """
+    Get the list of walls of a gym, optionally only the
+    ones of the latest set
+    """
+    walls = _get_walls(get_catalog(database), gym, database)
+    return [
+        copy.deepcopy(wall) for wall in walls
+        if not latest or wall.get('latest') is True
+    ]
+
+
+def get_all_walls(database: Database) -> tuple[Catalog, dict[str, list[Data]]]:
+    """
+    Get the catalog along with the walls of every listed gym.
+
+    The returned walls are shared and must not be modified.
+    """
+    catalog = get_catalog(database)
+    return catalog, {
+        gym_id: _get_walls(catalog, gym_id, database)
+        for gym_id in catalog.gyms_by_id
+    }
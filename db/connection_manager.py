@@ -0,0 +1,89 @@
+import os
+import threading
+
+import pymongo
+from pymongo.database import Database
+
+from db import instrumentation
+from src.config import *
+
+# One pooled client per connection string and per process.
+_clients: dict[str, pymongo.MongoClient] = {}
+_clients_lock = threading.Lock()
+_owner_pid = os.getpid()
+
+
+def _reset_after_fork() -> None:
+    """
+    Forget the clients inherited from the parent process.
+
+    MongoClient instances are not fork-safe: their sockets and monitor
+    threads belong to the process that created them. When gunicorn
+    forks its workers (for instance with --preload) each child has to
+    build its own client, so the inherited references are discarded
+    without closing them, as closing would also affect the parent.
+    """
+    global _clients, _clients_lock, _owner_pid
+    _clients = {}
+    _clients_lock = threading.Lock()
+    _owner_pid = os.getpid()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _create_client(uri: str) -> pymongo.MongoClient:
+    """
+    Build a new pooled client for the given connection string
+    """
+    return pymongo.MongoClient(
+        uri,
+        maxPoolSize=MONGO_MAX_POOL_SIZE,
+        minPoolSize=MONGO_MIN_POOL_SIZE,
+        maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+        serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+        socketTimeoutMS=None,
+        # do not open sockets until the first operation, so that a
+        # client created before forking never touches the network
+        connect=False,
+        # attribute every command to the request that sends it
+        event_listeners=[instrumentation.listener],
+    )
+
+
+def get_client(uri: str) -> pymongo.MongoClient:
+    """
+    Get the process-wide pooled client for a connection string,
+    creating it on first use.
+    """
+    if os.getpid() != _owner_pid:
+        # fallback for platforms without os.register_at_fork
+        _reset_after_fork()
+    client = _clients.get(uri)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(uri)
+            if client is None:
+                client = _create_client(uri)
+                _clients[uri] = client
+    return client
+
+
+def get_database(uri: str, db_name: str = DB_NAME) -> Database:
+    """
+    Get a database handle backed by the pooled client of the
+    given connection string
+    """
+    return get_client(uri)[db_name]
+
+
+def close_all() -> None:
+    """
+    Close every client owned by the current process
+    """
+    with _clients_lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
@@ -0,0 +1,348 @@
+"""
+Indexes required by the queries of the controller, declared per
+collection family: the collections shared by every gym and the
+collections of each gym, named after its code.
+
+The application ensures them when each worker starts, before it
+handles any request, and scripts/py/add_gym.py when it creates a gym. Run from
+the project root to list the indexes the DDBB is missing, to create
+them, and to print the plan MongoDB picks for each controller query:
+
+    python -m db.indexes [--creds CREDS] [--gym GYM] [--ensure] [--explain]
+"""
+import argparse
+import logging
+import threading
+from typing import Iterable, Optional
+
+from bson.objectid import ObjectId
+from pymongo import IndexModel
+from pymongo.database import Database
+from pymongo.errors import OperationFailure
+
+# Fields the problems of a gym can be sorted by when navigating through
+# them, besides the creation date, which is the _id order (see
+# SORTING_FIELD_MAP in the controller)
+NAVIGATION_FIELDS = ('difficulty', 'section', 'rating', 'repetitions')
+# Collection that lists the gyms (see db/catalog.py)
+GYMS_COLLECTION = 'walls'
+
+logger = logging.getLogger(__name__)
+
+
+def _get_navigation_indexes() -> list[IndexModel]:
+    """
+    Compound indexes that back the problem navigation queries. Both
+    directions of the selected field are required since newer problems
+    always go first. Their prefixes back the filters by section,
+    difficulty and rating as well.
+    """
+    return [
+        IndexModel([(field, direction), ('time', -1), ('_id', 1)])
+        for field in NAVIGATION_FIELDS
+        for direction in (1, -1)
+    ]
+
+
+# Indexes of the collections shared by every gym, by collection name
+COLLECTION_INDEXES: dict[str, list[IndexModel]] = {
+    'users': [
+        IndexModel([('id', 1)]),
+        IndexModel([('email', 1)]),
+        IndexModel([('name', 1)]),
+    ],
+    # also backs the $lookup of the preferences of a user
+    'user_preferences': [IndexModel([('user_id', 1)])],
+    # backs the upserts and deletes of single entries and the reads
+    # of the ticklist of a user, optionally restricted to a gym
+    'ticklist_entries': [IndexModel([('user_id', 1), ('gym', 1), ('iden', 1)], unique=True)],
+}
+# Indexes of the collections of each gym, by collection name suffix
+GYM_COLLECTION_INDEXES: dict[str, list[IndexModel]] = {
+    'boulders': [IndexModel([('name', 1)]), *_get_navigation_indexes()],
+    'circuits': [IndexModel([('name', 1)]), IndexModel([('section', 1)])],
+}
+
+# DDBBs whose indexes have already been ensured by this process, and
+# collections of each DDBB, by DDBB and collection name
+_indexed_databases = set()
+_indexed_collections = set()
+_lock = threading.Lock()
+
+
+def get_gym_codes(database: Database) -> list[str]:
+    """
+    Codes of the gyms listed in the DDBB
+    """
+    return [gym['id'] for gym in database[GYMS_COLLECTION].find({}, {'id': 1}) if gym.get('id')]
+
+
+def get_gym_indexes(gym: str) -> dict[str, list[IndexModel]]:
+    """
+    Indexes of the collections of a gym, by collection name
+    """
+    return {f'{gym}_{suffix}': indexes for suffix, indexes in GYM_COLLECTION_INDEXES.items()}
+
+
+def get_required_indexes(database: Database, gyms: Optional[Iterable[str]] = None) -> dict[str, list[IndexModel]]:
+    """
+    Indexes of the shared collections and of the collections of the
+    given gyms, or of every listed gym, by collection name
+    """
+    required = dict(COLLECTION_INDEXES)
+    for gym in gyms if gyms is not None else get_gym_codes(database):
+        required.update(get_gym_indexes(gym))
+    return required
+
+
+def ensure_collection_indexes(collection: str, database: Database) -> None:
+    """
+    Create the indexes of one of the shared collections. Existing
+    indexes are left as they are.
+    """
+    database[collection].create_indexes(COLLECTION_INDEXES[collection])
+
+
+def ensure_gym_indexes(gym: str, database: Database) -> None:
+    """
+    Create the indexes of the collections of a gym, which creates
+    the collections too
+    """
+    for collection, indexes in get_gym_indexes(gym).items():
+        database[collection].create_indexes(indexes)
+
+
+def ensure_indexes(database: Database, gyms: Optional[Iterable[str]] = None) -> None:
+    """
+    Create the indexes of the shared collections and of the
+    collections of the given gyms, or of every listed gym
+    """
+    for collection, indexes in get_required_indexes(database, gyms).items():
+        database[collection].create_indexes(indexes)
+
+
+def _claim_collections(collections: Iterable[str], database: Database) -> list[str]:
+    """
+    Collections whose indexes this process has not ensured yet, which
+    are marked as ensured so that concurrent requests skip them
+    """
+    with _lock:
+        claimed = [name for name in collections if (database.name, name) not in _indexed_collections]
+        _indexed_collections.update((database.name, name) for name in claimed)
+    return claimed
+
+
+def _create_indexes_once(required: dict[str, list[IndexModel]], database: Database) -> None:
+    """
+    Create the indexes of the collections not ensured yet by this
+    process. Indexes are an optimization, so the application keeps
+    working if some cannot be created, for instance because the user
+    lacks the privileges or a unique index conflicts with duplicated
+    legacy documents. Collections whose indexes could not be created
+    because the DDBB is unreachable are tried again the next time.
+    """
+    for collection in _claim_collections(required, database):
+        try:
+            database[collection].create_indexes(required[collection])
+        except OperationFailure as error:
+            logger.warning('Could not create the indexes of %s.%s: %s', database.name, collection, error)
+        except Exception:
+            with _lock:
+                _indexed_collections.discard((database.name, collection))
+            raise
+
+
+def ensure_indexes_once(database: Database) -> None:
+    """
+    Ensure every index once per process and DDBB
+    """
+    with _lock:
+        if database.name in _indexed_databases:
+            return
+        _indexed_databases.add(database.name)
+    _create_indexes_once(get_required_indexes(database), database)
+
+
+def ensure_collection_indexes_once(collection: str, database: Database) -> None:
+    """
+    Ensure the indexes of one of the shared collections once
+    per process and DDBB
+    """
+    _create_indexes_once({collection: COLLECTION_INDEXES[collection]}, database)
+
+
+def ensure_gym_indexes_once(gym: str, database: Database) -> None:
+    """
+    Ensure the indexes of the collections of a gym once per process
+    and DDBB, in case the gym was created after the process ensured
+    every index
+    """
+    _create_indexes_once(get_gym_indexes(gym), database)
+
+
+def reset_indexes_once() -> None:
+    """
+    Forget which indexes this process has ensured, so that
+    they are ensured again
+    """
+    with _lock:
+        _indexed_databases.clear()
+        _indexed_collections.clear()
+
+
+def _get_key(index: IndexModel) -> list[tuple[str, int]]:
+    return [(field, int(direction)) for field, direction in index.document['key'].items()]
+
+
+def get_missing_indexes(database: Database, gyms: Optional[Iterable[str]] = None) -> list[tuple[str, IndexModel]]:
+    """
+    Required indexes that the DDBB does not have, as collection
+    name and index pairs. Indexes are compared by their keys.
+    """
+    missing = []
+    existing_collections = set(database.list_collection_names())
+    for collection, indexes in get_required_indexes(database, gyms).items():
+        existing = []
+        if collection in existing_collections:
+            existing = [
+                [(field, int(direction)) for field, direction in info['key']]
+                for info in database[collection].index_information().values()
+            ]
+        missing += [(collection, index) for index in indexes if _get_key(index) not in existing]
+    return missing
+
+
+def get_controller_queries(gym: str) -> list[tuple[str, str, dict, Optional[list]]]:
+    """
+    Representative queries of the controller on the collections of a
+    gym, as description, collection name, filter and sort
+    """
+    from db.mongodb_controller import SORTING_FIELD_MAP
+    from db.mongodb_controller import build_seek_condition, get_navigation_order
+    boulders, circuits = f'{gym}_boulders', f'{gym}_circuits'
+    queries = [
+        ('boulder by id', boulders, {'_id': {'$in': ['', ObjectId()]}}, None),
+        ('boulder by name', boulders, {'name': ''}, None),
+        ('boulders of the latest walls', boulders, {'section': {'$in': ['']}}, None),
+        ('boulders by difficulty', boulders, {'difficulty': 0}, None),
+        ('boulders by rating', boulders, {'rating': {'$lt': 3.5, '$gt': 2.5}}, None),
+        ('boulder list page', boulders, {'_id': {'$gt': ObjectId()}}, [('_id', 1)]),
+    ]
+    current = {'_id': ObjectId(), 'time': '', **{field: 0 for field in NAVIGATION_FIELDS}}
+    for sort_by in SORTING_FIELD_MAP:
+        order = get_navigation_order(sort_by, True)
+        queries.append((
+            f'next boulder by {sort_by}', boulders,
+            {'$or': build_seek_condition(order, current)}, order
+        ))
+    queries += [
+        ('circuit by name', circuits, {'name': ''}, None),
+        ('circuits of the latest walls', circuits, {'section': {'$in': ['']}}, None),
+        ('circuit list page', circuits, {'_id': {'$gt': ObjectId()}}, [('_id', 1)]),
+    ]
+    return queries
+
+
+def get_shared_queries() -> list[tuple[str, str, dict, Optional[list]]]:
+    """
+    Representative queries of the controller on the shared
+    collections, as description, collection name, filter and sort
+    """
+    return [
+        ('user by id', 'users', {'id': ''}, None),
+        ('user by email', 'users', {'email': ''}, None),
+        ('user by name', 'users', {'name': ''}, None),
+        ('user preferences', 'user_preferences', {'user_id': ''}, None),
+        ('ticklist entry', 'ticklist_entries', {'user_id': '', 'gym': '', 'iden': ''}, None),
+        ('ticklist of a gym', 'ticklist_entries', {'user_id': '', 'gym': ''}, [('_id', 1)]),
+    ]
+
+
+def describe_plan(plan: dict) -> str:
+    """
+    One line summary of a query plan: its stages from the
+    outermost in, with the index used by each index scan
+    """
+    stage = plan.get('stage', '?')
+    if 'indexName' in plan:
+        stage = f"{stage} {plan['indexName']}"
+    if 'inputStage' in plan:
+        return f"{stage} > {describe_plan(plan['inputStage'])}"
+    if 'inputStages' in plan:
+        return f"{stage} [{', '.join(describe_plan(input_stage) for input_stage in plan['inputStages'])}]"
+    return stage
+
+
+def _find_query_planner(explanation) -> Optional[dict]:
+    """
+    First query planner section of an explain result. Aggregations
+    nest it in their first stage unless the whole pipeline is
+    pushed down to the query engine.
+    """
+    if isinstance(explanation, dict):
+        if 'queryPlanner' in explanation:
+            return explanation['queryPlanner']
+        explanation = list(explanation.values())
+    if isinstance(explanation, list):
+        for value in explanation:
+            query_planner = _find_query_planner(value)
+            if query_planner is not None:
+                return query_planner
+    return None
+
+
+def describe_explanation(explanation: dict) -> str:
+    """
+    One line summary of the winning plan of an explain result
+    """
+    query_planner = _find_query_planner(explanation)
+    if query_planner is None:
+        return '?'
+    winning_plan = query_planner['winningPlan']
+    # the plan is nested when the slot based engine runs the query
+    return describe_plan(winning_plan.get('queryPlan', winning_plan))
+
+
+def explain(queries: list[tuple[str, str, dict, Optional[list]]], database: Database) -> list[tuple[str, str, str]]:
+    """
+    Plan MongoDB picks for each query, as description,
+    collection name and plan summary
+    """
+    plans = []
+    for description, collection, query, sort in queries:
+        cursor = database[collection].find(query).limit(1)
+        if sort:
+            cursor = cursor.sort(sort)
+        plans.append((description, collection, describe_explanation(cursor.explain())))
+    return plans
+
+
+if __name__ == '__main__':
+    from db import connection_manager
+    from src.config import CREDS
+
+    parser = argparse.ArgumentParser(description='Report and create the indexes of the DDBB')
+    parser.add_argument('-c', '--creds', help='File with the DDBB connection string',
+                        type=str, default=CREDS)
+    parser.add_argument('-g', '--gym', help='Only check the collections of this gym',
+                        type=str, default=None)
+    parser.add_argument('--ensure', help='Create the missing indexes',
+                        action='store_true')
+    parser.add_argument('--explain', help='Print the plan of each controller query',
+                        action='store_true')
+    args = parser.parse_args()
+    with open(args.creds) as f:
+        database = connection_manager.get_database(f.readline().strip())
+    gyms = [args.gym] if args.gym else get_gym_codes(database)
+    if args.ensure:
+        ensure_indexes(database, gyms)
+    missing = get_missing_indexes(database, gyms)
+    for collection, index in missing:
+        print(f'Missing\t{collection}\t{_get_key(index)}')
+    print(f'{len(missing)} missing indexes')
+    if args.explain:
+        queries = get_shared_queries()
+        for gym in gyms:
+            queries += get_controller_queries(gym)
+        for description, collection, plan in explain(queries, database):
+            print(f'{collection}\t{description}\t{plan}')
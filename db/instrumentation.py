@@ -0,0 +1,256 @@
+"""
+Attribution of the DDBB commands to the request that sends them.
+
+Every pooled client (see db/connection_manager.py) reports its commands
+to a command listener, which adds their count, duration and number of
+returned documents to the statistics of the request being handled by
+the thread that sent them. Requests are delimited with start and
+finish, and finished requests are added to per-process totals by
+endpoint.
+
+The listener also records the duration of every command in the
+metrics of the controller function that sent it (see src/metrics.py),
+as the public controller functions are instrumented when the
+controller is imported.
+"""
+import contextvars
+import functools
+import inspect
+import threading
+import time
+from collections import Counter
+from types import ModuleType
+from typing import Callable, Iterator, Optional
+
+from pymongo import monitoring
+
+from src import metrics
+from src.typing import Data
+
+# Label of the commands sent outside of the controller functions
+NO_FUNCTION = 'none'
+
+FUNCTION_DURATION = metrics.Histogram(
+    'rocolib_mongo_function_duration_seconds',
+    'Duration of the calls to the DDBB controller functions, by function', ('function',))
+COMMAND_DURATION = metrics.Histogram(
+    'rocolib_mongo_command_duration_seconds',
+    'Duration of the DDBB commands, by controller function and command', ('function', 'command'))
+COMMAND_ERRORS = metrics.Counter(
+    'rocolib_mongo_command_errors_total',
+    'Failed DDBB commands, by controller function and command', ('function', 'command'))
+
+
+class RequestStats():
+    """
+    DDBB commands sent while handling a request
+    """
+
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.commands: Counter = Counter()
+        self.durations: Counter = Counter()
+        self.documents = 0
+        self.errors = 0
+
+    @property
+    def elapsed(self) -> float:
+        """
+        Time since the request started, in ms
+        """
+        return (time.perf_counter() - self.started) * 1000
+
+    @property
+    def count(self) -> int:
+        return sum(self.commands.values())
+
+    @property
+    def duration(self) -> float:
+        return sum(self.durations.values())
+
+    def add(self, command_name: str, duration: float, documents: int, failed: bool = False) -> None:
+        """
+        Add a command that took duration ms and returned documents
+        """
+        self.commands[command_name] += 1
+        self.durations[command_name] += duration
+        self.documents += documents
+        self.errors += failed
+
+    def to_dict(self) -> Data:
+        return {
+            'commands': self.count,
+            'duration_ms': round(self.duration, 3),
+            'documents': self.documents,
+            'errors': self.errors,
+            'by_command': {
+                name: {'count': count, 'duration_ms': round(self.durations[name], 3)}
+                for name, count in self.commands.items()
+            },
+        }
+
+
+# Statistics of the request handled by the current thread, if any
+_current: contextvars.ContextVar[Optional[RequestStats]] = contextvars.ContextVar(
+    'request_stats', default=None)
+# Controller function being run by the current thread, if any
+_function: contextvars.ContextVar[str] = contextvars.ContextVar('controller_function', default=NO_FUNCTION)
+# Totals of the finished requests of this process, by endpoint
+_totals: dict[str, Counter] = {}
+_lock = threading.Lock()
+
+
+def _count_documents(reply: Data) -> int:
+    """
+    Number of documents returned by a command, from its reply
+    """
+    cursor = reply.get('cursor')
+    if cursor is not None:
+        return len(cursor.get('firstBatch', cursor.get('nextBatch', [])))
+    if reply.get('value') is not None:
+        # findAndModify
+        return 1
+    return 0
+
+
+class CommandListener(monitoring.CommandListener):
+    """
+    Add the commands that succeed or fail to the statistics
+    of the current request. Commands sent outside of a request
+    are not recorded.
+    """
+
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        pass
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        COMMAND_DURATION.observe(
+            event.duration_micros / 1e6, function=_function.get(), command=event.command_name)
+        stats = _current.get()
+        if stats is not None:
+            stats.add(event.command_name, event.duration_micros / 1000, _count_documents(event.reply))
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        COMMAND_DURATION.observe(
+            event.duration_micros / 1e6, function=_function.get(), command=event.command_name)
+        COMMAND_ERRORS.inc(function=_function.get(), command=event.command_name)
+        stats = _current.get()
+        if stats is not None:
+            stats.add(event.command_name, event.duration_micros / 1000, 0, failed=True)
+
+
+listener = CommandListener()
+
+
+def start() -> RequestStats:
+    """
+    Start recording the commands of the request handled by
+    the current thread
+    """
+    stats = RequestStats()
+    _current.set(stats)
+    return stats
+
+
+def get_current() -> Optional[RequestStats]:
+    """
+    Statistics of the request handled by the current thread
+    """
+    return _current.get()
+
+
+def finish(endpoint: str) -> Optional[RequestStats]:
+    """
+    Stop recording the commands of the current request, add them
+    to the totals of its endpoint and return them
+    """
+    stats = _current.get()
+    if stats is None:
+        return None
+    _current.set(None)
+    with _lock:
+        totals = _totals.setdefault(endpoint, Counter())
+        totals['requests'] += 1
+        totals['commands'] += stats.count
+        totals['duration_ms'] += stats.duration
+        totals['documents'] += stats.documents
+        totals['errors'] += stats.errors
+    return stats
+
+
+def get_totals() -> dict[str, Data]:
+    """
+    Totals of the requests finished by this process, by endpoint
+    """
+    with _lock:
+        return {endpoint: dict(totals) for endpoint, totals in _totals.items()}
+
+
+def reset_totals() -> None:
+    with _lock:
+        _totals.clear()
+
+
+def get_server_timing(stats: RequestStats) -> str:
+    """
+    Server-Timing header value with the time of a request so
+    far, its DDBB time and the time of each kind of command
+    """
+    timings = [f'app;dur={stats.elapsed:.3f}']
+    timings += [f'db;dur={stats.duration:.3f};desc="{stats.count} commands, {stats.documents} documents"']
+    timings += [
+        f'db-{name};dur={stats.durations[name]:.3f};desc="{count}"'
+        for name, count in stats.commands.most_common()
+    ]
+    return ', '.join(timings)
+
+
+def instrument(function: Callable) -> Callable:
+    """
+    Record the duration of the calls to a controller function and
+    attribute the commands they send to it. Commands sent by other
+    instrumented functions that it calls are attributed to those.
+    """
+    name = function.__name__
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        token = _function.set(name)
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            FUNCTION_DURATION.observe(time.perf_counter() - start, function=name)
+            _function.reset(token)
+    return wrapper
+
+
+def instrument_module(module: ModuleType) -> None:
+    """
+    Instrument the public functions of a module that take a DDBB
+    """
+    for name, function in inspect.getmembers(module, inspect.isfunction):
+        if function.__module__ == module.__name__ and not name.startswith('_') \
+                and 'database' in inspect.signature(function).parameters:
+            setattr(module, name, instrument(function))
+
+
+def attribute_iterator(iterator: Iterator) -> Iterator:
+    """
+    Attribute the commands sent while consuming an iterator, such
+    as the streamed problem lists, to the controller function that
+    created it, since it is consumed after that function returns
+    """
+    name = _function.get()
+
+    def iter_attributed() -> Iterator:
+        while True:
+            token = _function.set(name)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                _function.reset(token)
+            yield item
+    return iter_attributed()
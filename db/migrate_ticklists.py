@@ -0,0 +1,128 @@
+"""
+Move the ticklists embedded in the user documents to the
+`ticklist_entries` collection, one document per user and problem.
+
+Run from the project root:
+
+    python -m db.migrate_ticklists [--creds CREDS] [--dry-run]
+
+Users are migrated one at a time: their entries are upserted in the
+order of the embedded list and then the embedded list is removed, so
+the migration can be stopped and run again. Entries that already exist,
+because the user ticked the problem after the application was updated,
+are merged with the embedded ones. The dates of a user whose previous
+run stopped before removing the list are already at the start of their
+entries, and are not added twice.
+"""
+import argparse
+from typing import Optional
+
+from pymongo import UpdateOne
+from pymongo.database import Database
+
+from db import connection_manager
+from db.indexes import ensure_collection_indexes
+from db.mongodb_controller import TICKLIST_COLLECTION, USERS_COLLECTION
+from db.mongodb_controller import get_ticklist_entry_query
+from src.config import CREDS
+from src.models import TICKLIST
+from src.typing import Data
+
+
+def get_climbed_dates(problem: Data) -> list[str]:
+    """
+    Climbed dates of an embedded ticklist problem. They used
+    to be stored as a single string.
+    """
+    date_climbed = problem.get('date_climbed')
+    if not date_climbed:
+        return []
+    if isinstance(date_climbed, str):
+        return [date_climbed]
+    return list(date_climbed)
+
+
+def get_stored_dates(user_id: str, database: Database) -> dict[tuple[str, str], list[str]]:
+    """
+    Climbed dates of the ticklist entries already stored for
+    a user, by gym and problem
+    """
+    entries = database[TICKLIST_COLLECTION].find(
+        {'user_id': user_id}, {'gym': 1, 'iden': 1, 'date_climbed': 1})
+    return {(entry['gym'], entry['iden']): entry.get('date_climbed') or [] for entry in entries}
+
+
+def get_entry_updates(
+        user_id: str,
+        ticklist: list[Data],
+        stored_dates: Optional[dict[tuple[str, str], list[str]]] = None) -> list[UpdateOne]:
+    """
+    Upserts of the ticklist entries of a user, in the order of the
+    embedded list. The dates of the entries that already start with
+    the embedded ones (see get_stored_dates) are not pushed again.
+    """
+    stored_dates = stored_dates or {}
+    updates = []
+    for problem in ticklist:
+        if not problem.get('iden') or not problem.get('gym'):
+            continue
+        update = {
+            '$setOnInsert': {'section': problem.get('section')},
+            '$max': {'is_done': bool(problem.get('is_done'))},
+        }
+        dates = get_climbed_dates(problem)
+        stored = stored_dates.get((problem['gym'], str(problem['iden'])), [])
+        if dates and stored[:len(dates)] != dates:
+            # older dates go first
+            update['$push'] = {'date_climbed': {'$each': dates, '$position': 0}}
+        updates.append(UpdateOne(
+            get_ticklist_entry_query(user_id, problem['gym'], problem['iden']),
+            update,
+            upsert=True
+        ))
+    return updates
+
+
+def migrate_user(user: Data, database: Database) -> int:
+    """
+    Move the embedded ticklist of a user to the ticklist entries
+    collection and return the number of entries written
+    """
+    updates = get_entry_updates(
+        user['id'], user.get(TICKLIST) or [], get_stored_dates(user['id'], database))
+    if updates:
+        database[TICKLIST_COLLECTION].bulk_write(updates, ordered=True)
+    database[USERS_COLLECTION].update_one({'_id': user['_id']}, {'$unset': {TICKLIST: ''}})
+    return len(updates)
+
+
+def migrate(database: Database, dry_run: bool = False) -> tuple[int, int]:
+    """
+    Migrate every user with an embedded ticklist and return
+    the number of users and entries migrated
+    """
+    if not dry_run:
+        ensure_collection_indexes(TICKLIST_COLLECTION, database)
+    users, entries = 0, 0
+    for user in database[USERS_COLLECTION].find(
+            {TICKLIST: {'$exists': True}}, {'id': 1, TICKLIST: 1}):
+        users += 1
+        if dry_run:
+            entries += len(get_entry_updates(user['id'], user.get(TICKLIST) or []))
+        else:
+            entries += migrate_user(user, database)
+    return users, entries
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Move embedded ticklists to their own collection')
+    parser.add_argument('-c', '--creds', help='File with the DDBB connection string',
+                        type=str, default=CREDS)
+    parser.add_argument('--dry-run', help='Only count the users and entries to migrate',
+                        action='store_true')
+    args = parser.parse_args()
+    with open(args.creds) as f:
+        database = connection_manager.get_database(f.readline().strip())
+    users, entries = migrate(database, args.dry_run)
+    action = 'To migrate' if args.dry_run else 'Migrated'
+    print(f'{action}: {entries} ticklist entries of {users} users')
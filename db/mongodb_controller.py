@@ -1,21 +1,58 @@
-from typing import Optional
+from typing import Callable, Iterator, Optional
 
 from requests import post
 from db import query_builder
+from db import catalog as gym_catalog
+from db import indexes
+from db import instrumentation
+from db import user_cache
+from db import versions
+from db import wall_index
 from src.typing import Data
 
 import functools
+import sys
 from datetime import datetime
 from bson.objectid import ObjectId
 
+from pymongo import ReturnDocument
+from pymongo.collection import Collection
+from pymongo.cursor import Cursor
 from pymongo.database import Database
+from pymongo.errors import BulkWriteError
 from pymongo.results import InsertOneResult, UpdateResult
 
 from db.query_builder import QueryBuilder
-from src.models import TICKLIST, TickListProblem
+from src.models import TICKLIST, USER_PREFERENCES, TickListProblem
 from src.config import *
 
+# Key of the cursor of the next page of a paginated list
+NEXT_PAGE = 'next'
 USERS_COLLECTION = 'users'
+USER_PREFERENCES_COLLECTION = 'user_preferences'
+TICKLIST_COLLECTION = 'ticklist_entries'
+# Fields of the ticklist entries returned to the application
+TICKLIST_ENTRY_PROJECTION = {'_id': 0, 'user_id': 0}
+# Ticklists are stored in their own collection. Users that have not
+# been migrated yet (see db/migrate_ticklists.py) still have an
+# embedded one, which is never read along with the user
+USER_PROJECTION = {TICKLIST: 0}
+
+# Maps the sorting options of the problem lists to boulder fields
+SORTING_FIELD_MAP = {
+    'creation_date': '_id',  # insertion order is by date
+    'difficulty': 'difficulty',
+    'section': 'section',
+    'rating': 'rating',
+    # Here we might have problems if not all boulders have repetitions
+    'repetitions': 'repetitions'
+}
+# Same as above, for user lists, which are sorted in memory
+USER_LIST_SORTING_FIELD_MAP = {
+    **SORTING_FIELD_MAP,
+    'difficulty': 'difficulty_int'
+}
+REVERSE_DIFFICULTY_MAP = {v: k for k, v in BOULDER_DIFFICULTY_MAP.items()}
 
 
 def preprocess_boulder_data(boulder):
@@ -35,6 +72,27 @@ def preprocess_boulder_data(boulder):
     return boulder
 
 
+def postprocess_boulder(boulder: Data) -> Data:
+    """
+    Add the missing fields of a boulder returned by the DB
+    and map the fields that are stored as codes
+    """
+    # skip if boulder data is empty for some reason
+    if not boulder:
+        return boulder
+    fields_to_check = {
+        'repetitions': 0
+    }
+    for field in fields_to_check:
+        if field in boulder:
+            continue
+        boulder[field] = fields_to_check[field]
+    for field in FIELDS_TO_MAP:
+        if field in boulder:
+            boulder[field] = FIELDS_TO_MAP[field][boulder[field]]
+    return boulder
+
+
 def postprocess_boulder_data(func):
     """
     Postprocess the data returned by the DB and add/delete
@@ -52,46 +110,16 @@ def postprocess_boulder_data(func):
         #   1. list
         #   2. dict containing multiple objects
         #   3. single object as dict
-        fields_to_check = {
-            'repetitions': 0
-        }
-        maps_to_apply = FIELDS_TO_MAP
         if isinstance(boulder_data, list):
             for boulder in boulder_data:
-                # skip if boulder data is empty for some reason
-                if not boulder:
-                    continue
-                for field in fields_to_check:
-                    if field in boulder:
-                        continue
-                    boulder[field] = fields_to_check[field]
-                for field in maps_to_apply:
-                    if field in boulder:
-                        boulder[field] = maps_to_apply[field][boulder[field]]
+                postprocess_boulder(boulder)
         elif isinstance(boulder_data, dict) and boulder_data:
             # check if Items is key
             if ITEMS in boulder_data:
                 for boulder in boulder_data[ITEMS]:
-                    # skip if boulder data is empty for some reason
-                    if not boulder:
-                        continue
-                    for field in fields_to_check:
-                        if field in boulder:
-                            continue
-                        boulder[field] = fields_to_check[field]
-                    for field in maps_to_apply:
-                        if field in boulder:
-                            boulder[field] = maps_to_apply[field][boulder[field]]
+                    postprocess_boulder(boulder)
             else:
-                # skip if boulder data is empty for some reason
-                if boulder_data:
-                    for field in fields_to_check:
-                        if field in boulder_data:
-                            continue
-                        boulder_data[field] = fields_to_check[field]
-                    for field in maps_to_apply:
-                        if field in boulder_data:
-                            boulder_data[field] = maps_to_apply[field][boulder_data[field]]
+                postprocess_boulder(boulder_data)
         return boulder_data
     return wrapper
 
@@ -149,24 +177,19 @@ def make_list_serializable(data: list[Data]) -> list[Data]:
     return data
 
 
-@serializable
 def get_gyms(database: Database) -> list[Data]:
     """
     Get the list of available gyms
     """
-    return list(database['walls'].find())
+    return gym_catalog.get_gyms(database)
 
 
-@serializable
 def get_gym_walls(gym: str, database: Database, latest: bool = False) -> list[Data]:
     """
     Return the list of available walls for a specific
     Gym
     """
-    query_builder = QueryBuilder()
-    if latest:
-        query_builder.equal('latest', True)
-    return list(database[f'{gym}_walls'].find(query_builder.query))
+    return gym_catalog.get_gym_walls(gym, database, latest)
 
 
 def get_gym_pretty_name(gym: str, database: Database) -> str:
@@ -175,8 +198,7 @@ def get_gym_pretty_name(gym: str, database: Database) -> str:
 
     IF the gym cannot be found, return an empty string
     """
-    data = database['walls'].find_one(
-        {'id': gym}, {'name': 1})  # move this cases to query builder?
+    data = gym_catalog.get_gym(gym, database)
     return data.get('name', '') if data else ''
 
 
@@ -186,9 +208,8 @@ def get_wall_name(gym_name: str, wall_section: str, database: Database) -> str:
 
     If the wall cannot be found, return an empty string
     """
-    data = database[f'{gym_name}_walls'].find_one(
-        {'image': wall_section}, {'name': 1})
-    return data.get('name', '') if data else ''
+    wall = wall_index.get_wall(gym_name, wall_section, database)
+    return wall.name if wall else ''
 
 
 def get_gym_section_name(gym: str, section, database: Database) -> str:
@@ -211,15 +232,10 @@ def get_walls_radius_all(database: Database) -> dict[str, float]:
         [...]
     }
     """
-    gym_ids = [gym['id'] for gym in get_gyms(database)]
-    walls_with_radius = {}
-    for gym in gym_ids:
-        gym_walls_list = get_gym_walls(gym, database)
-        walls_with_radius = {
-            **walls_with_radius,
-            **{f"{gym}/{wall['image']}": wall['radius'] for wall in gym_walls_list}
-        }
-    return walls_with_radius
+    return {
+        wall_path: wall.radius
+        for wall_path, wall in wall_index.get_walls(database).items()
+    }
 
 
 @serializable
@@ -248,6 +264,84 @@ def get_boulders(gym: str, database: Database) -> dict[str, list[Data]]:
     return {ITEMS: raw_boulder_data}
 
 
+def _get_page_cursor(
+        collection: Collection,
+        limit: Optional[int] = None,
+        after: Optional[str] = None,
+        projection: Optional[list[str]] = None,
+        summary: bool = False) -> Cursor:
+    """
+    Cursor over the documents of a page of a collection (see _iter_page).
+    With a limit, it returns one more document to tell whether there
+    is a next page.
+    """
+    query_builder = QueryBuilder()
+    if after:
+        query_builder.greater('_id', ObjectId(after))
+    fields = None
+    if projection:
+        fields = {field: 1 for field in projection if not (summary and field == 'holds')}
+        fields['_id'] = 1
+    elif summary:
+        fields = {'holds': 0}
+    cursor = collection.find(query_builder.query, fields).sort('_id', 1)
+    if limit:
+        # one more to know if there is a next page
+        cursor = cursor.limit(limit + 1)
+    return cursor
+
+
+def _iter_page(
+        collection: Collection,
+        process: Callable[[Data], Data],
+        limit: Optional[int] = None,
+        **page_args) -> dict[str, Iterator[Data]]:
+    """
+    Get the documents of a collection in insertion order. With a limit,
+    only that many documents are returned, starting right after the one
+    whose id is after, and the id of the last one is returned as the
+    cursor of the next page if there are more. Projection selects the
+    fields to return and summary leaves the holds out.
+
+    The returned dictionary has the 'Items' key, whose value is an
+    iterator that yields the documents, after applying process to them,
+    as they are read from the DDBB, so that pages are never loaded in
+    memory as a whole. The 'next' key is added to the dictionary once
+    the iterator is exhausted, if there is a next page.
+    """
+    page = {}
+
+    def iter_items() -> Iterator[Data]:
+        last_id = None
+        for count, document in enumerate(_get_page_cursor(collection, limit, **page_args)):
+            if limit and count == limit:
+                page[NEXT_PAGE] = str(last_id)
+                break
+            last_id = document['_id']
+            yield process(document)
+
+    page[ITEMS] = instrumentation.attribute_iterator(iter_items())
+    return page
+
+
+def iter_circuits_page(gym: str, database: Database, **page_args) -> dict[str, Iterator[Data]]:
+    """
+    Get a page of the circuits of the specified gym (see _iter_page)
+    """
+    return _iter_page(database[f'{gym}_circuits'], make_object_serializable, **page_args)
+
+
+def iter_boulders_page(gym: str, database: Database, **page_args) -> dict[str, Iterator[Data]]:
+    """
+    Get a page of the boulders of the specified gym (see _iter_page)
+    """
+    return _iter_page(
+        database[f'{gym}_boulders'],
+        lambda boulder: make_object_serializable(postprocess_boulder(boulder)),
+        **page_args
+    )
+
+
 @serializable
 def get_routes(gym: str, database: Database) -> dict[str, list[Data]]:
     """
@@ -260,6 +354,34 @@ def get_routes(gym: str, database: Database) -> dict[str, list[Data]]:
     return {ITEMS: raw_route_data}
 
 
+def count_boulders(gym: str, database: Database) -> int:
+    """
+    Get the number of boulders of the specified gym from the
+    collection metadata, without reading any document
+    """
+    return database[f'{gym}_boulders'].estimated_document_count()
+
+
+def count_routes(gym: str, database: Database) -> int:
+    """
+    Get the number of routes of the specified gym from the
+    collection metadata, without reading any document
+    """
+    return database[f'{gym}_routes'].estimated_document_count()
+
+
+def get_problems_version(gym: str, problem_type: str, database: Database) -> int:
+    """
+    Get the version of the boulders or circuits (problem_type)
+    of the specified gym, increased on every modification
+    """
+    return versions.get_version(f'{gym}_{problem_type}', database)
+
+
+def _bump_problems_version(gym: str, problem_type: str, database: Database) -> None:
+    versions.bump_version(f'{gym}_{problem_type}', database)
+
+
 @serializable
 def put_boulder(boulder_data: Data, gym: str, database: Database) -> InsertOneResult:
     """
@@ -267,10 +389,35 @@ def put_boulder(boulder_data: Data, gym: str, database: Database) -> InsertOneRe
     """
     result = database[f'{gym}_boulders'].insert_one(
         preprocess_boulder_data(boulder_data))
+    _bump_problems_version(gym, 'boulders', database)
     if result is not None:
         return result.inserted_id
 
 
+def put_boulders(boulders_data: list[Data], gym: str, database: Database) -> list[tuple[Optional[str], Optional[str]]]:
+    """
+    Store several new boulders for the specified gym in a single
+    unordered write, so that a boulder that cannot be stored does not
+    prevent the others from being stored.
+
+    Return, for each boulder, its id and None if it was stored, or
+    None and the error message of the DDBB otherwise.
+    """
+    documents = [preprocess_boulder_data(boulder) for boulder in boulders_data]
+    failed = {}
+    try:
+        # ids are set in the documents themselves
+        database[f'{gym}_boulders'].insert_many(documents, ordered=False)
+    except BulkWriteError as err:
+        failed = {error['index']: error['errmsg'] for error in err.details['writeErrors']}
+    if len(failed) < len(documents):
+        _bump_problems_version(gym, 'boulders', database)
+    return [
+        (None, failed[index]) if index in failed else (str(document['_id']), None)
+        for index, document in enumerate(documents)
+    ]
+
+
 @serializable
 def put_circuit(circuit_data: Data, gym: str, database: Database) -> InsertOneResult:
     """
@@ -278,6 +425,7 @@ def put_circuit(circuit_data: Data, gym: str, database: Database) -> InsertOneRe
     """
     result = database[f'{gym}_circuits'].insert_one(
         preprocess_boulder_data(circuit_data))
+    _bump_problems_version(gym, 'circuits', database)
     if result is not None:
         return result.inserted_id
 
@@ -292,121 +440,82 @@ def put_route(route_data: Data, gym: str, database: Database) -> InsertOneResult
         return result.inserted_id
 
 
-@serializable
-def put_boulder_in_ticklist(boulder_data: Data, user_id: str, database: Database, mark_as_done_clicked: bool = False) -> list[Data]:
+def get_ticklist_entry_query(user_id: str, gym: str, iden: str) -> dict:
+    """
+    Query matching the ticklist entry of a user for a boulder. Upserts
+    copy these fields to the entries they insert.
+    """
+    return {'user_id': user_id, 'gym': gym, 'iden': str(iden)}
+
+
+def put_boulder_in_ticklist(boulder_data: Data, user_id: str, database: Database, mark_as_done_clicked: bool = False) -> Data:
     """
     Store a new boulder in the user's ticklist, change its
     is_done status or add a new climbed date
 
-    Return the updated ticklist
-    """
-    IS_DONE = 'is_done'
-    IDEN = 'iden'
-    DATE_CLIMBED = 'date_climbed'
-    # TICKLIST = 'ticklist'
-    # USERS = 'users'
-    # user = database[USERS].find_one({'id': user_id})
-    user = database[USERS_COLLECTION].find_one(
-        QueryBuilder().equal('id', user_id).query)
-    # get ticklist
-    ticklist = user.get(TICKLIST, [])
-    # check if problem is already in the user's ticklist
-    boulder = list(filter(lambda x: x[IDEN] == boulder_data[IDEN], ticklist))
-    # Boulder is not in ticklist
-    if not boulder:
-        # Add it to ticklist, either marked as done or not
-        if boulder_data[IS_DONE] and mark_as_done_clicked:
-            boulder_data[DATE_CLIMBED] = [
-                datetime.today().strftime('%Y-%m-%d')]
-        ticklist.append(boulder_data)
-        update_user_ticklist(database, ticklist, user, user_id)
-    # boulder is already in ticklist and marked as done
-    elif boulder and mark_as_done_clicked and boulder_data[IS_DONE]:
-        # find boulder index in ticklist
-        index = find_boulder_index(boulder_data, ticklist)
-        # mark boulder as done
-        ticklist[index][IS_DONE] = boulder_data[IS_DONE]
-        # Set climbed date. If string, change to list
-        ticklist = set_climbed_date(ticklist, index)
-        update_user_ticklist(database, ticklist, user, user_id)
-    return ticklist
-
+    Only the entry of the boulder is written, with a single upsert,
+    so ticks from several devices do not overwrite each other.
 
-def update_user_ticklist(database: Database, ticklist: list[Data], user: Data, user_id: str) -> None:
+    Return the updated ticklist entry
     """
-    Update a user's ticklist, both DDBB and in memory projections
-    """
-    user[TICKLIST] = ticklist
-    database[USERS_COLLECTION].update_one(
-        QueryBuilder().equal('id', user_id).query, {'$set': user})
+    indexes.ensure_collection_indexes_once(TICKLIST_COLLECTION, database)
+    update = {'$setOnInsert': {'section': boulder_data.get('section')}}
+    if boulder_data['is_done'] and mark_as_done_clicked:
+        # mark boulder as done and add a new climbed date
+        update['$set'] = {'is_done': True}
+        update['$push'] = {'date_climbed': datetime.today().strftime('%Y-%m-%d')}
+    else:
+        # just add it to the ticklist if it is not there yet
+        update['$setOnInsert']['is_done'] = boulder_data['is_done']
+    return database[TICKLIST_COLLECTION].find_one_and_update(
+        get_ticklist_entry_query(user_id, boulder_data['gym'], boulder_data['iden']),
+        update,
+        projection=TICKLIST_ENTRY_PROJECTION,
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
 
 
-def find_boulder_index(boulder_data: Data, boulders: list[Data]) -> int:
+def delete_boulder_in_ticklist(boulder_data: Data, user_id: str, database: Database) -> bool:
     """
-    Given a list of boulders and the data from a single boulder,
-    find the boulder in the list and return its index if found.
-    Else return -1
+    Delete the selected problem from the user's ticklist
+
+    Return True if the problem was in the ticklist
     """
-    IDEN = 'iden'
-    for index, t_boulder in enumerate(boulders):
-        if t_boulder[IDEN] == boulder_data[IDEN]:
-            return index
-    return -1
+    result = database[TICKLIST_COLLECTION].delete_one(
+        get_ticklist_entry_query(user_id, boulder_data['gym'], boulder_data['iden']))
+    return result.deleted_count > 0
 
 
 @serializable
-def set_climbed_date(ticklist: list[Data], index: int, climbed_date: Optional[datetime] = None) -> list[Data]:
-    """
-    Given a list of boulders and an index, update the climbed
-    date of the boulder at the given index
-
-    Return the updated ticklist
-    """
-    DATE_CLIMBED = 'date_climbed'
-    if not climbed_date:
-        climbed_date = datetime.today()
-    # backwards compatibility, where we were storing date_climbed as a string
-    if type(ticklist[index].get(DATE_CLIMBED, None)) == str:
-        # Convert to list and add new date
-        ticklist[index][DATE_CLIMBED] = [
-            ticklist[index].get(DATE_CLIMBED),
-            climbed_date.strftime('%Y-%m-%d')
-        ]
-    # If it is already a list, add new date
-    elif type(ticklist[index].get(DATE_CLIMBED, None)) == list:
-        ticklist[index][DATE_CLIMBED] += [climbed_date.strftime('%Y-%m-%d')]
-    # date climbed does not exist yet
-    else:
-        ticklist[index][DATE_CLIMBED] = [climbed_date.strftime('%Y-%m-%d')]
-    return ticklist
+def get_ticklist(user_id: str, database: Database, gym: Optional[str] = None, is_done: Optional[bool] = None) -> list[Data]:
+    """
+    Get the entries of a user's ticklist in the order they were added,
+    optionally only those of a gym or with a given is_done status
+    """
+    query_builder = QueryBuilder().equal('user_id', user_id)
+    if gym is not None:
+        query_builder.equal('gym', gym)
+    if is_done is not None:
+        query_builder.equal('is_done', is_done)
+    return list(
+        database[TICKLIST_COLLECTION].find(
+            query_builder.query, TICKLIST_ENTRY_PROJECTION).sort('_id', 1)
+    )
 
 
-@serializable
-def delete_boulder_in_ticklist(boulder_data: Data, user_id: str, database: Database) -> list[Data]:
+def get_done_boulder_ids(user_id: str, gym: str, database: Database) -> list[str]:
     """
-    Delete the selected problem from the user's ticklist
-
-    Return the filtered list of boulders with the given one removed
+    Get the ids of the boulders of a gym that a user has marked as done
     """
-    user = database[USERS_COLLECTION].find_one(
-        QueryBuilder().equal('id', user_id).query)
-    filtered_list = []
-    if user:
-        # get ticklist
-        ticklist = user.get('ticklist', [])
-        # remove problem from list
-        filtered_list = list(
-            filter(lambda x: x['iden'] != boulder_data['iden'], ticklist))
-        user['ticklist'] = filtered_list
-        database[USERS_COLLECTION].update_one(
-            QueryBuilder().equal('id', user_id).query, {'$set': user})
-
-    return filtered_list
+    return [entry['iden'] for entry in get_ticklist(user_id, database, gym=gym, is_done=True)]
 
 
 @serializable
 @postprocess_boulder_data
 def get_user_problem_list_by_id(user_id: str, list_id: str, database: Database) -> list:
+    if list_id == TICKLIST:
+        return get_ticklist(user_id, database)
     problem_list = database[USERS_COLLECTION].find_one(
         QueryBuilder().equal('id', user_id).query, {list_id: 1})
     return problem_list.get(list_id, []) if problem_list else []
@@ -439,6 +548,51 @@ def get_ticklist_boulder(boulder: TickListProblem, database: Database) -> Data:
     return boulder_data
 
 
+@serializable
+@postprocess_boulder_data
+def get_ticklist_boulders(ticklist: list[TickListProblem], database: Database) -> list[Data]:
+    """
+    Given a list of ticklist problems, get the remaining fields of all of them
+    issuing a single query per gym instead of one (or two) per problem.
+
+    Return a list of boulder data with 'gym', 'is_done', and 'date_climbed' fields,
+    in the same order as the ticklist. Problems that cannot be found are skipped.
+    """
+    # group problem ids by gym. Ids may have been stored either as
+    # strings or as ObjectIds, so look for both representations
+    ids_by_gym = {}
+    for problem in ticklist:
+        ids = ids_by_gym.setdefault(problem.gym, [])
+        ids.append(problem.iden)
+        if ObjectId.is_valid(problem.iden):
+            ids.append(ObjectId(problem.iden))
+
+    boulders_by_gym = {}
+    for gym, ids in ids_by_gym.items():
+        boulders_by_gym[gym] = {
+            str(boulder['_id']): boulder for boulder in database[f'{gym}_boulders'].find(
+                QueryBuilder().contained_in('_id', ids).query)
+        }
+
+    boulders = []
+    for problem in ticklist:
+        boulder = boulders_by_gym[problem.gym].get(str(problem.iden))
+        if not boulder:
+            continue
+        # the same document could be referenced twice, work on a copy
+        boulder_data = dict(boulder)
+        boulder_data['gym'] = problem.gym
+        boulder_data['is_done'] = problem.is_done
+        # backwards compatibility
+        if problem.date_climbed:
+            boulder_data['date_climbed'] = problem.date_climbed if type(
+                problem.date_climbed) == list else [problem.date_climbed]
+        else:
+            boulder_data['date_climbed'] = []
+        boulders.append(boulder_data)
+    return boulders
+
+
 @serializable
 @postprocess_boulder_data
 def get_boulder_by_name(gym: str, name: str, database: Database) -> Data:
@@ -510,6 +664,131 @@ def get_random_boulder(gym: str, database: Database) -> Data:
     return boulder if boulder else {}
 
 
+def get_navigation_order(sort_by: str, is_ascending: bool) -> list[tuple[str, int]]:
+    """
+    Get the full sort specification used to navigate through the problems
+    of a gym: the selected field, then newest first and finally the
+    boulder id so that the order is total and cursors are unambiguous.
+    """
+    order = [
+        (SORTING_FIELD_MAP[sort_by], 1 if is_ascending else -1),
+        ('time', -1),
+        ('_id', 1)
+    ]
+    # ids are unique, so nothing sorts after them: sorting by creation
+    # date is then sorting by id alone, which the _id index serves
+    unique_order = []
+    for field, direction in order:
+        unique_order.append((field, direction))
+        if field == '_id':
+            break
+    return unique_order
+
+
+def _find_raw_boulder_by_id(gym: str, boulder_id: str, database: Database) -> Optional[Data]:
+    """
+    Get a boulder document as stored in the DDBB. Ids may
+    have been stored either as strings or as ObjectIds.
+    """
+    return database[f'{gym}_boulders'].find_one(_get_id_query(boulder_id))
+
+
+def _get_id_query(boulder_id: str) -> dict:
+    """
+    Query matching a boulder id stored either as a string or as an ObjectId
+    """
+    ids = [boulder_id]
+    if ObjectId.is_valid(boulder_id):
+        ids.append(ObjectId(boulder_id))
+    return QueryBuilder().contained_in('_id', ids).query
+
+
+def _strictly_after(field: str, direction: int, value) -> Optional[dict]:
+    """
+    Condition matching the values of a field that come after the given one
+    when sorting in the given direction. Missing and null values sort
+    before any other value, like MongoDB does.
+    """
+    if direction == 1:
+        if value is None:
+            return {field: {'$ne': None}}
+        return {field: {'$gt': value}}
+    if value is None:
+        # nothing comes after null in descending order
+        return None
+    return {'$or': [{field: {'$lt': value}}, {field: None}]}
+
+
+def build_seek_condition(order: list[tuple[str, int]], boulder: Data) -> list[dict]:
+    """
+    Given a sort specification and a boulder, build the list of alternative
+    conditions that match every boulder placed after it in that order:
+    (f1 > v1) or (f1 = v1 and f2 > v2) or (f1 = v1 and f2 = v2 and f3 > v3)
+    """
+    conditions = []
+    equalities = []
+    for field, direction in order:
+        value = boulder.get(field)
+        after = _strictly_after(field, direction, value)
+        if after is not None:
+            conditions.append({'$and': equalities + [after]} if equalities else after)
+        # a null value also matches missing fields
+        equalities.append({field: value})
+    return conditions
+
+
+def get_adjacent_boulder(
+        boulder_id: str,
+        gym: str,
+        user_id: str,
+        latest_wall_set: bool,
+        sort_by: str,
+        is_ascending: bool,
+        to_show: str,
+        database: Database,
+        forward: bool = True) -> Data:
+    """
+    Given a boulder id, get the boulder right after (or before) it in the
+    selected order using a keyset query, so that only the neighbour is read
+    from the DDBB instead of the whole gym.
+
+    If there is no such boulder, the given one is returned. If the given
+    boulder is not found, an empty dict is returned.
+    """
+    current = _find_raw_boulder_by_id(gym, boulder_id, database)
+    if not current:
+        return {}
+
+    indexes.ensure_gym_indexes_once(gym, database)
+
+    order = get_navigation_order(sort_by, is_ascending)
+    if not forward:
+        order = [(field, -direction) for field, direction in order]
+
+    query_builder = QueryBuilder().any_of(build_seek_condition(order, current))
+
+    if latest_wall_set:
+        walls = get_gym_walls(gym, database, latest_wall_set)
+        query_builder.contained_in(
+            'section', [wall['image'] for wall in walls])
+
+    # if show only to do, skip problems present as done in user ticklist
+    if to_show == 'to_do' and user_id:
+        done_boulders = []
+        for iden in get_done_boulder_ids(user_id, gym, database):
+            done_boulders.append(iden)
+            if ObjectId.is_valid(iden):
+                done_boulders.append(ObjectId(iden))
+        if done_boulders:
+            query_builder.not_contained_in('_id', done_boulders)
+
+    adjacent = next(
+        database[f'{gym}_boulders'].find(query_builder.query).sort(order).limit(1),
+        None
+    )
+    return adjacent if adjacent else current
+
+
 @serializable
 @postprocess_boulder_data
 def get_next_boulder(
@@ -522,7 +801,7 @@ def get_next_boulder(
         to_show: str,
         database: Database) -> Data:
     """
-    Given a boulder id, get the next boulder based on insertion date
+    Given a boulder id, get the next boulder in the selected order
 
     :param boulder_id: boulder ID for which to get next boulder
     :type boulder_id: str
@@ -530,199 +809,144 @@ def get_next_boulder(
     :type gym: str
     :param database: database connection
     :type database: Database
-    :return: next boulder if there is any, empty dict otherwise
+    :return: next boulder if there is any, the current one otherwise
     :rtype: Data
     """
-    # TODO: query can be reworked so that all happens in the DDBB and not all
-    # problems have to be retrieved
-    # build the query
-    SORTING_FIELD_MAP = {
-        'creation_date': '_id',  # insertion order is by date
-        'difficulty': 'difficulty',
-        'section': 'section',
-        'rating': 'rating',
-        # Here we might have problems if not all boulders have repetitions
-        'repetitions': 'repetitions'
-    }
-    sorting_field = SORTING_FIELD_MAP[sort_by]
-
-    query_builder = QueryBuilder()
-
-    if latest_wall_set:
-        walls = get_gym_walls(gym, database, latest_wall_set)
-        query_builder.contained_in(
-            'section', [wall['image'] for wall in walls])
-
-    boulders = list(
-        database[f'{gym}_boulders'].find(query_builder.query).sort([
-            (sorting_field, 1 if is_ascending else -1),
-            ('time', -1)
-        ])
+    return get_adjacent_boulder(
+        boulder_id,
+        gym,
+        user_id,
+        latest_wall_set,
+        sort_by,
+        is_ascending,
+        to_show,
+        database,
+        forward=True
     )
 
-    # if show only to do, remove problems present as done in user ticklist
-    if to_show == 'to_do' and user_id:
-        done_boulders = [b['iden'] for b in get_user_problem_list_by_id(
-            user_id, 'ticklist', database) if b['is_done'] == True]
-        boulders = [boulder for boulder in boulders if str(
-            boulder['_id']) not in done_boulders]
-        # [(b['name'], b['difficulty'], b['time']) for b in sorted(a, key=lambda x: (-x['difficulty'], -(datetime.datetime.strptime(x['time'], '%Y-%m-%dT%H:%M:%S.%f') - datetime.datetime(1, 1, 1)).total_seconds()))]
-
-    next_boulder = {}
-    if boulders:
-        idx = [str(b['_id']) for b in boulders].index(boulder_id)
-        if idx < len(boulders) - 1:
-            next_boulder = boulders[idx+1]
-        else:
-            next_boulder = boulders[idx]
-    return next_boulder
-
 
-@serializable
-@postprocess_boulder_data
-def get_next_boulder_from_user_list(boulder_id, list_id, user_id, latest_wall_set, sort_by, is_ascending, to_show, database):
-    SORTING_FIELD_MAP = {
-        'creation_date': '_id',  # insertion order is by date
-        'difficulty': 'difficulty_int',
-        'section': 'section',
-        'rating': 'rating',
-        # Here we might have problems if not all boulders have repetitions
-        'repetitions': 'repetitions'
-    }
-    REVERSE_MAPS = {
-        'green': 0,
-        'blue': 1,
-        'yellow': 2,
-        'red': 3
-    }
+def get_user_list_navigation(
+        user_id: str,
+        list_id: str,
+        to_show: str,
+        sort_by: str,
+        is_ascending: bool,
+        database: Database) -> list[Data]:
+    """
+    Get the problems of a user list sorted and filtered as shown in the
+    problem view. The problems are fetched with one query per gym, so the
+    number of round trips does not depend on the length of the list.
 
-    # What a pain to have to recover all boulders...
-    ticklist_p = get_user_problem_list_by_id(user_id, list_id, database)
-    problems = [get_boulder_by_id(b['gym'], b['iden'], database)
-                for b in ticklist_p]
-    # match fields
-    for p in problems:
-        for t in ticklist_p:
-            if p['_id'] == t['iden']:
-                p['gym'] = t['gym']
-                p['is_done'] = t['is_done']
-                p['difficulty_int'] = REVERSE_MAPS[p['difficulty']]
+    Each problem carries its 'gym' and 'is_done' fields.
+    """
+    ticklist = [
+        TickListProblem(problem)
+        for problem in get_user_problem_list_by_id(user_id, list_id, database)
+    ]
+    problems = get_ticklist_boulders(ticklist, database)
 
     # Apply sorting and filtering criteria
     if to_show == 'done':
         problems = [p for p in problems if p['is_done']]
     elif to_show == 'to_do':
         problems = [p for p in problems if not p['is_done']]
-    # sorted_problem_list = sorted(problems, key=lambda p: (p[SORTING_FIELD_MAP[sort_by]], (-1 if not is_ascending else 1) *datetime.timestamp(datetime.fromisoformat(p['time']))), reverse=not is_ascending)
-    problems.sort(key=lambda p: (p[SORTING_FIELD_MAP[sort_by]], (1 if not is_ascending else -1)
-                  * datetime.timestamp(datetime.fromisoformat(p['time']))), reverse=not is_ascending)
-
-    next_boulder = {}
-
-    # print([(b['name'],b[SORTING_FIELD_MAP[sort_by]],datetime.timestamp(datetime.fromisoformat(b['time']))) for b in problems])
-
-    idx = -1
-    if problems:
-        # wrap in try catch ? if not found we can keep showing the current boulder
-        idx = [b['_id'] for b in problems].index(
-            boulder_id)  # index of current boulder in list
-
-    keep_searching = True if problems and idx != - \
-        1 and idx != len(problems)-1 else False
-    gym_code = problems[idx]['gym'] if idx != -1 else ''
-    next_idx = 1
-
-    while keep_searching:
-        next_boulder = get_boulder_by_id(
-            problems[idx+next_idx]['gym'], problems[idx+next_idx]['_id'], database)
-        # check if wall section is latest wall set (wrap in function)
-        valid_gym_sections = [wall['image'] for wall in get_gym_walls(
-            problems[idx+next_idx]['gym'], database, latest_wall_set)]
+
+    # precompute the sort keys instead of parsing dates on every comparison
+    sorting_field = USER_LIST_SORTING_FIELD_MAP[sort_by]
+    time_sign = 1 if not is_ascending else -1
+    sort_keys = {}
+    for p in problems:
+        value = p.get(sorting_field)
+        if sorting_field == 'difficulty_int':
+            value = REVERSE_DIFFICULTY_MAP[p['difficulty']]
+        sort_keys[id(p)] = (
+            value, time_sign * datetime.fromisoformat(p['time']).timestamp())
+    problems.sort(key=lambda p: sort_keys[id(p)], reverse=not is_ascending)
+    return problems
+
+
+def get_adjacent_boulder_from_user_list(
+        boulder_id: str,
+        list_id: str,
+        user_id: str,
+        latest_wall_set: bool,
+        sort_by: str,
+        is_ascending: bool,
+        to_show: str,
+        database: Database,
+        forward: bool = True) -> tuple[Data, str]:
+    """
+    Given a boulder id, get the closest boulder after (or before) it in a user
+    list that belongs to a valid wall section, and the code of its gym.
+
+    If there is no such boulder, return an empty dict and the gym of the
+    given boulder. The walls of each gym are read at most once.
+    """
+    problems = get_user_list_navigation(
+        user_id, list_id, to_show, sort_by, is_ascending, database)
+
+    ids = [p['_id'] for p in problems]
+    if boulder_id not in ids:
+        return {}, ''
+    idx = ids.index(boulder_id)  # index of current boulder in list
+
+    valid_sections = {}
+    step = 1 if forward else -1
+    candidate_idx = idx + step
+    while 0 <= candidate_idx < len(problems):
+        candidate = problems[candidate_idx]
+        gym = candidate['gym']
+        if gym not in valid_sections:
+            valid_sections[gym] = [
+                wall['image'] for wall in get_gym_walls(gym, database, latest_wall_set)]
         # valid boulder, if there are more conditions, add here
-        if bool(next_boulder) and next_boulder['section'] in valid_gym_sections:
-            keep_searching = False
-            gym_code = problems[idx+next_idx]['gym']
-        elif next_idx + 1 == len(problems):
-            next_boulder = {}
-            gym_code = problems[idx]['gym']
-            keep_searching = False
-        else:
-            next_idx += 1
+        if candidate['section'] in valid_sections[gym]:
+            boulder = {
+                key: val for key, val in candidate.items()
+                if key not in ('gym', 'is_done', 'date_climbed')
+            }
+            return boulder, gym
+        candidate_idx += step
 
-    return next_boulder, gym_code
+    return {}, problems[idx]['gym']
 
 
 @serializable
 @postprocess_boulder_data
-def get_previous_boulder_from_user_list(boulder_id, list_id, user_id, latest_wall_set, sort_by, is_ascending, to_show, database):
-    # problems = get_user_problem_list_by_id(user_id, list_id, database)
-
-    SORTING_FIELD_MAP = {
-        'creation_date': '_id',  # insertion order is by date
-        'difficulty': 'difficulty_int',
-        'section': 'section',
-        'rating': 'rating',
-        # Here we might have problems if not all boulders have repetitions
-        'repetitions': 'repetitions'
-    }
-    REVERSE_MAPS = {
-        'green': 0,
-        'blue': 1,
-        'yellow': 2,
-        'red': 3
-    }
-
-    # What a pain to have to recover all boulders...
-    ticklist_p = get_user_problem_list_by_id(user_id, list_id, database)
-    problems = [get_boulder_by_id(b['gym'], b['iden'], database)
-                for b in ticklist_p]
-    # match fields
-    for p in problems:
-        for t in ticklist_p:
-            if p['_id'] == t['iden']:
-                p['gym'] = t['gym']
-                p['is_done'] = t['is_done']
-                p['difficulty_int'] = REVERSE_MAPS[p['difficulty']]
+def get_next_boulder_from_user_list(boulder_id, list_id, user_id, latest_wall_set, sort_by, is_ascending, to_show, database):
+    """
+    Given a boulder id, get the next valid boulder of a user list and its gym
+    """
+    return get_adjacent_boulder_from_user_list(
+        boulder_id,
+        list_id,
+        user_id,
+        latest_wall_set,
+        sort_by,
+        is_ascending,
+        to_show,
+        database,
+        forward=True
+    )
 
-    # Apply sorting and filtering criteria
-    if to_show == 'done':
-        problems = [p for p in problems if p['is_done']]
-    elif to_show == 'to_do':
-        problems = [p for p in problems if not p['is_done']]
-    # sorted_problem_list = sorted(problems, key=lambda p: (p[SORTING_FIELD_MAP[sort_by]], (-1 if not is_ascending else 1) *datetime.timestamp(datetime.fromisoformat(p['time']))), reverse=not is_ascending)
-    problems.sort(key=lambda p: (p[SORTING_FIELD_MAP[sort_by]], (1 if not is_ascending else -1)
-                  * datetime.timestamp(datetime.fromisoformat(p['time']))), reverse=not is_ascending)
-
-    next_boulder = {}
-
-    idx = -1
-    if problems:
-        # wrap in try catch ? if not found we can keep showing the current boulder
-        idx = [b['_id'] for b in problems].index(
-            boulder_id)  # index of current boulder in list
-
-    keep_searching = True if problems and idx != -1 and idx != 0 else False
-    gym_code = problems[idx]['gym'] if idx != -1 else ''
-    next_idx = -1
-
-    while keep_searching:
-        next_boulder = get_boulder_by_id(
-            problems[idx+next_idx]['gym'], problems[idx+next_idx]['_id'], database)
-        # check if wall section is latest wall set (wrap in function)
-        valid_gym_sections = [wall['image'] for wall in get_gym_walls(
-            problems[idx+next_idx]['gym'], database, latest_wall_set)]
-        # valid boulder, if there are more conditions, add here
-        if bool(next_boulder) and next_boulder['section'] in valid_gym_sections:
-            keep_searching = False
-            gym_code = problems[idx+next_idx]['gym']
-        elif next_idx - 1 == 0:  # no more problems in list from where to search
-            next_boulder = {}
-            gym_code = problems[idx]['gym']
-            keep_searching = False
-        else:
-            next_idx -= 1
 
-    return next_boulder, gym_code
+@serializable
+@postprocess_boulder_data
+def get_previous_boulder_from_user_list(boulder_id, list_id, user_id, latest_wall_set, sort_by, is_ascending, to_show, database):
+    """
+    Given a boulder id, get the previous valid boulder of a user list and its gym
+    """
+    return get_adjacent_boulder_from_user_list(
+        boulder_id,
+        list_id,
+        user_id,
+        latest_wall_set,
+        sort_by,
+        is_ascending,
+        to_show,
+        database,
+        forward=False
+    )
 
 
 @serializable
@@ -737,7 +961,7 @@ def get_previous_boulder(
         to_show: str,
         database: Database) -> Data:
     """
-    Given a boulder id, get the previous boulder based on insertion date
+    Given a boulder id, get the previous boulder in the selected order
 
     :param boulder_id: boulder ID for which to get next boulder
     :type boulder_id: str
@@ -745,53 +969,21 @@ def get_previous_boulder(
     :type gym: str
     :param database: database connection
     :type database: Database
-    :return: next boulder if there is any, empty dict otherwise
+    :return: previous boulder if there is any, the current one otherwise
     :rtype: Data
     """
-    # TODO: query can be reworked so that all happens in the DDBB and not all
-    # problems have to be retrieved
-    # build the query
-    SORTING_FIELD_MAP = {
-        'creation_date': '_id',  # insertion order is by date
-        'difficulty': 'difficulty',
-        'section': 'section',
-        'rating': 'rating',
-        # Here we might have problems if not all boulders have repetitions
-        'repetitions': 'repetitions'
-    }
-    sorting_field = SORTING_FIELD_MAP[sort_by]
-
-    query_builder = QueryBuilder()
-
-    if latest_wall_set:
-        walls = get_gym_walls(gym, database, latest_wall_set)
-        query_builder.contained_in(
-            'section', [wall['image'] for wall in walls])
-
-    boulders = list(
-        database[f'{gym}_boulders'].find(query_builder.query).sort([
-            (sorting_field, 1 if is_ascending else -1),
-            ('time', -1)
-        ])
+    return get_adjacent_boulder(
+        boulder_id,
+        gym,
+        user_id,
+        latest_wall_set,
+        sort_by,
+        is_ascending,
+        to_show,
+        database,
+        forward=False
     )
 
-    # if show only to do, remove problems present as done in user ticklist
-    if to_show == 'to_do' and user_id:
-        done_boulders = [b['iden'] for b in get_user_problem_list_by_id(
-            user_id, 'ticklist', database) if b['is_done'] == True]
-        boulders = [boulder for boulder in boulders if str(
-            boulder['_id']) not in done_boulders]
-        # [(b['name'], b['difficulty'], b['time']) for b in sorted(a, key=lambda x: (-x['difficulty'], -(datetime.datetime.strptime(x['time'], '%Y-%m-%dT%H:%M:%S.%f') - datetime.datetime(1, 1, 1)).total_seconds()))]
-
-    previous_boulder = {}
-    if boulders:
-        idx = [str(b['_id']) for b in boulders].index(boulder_id)
-        if idx > 0:
-            previous_boulder = boulders[idx-1]
-        else:
-            previous_boulder = boulders[idx]
-    return previous_boulder
-
 
 @serializable
 def update_boulder_by_id(gym: str, boulder_id: str, boulder_data: Data, database: Database) -> UpdateResult:
@@ -800,10 +992,66 @@ def update_boulder_by_id(gym: str, boulder_id: str, boulder_data: Data, database
     whole body of data for that boulder
     """
     boulder_data.pop('_id', None)
-    return database[f'{gym}_boulders'].update_one(
+    result = database[f'{gym}_boulders'].update_one(
         {'_id': ObjectId(boulder_id)},
         {'$set': preprocess_boulder_data(boulder_data)}
     )
+    _bump_problems_version(gym, 'boulders', database)
+    return result
+
+
+def _get_rating_update(rating: int) -> list[dict]:
+    """
+    Update pipeline that adds a rating to a boulder. The sum of all
+    ratings is kept along with their count, and the average rating is
+    stored too, since boulders are sorted and filtered by it.
+    Boulders rated before rating_sum existed get it from their average.
+    """
+    raters = {'$ifNull': ['$raters', 0]}
+    rating_sum = {
+        '$ifNull': ['$rating_sum', {'$multiply': [{'$ifNull': ['$rating', 0]}, raters]}]
+    }
+    return [
+        {'$set': {
+            'rating_sum': {'$add': [rating_sum, rating]},
+            'raters': {'$add': [raters, 1]},
+        }},
+        {'$set': {'rating': {'$divide': ['$rating_sum', '$raters']}}},
+    ]
+
+
+def rate_boulder_by_id(gym: str, boulder_id: str, rating: int, database: Database) -> UpdateResult:
+    """
+    Add a rating to a boulder in a single atomic update, so that
+    concurrent ratings are never lost
+    """
+    result = database[f'{gym}_boulders'].update_one(
+        _get_id_query(boulder_id), _get_rating_update(rating))
+    if result.matched_count:
+        _bump_problems_version(gym, 'boulders', database)
+    return result
+
+
+def rate_boulder_by_name(gym: str, name: str, rating: int, database: Database) -> UpdateResult:
+    """
+    Add a rating to a boulder, found by its name, in a single atomic update
+    """
+    result = database[f'{gym}_boulders'].update_one(
+        QueryBuilder().equal('name', name).query, _get_rating_update(rating))
+    if result.matched_count:
+        _bump_problems_version(gym, 'boulders', database)
+    return result
+
+
+def add_boulder_repetition_by_id(gym: str, boulder_id: str, database: Database) -> UpdateResult:
+    """
+    Increase the number of repetitions of a boulder in a single atomic update
+    """
+    result = database[f'{gym}_boulders'].update_one(
+        _get_id_query(boulder_id), {'$inc': {'repetitions': 1}})
+    if result.matched_count:
+        _bump_problems_version(gym, 'boulders', database)
+    return result
 
 
 @serializable
@@ -886,15 +1134,20 @@ def save_user(user_data: Data, database: Database) -> InsertOneResult:
     """
     Persist user data. Insert user_data in the given database
     """
-    query_builder = QueryBuilder().equal('id',  user_data.get('id', None))
-    found_user = database['users'].find_one(query_builder.query)
-    if not found_user:
-        return database['users'].insert_one(user_data)
+    user_id = user_data.get('id', None)
+    try:
+        query_builder = QueryBuilder().equal('id', user_id)
+        found_user = database['users'].find_one(query_builder.query)
+        if not found_user:
+            return database['users'].insert_one(user_data)
 
-    id_query = QueryBuilder().equal('_id', ObjectId(user_data['_id']))
-    user_data = {key: val for key, val in user_data.items() if key != '_id'}
-    updated_data = {"$set": user_data}
-    database['users'].update_one(id_query.query, updated_data)
+        id_query = QueryBuilder().equal('_id', ObjectId(user_data['_id']))
+        user_data = {key: val for key, val in user_data.items() if key != '_id'}
+        updated_data = {"$set": user_data}
+        database['users'].update_one(id_query.query, updated_data)
+    finally:
+        # after the write, so that data read before it is not cached
+        user_cache.invalidate(user_id)
 
 
 @serializable
@@ -903,17 +1156,62 @@ def get_user_data_by_id(user_id: str, database: Database) -> Data:
     Given a user id get its data. Return an empty dictionary if the user is not found
     """
     query_builder = QueryBuilder().equal('id', user_id)
-    user = database['users'].find_one(query_builder.query)
+    user = database['users'].find_one(query_builder.query, USER_PROJECTION)
     return user if user else {}
 
 
+def get_user_data_with_preferences(field: str, value: str, database: Database) -> tuple[Data, Data]:
+    """
+    Given the value of a user field (id, email or name) get the data of the
+    user and its preferences, joined in a single aggregation. Return two
+    empty dictionaries if the user is not found, and an empty dictionary
+    as preferences if the user has none.
+    """
+    pipeline = [
+        {'$match': QueryBuilder().equal(field, value).query},
+        {'$limit': 1},
+        {'$project': USER_PROJECTION},
+        {'$lookup': {
+            'from': USER_PREFERENCES_COLLECTION,
+            'localField': 'id',
+            'foreignField': 'user_id',
+            'as': USER_PREFERENCES,
+        }},
+    ]
+    user_data = next(database[USERS_COLLECTION].aggregate(pipeline), None)
+    if not user_data:
+        return {}, {}
+    user_prefs = user_data.pop(USER_PREFERENCES)
+    return (
+        make_object_serializable(user_data),
+        make_object_serializable(user_prefs[0]) if user_prefs else {}
+    )
+
+
+def get_cached_user_data(user_id: str, database: Database) -> tuple[Data, Data]:
+    """
+    Given a user id get its data and preferences, from the per-process
+    user cache (see db/user_cache.py) if possible. Return two empty
+    dictionaries if the user is not found
+    """
+    cached = user_cache.get(database.name, user_id)
+    if cached is not None:
+        return cached
+    generation = user_cache.get_generation()
+    user_data, user_prefs = get_user_data_with_preferences('id', user_id, database)
+    if not user_data:
+        return {}, {}
+    user_cache.put(database.name, user_id, (user_data, user_prefs), generation)
+    return user_data, user_prefs
+
+
 @serializable
 def get_user_data_by_email(email: str, database: Database) -> Data:
     """
     Given a user email get its data. Return an empty dictionary if the user is not found
     """
     query_builder = QueryBuilder().equal('email', email)
-    user = database['users'].find_one(query_builder.query)
+    user = database['users'].find_one(query_builder.query, USER_PROJECTION)
     return user if user else {}
 
 
@@ -923,7 +1221,7 @@ def get_user_data_by_username(name: str, database: Database) -> Data:
     Given a user email get its data. Return an empty dictionary if the user is not found
     """
     query_builder = QueryBuilder().equal('name', name)
-    user = database['users'].find_one(query_builder.query)
+    user = database['users'].find_one(query_builder.query, USER_PROJECTION)
     return user if user else {}
 
 
@@ -942,14 +1240,23 @@ def save_user_preferences(user_prefs: Data, database: Database) -> InsertOneResu
     """
     Save a specific user preferences 
     """
-    found_user_prefs = database['user_preferences'].find_one(
-        QueryBuilder().equal('user_id', user_prefs.get('user_id', None)).query
-    )
+    user_id = user_prefs.get('user_id', None)
+    try:
+        found_user_prefs = database['user_preferences'].find_one(
+            QueryBuilder().equal('user_id', user_id).query
+        )
+
+        if not found_user_prefs:
+            return database['user_preferences'].insert_one(user_prefs)
+
+        new_prefs = {key: val for key, val in user_prefs.items() if key != '_id'}
+        updated_prefs = {"$set": new_prefs}
+        id_query = QueryBuilder().equal('_id', ObjectId(user_prefs['_id']))
+        database['user_preferences'].update_one(id_query.query, updated_prefs)
+    finally:
+        # after the write, so that data read before it is not cached
+        user_cache.invalidate(user_id)
 
-    if not found_user_prefs:
-        return database['user_preferences'].insert_one(user_prefs)
 
-    new_prefs = {key: val for key, val in user_prefs.items() if key != '_id'}
-    updated_prefs = {"$set": new_prefs}
-    id_query = QueryBuilder().equal('_id', ObjectId(user_prefs['_id']))
-    database['user_preferences'].update_one(id_query.query, updated_prefs)
+# record the DDBB usage of every public function (see db/instrumentation.py)
+instrumentation.instrument_module(sys.modules[__name__])
@@ -31,6 +31,11 @@ class QueryBuilder:
             self._init_query()
         self._query[self._root_key] += [{property: {operator: value}}]
 
+    def _add_clause_to_query(self, clause: dict) -> None:
+        if self._is_query_empty():
+            self._init_query()
+        self._query[self._root_key] += [clause]
+
     def reset_query(self) -> None:
         self._query = {}
 
@@ -69,3 +74,7 @@ class QueryBuilder:
     @chaineable
     def contains_text(self, property: str, value) -> None:
         self._add_to_query('$regex', property, value)
+
+    @chaineable
+    def any_of(self, queries: list) -> None:
+        self._add_clause_to_query({'$or': queries})
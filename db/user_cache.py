@@ -0,0 +1,98 @@
+import copy
+import threading
+import time
+from typing import Optional
+
+from cachetools import TLRUCache, TTLCache
+
+from src import metrics
+from src.config import *
+from src.typing import Data
+
+# Data and preferences of the users loaded by this process, keyed by
+# DDBB name and user id. Entries live for USER_CACHE_TTL seconds, so
+# changes made by other processes are seen after that time at most.
+_cache: TTLCache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+# Data and preferences of the users of the verified API tokens, keyed by
+# DDBB name and token digest. Entries live until their token expires, unless the user
+# is saved before, and the least recently used ones are evicted first.
+_tokens: TLRUCache = TLRUCache(
+    maxsize=TOKEN_CACHE_SIZE, ttu=lambda _, value, now: value[0], timer=time.time)
+# Increased on every invalidation, so that data read from the DDBB
+# before a user was modified is not cached after it
+_generation = 0
+_lock = threading.Lock()
+
+
+def get_generation() -> int:
+    """
+    Get the current generation of the cache, to be given back
+    to put along with the data read after calling this function
+    """
+    return _generation
+
+
+def get(database_name: str, user_id: str) -> Optional[tuple[Data, Data]]:
+    """
+    Get a copy of the cached data and preferences of a user,
+    or None if they are not cached
+    """
+    with _lock:
+        entry = _cache.get((database_name, user_id))
+    metrics.count_cache_lookup('user', entry is not None)
+    return copy.deepcopy(entry) if entry is not None else None
+
+
+def put(database_name: str, user_id: str, entry: tuple[Data, Data], generation: int) -> None:
+    """
+    Cache the data and preferences of a user unless the cache
+    has been invalidated since they were read
+    """
+    with _lock:
+        if generation == _generation:
+            _cache[(database_name, user_id)] = copy.deepcopy(entry)
+
+
+def get_token(database_name: str, digest: str) -> Optional[tuple[Data, Data]]:
+    """
+    Get a copy of the data and preferences of the user of a verified
+    token, or None if the token is not cached or has expired
+    """
+    with _lock:
+        entry = _tokens.get((database_name, digest))
+    metrics.count_cache_lookup('token', entry is not None)
+    return copy.deepcopy(entry[2]) if entry is not None else None
+
+
+def put_token(
+        database_name: str,
+        digest: str,
+        user_id: str,
+        entry: tuple[Data, Data],
+        expires_at: float,
+        generation: int) -> None:
+    """
+    Cache the user of a verified token until the token expires (as a
+    Unix timestamp), unless the cache has been invalidated since the
+    user was read
+    """
+    with _lock:
+        if generation == _generation:
+            _tokens[(database_name, digest)] = (expires_at, user_id, copy.deepcopy(entry))
+
+
+def invalidate(user_id: Optional[str] = None) -> None:
+    """
+    Forget the cached data and tokens of a user, or of every user
+    """
+    global _generation
+    with _lock:
+        _generation += 1
+        if user_id is None:
+            _cache.clear()
+            _tokens.clear()
+            return
+        for key in [key for key in _cache.keys() if key[1] == user_id]:
+            del _cache[key]
+        for key in [key for key, value in _tokens.items() if value[1] == user_id]:
+            del _tokens[key]
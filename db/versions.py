@@ -0,0 +1,21 @@
+from pymongo.database import Database
+
+# Counters increased every time the data they name is modified, so that
+# processes and API clients can tell whether their copy is still valid
+VERSIONS_COLLECTION = 'versions'
+
+
+def get_version(key: str, database: Database) -> int:
+    """
+    Get the version of the given data stored in the DDBB
+    """
+    data = database[VERSIONS_COLLECTION].find_one({'_id': key})
+    return data.get('version', 0) if data else 0
+
+
+def bump_version(key: str, database: Database) -> None:
+    """
+    Mark the given data as modified
+    """
+    database[VERSIONS_COLLECTION].update_one(
+        {'_id': key}, {'$inc': {'version': 1}}, upsert=True)
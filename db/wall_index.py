@@ -0,0 +1,63 @@
+import threading
+from typing import NamedTuple, Optional
+
+from pymongo.database import Database
+
+from db import catalog as gym_catalog
+
+
+class WallInfo(NamedTuple):
+    """
+    Metadata of a wall section needed to render its problems
+    """
+    radius: float
+    name: str
+    latest: bool
+
+
+# In-process index of every wall section, keyed by 'gym/section',
+# and the catalog snapshot it was built from
+_walls: dict[str, WallInfo] = {}
+_source: Optional[gym_catalog.Catalog] = None
+_lock = threading.Lock()
+
+
+def get_wall_path(gym: str, section: str) -> str:
+    """
+    Key of a wall section in the index
+    """
+    return f'{gym}/{section}'
+
+
+def get_walls(database: Database) -> dict[str, WallInfo]:
+    """
+    Get the whole wall index, building it again whenever
+    the gym catalog has been reloaded.
+
+    The returned dict is shared and must not be modified.
+    """
+    global _walls, _source
+    catalog = gym_catalog.get_catalog(database)
+    if catalog is _source:
+        return _walls
+    with _lock:
+        if catalog is not _source:
+            catalog, gym_walls = gym_catalog.get_all_walls(database)
+            _walls = {
+                get_wall_path(gym, wall['image']): WallInfo(
+                    radius=wall.get('radius'),
+                    name=wall.get('name', ''),
+                    latest=wall.get('latest', False) is True,
+                )
+                for gym, walls in gym_walls.items()
+                for wall in walls
+            }
+            _source = catalog
+        return _walls
+
+
+def get_wall(gym: str, section: str, database: Database) -> Optional[WallInfo]:
+    """
+    Get the metadata of a wall section, or None if it does not exist
+    """
+    return get_walls(database).get(get_wall_path(gym, section))
@@ -0,0 +1,39 @@
+"""
+Settings of gunicorn, which reads this file from the working directory.
+
+Every worker writes its metrics to a directory shared by all of them,
+so that the worker that serves /metrics reports the metrics of the
+whole server (see src/metrics.py). Workers also create the missing
+indexes of the DDBB before they accept requests (see db/indexes.py).
+"""
+import os
+import tempfile
+
+os.environ.setdefault(
+    'METRICS_DIR', os.path.join(tempfile.gettempdir(), f'rocolib-metrics-{os.getpid()}'))
+
+# the configuration reads METRICS_DIR when it is imported
+from src import metrics
+
+
+def on_starting(server) -> None:
+    metrics.clear_directory()
+
+
+def post_worker_init(worker) -> None:
+    # before the worker accepts requests, so that none waits for them
+    from application import ensure_indexes
+    ensure_indexes()
+
+
+def worker_exit(server, worker) -> None:
+    # runs in the worker, so that its last requests are not lost
+    metrics.flush()
+
+
+def child_exit(server, worker) -> None:
+    metrics.mark_process_dead(worker.pid)
+
+
+def on_exit(server) -> None:
+    metrics.clear_directory()
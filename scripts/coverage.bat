@@ -1,5 +1,6 @@
 coverage run -p -m tests.tests
 coverage run -p -m tests.integration_tests
 coverage run -p -m tests.db_controller_tests
+coverage run -p -m tests.navigation_tests
 coverage combine
 coverage html
\ No newline at end of file
@@ -1,11 +1,17 @@
 import argparse
 import os
+import sys
 from typing import Optional
 import pymongo
 
 from PIL import Image
 from shutil import copyfile
 
+# the script is run from the project root, which is not in the path
+sys.path.insert(0, os.getcwd())
+from db import catalog
+from db import indexes
+
 
 # TODO: warn user if gym name already exists
 # TODO: check DDBB operation results
@@ -83,12 +89,16 @@ def create_walls_collection(gym_code: str, radius: float = 0.02) -> None:
         gym_collection.insert_one(wall_data)
 
 
-def create_boulders_collection(gym_code) -> None:
+def create_boulders_collection(gym_code: str) -> None:
     """
-    Not sure this is required. The collection will be created
-    when the first boulder is inserted.
+    Create the boulder and circuit collections of the new gym
+    along with the indexes their queries need (see db/indexes.py)
     """
-    pass
+    with open('creds.txt') as f:
+        creds = f.readline()
+    myclient = pymongo.MongoClient(creds)
+    db = myclient['RocoLib']
+    indexes.ensure_gym_indexes(gym_code, db)
 
 
 def add_gym_to_gyms_list(gym_code: str, gym_name: str, coordinates: Coordinates = Coordinates()) -> None:
@@ -103,6 +113,8 @@ def add_gym_to_gyms_list(gym_code: str, gym_name: str, coordinates: Coordinates
     wall_data = {'name': gym_name, 'id': gym_code,
                  'coordinates': coordinates.get_coords()}
     walls_collection.insert_one(wall_data)
+    # let the running application know that the list of gyms has changed
+    catalog.bump_version(db)
 
 
 def add_new_gym(gym_code: str, gym_name: str, images_path: str, location: list[float]) -> None:
@@ -1,7 +1,13 @@
 import argparse
+import os
+import sys
 import pymongo
 import shutil
 
+# the script is run from the project root, which is not in the path
+sys.path.insert(0, os.getcwd())
+from db import catalog
+
 
 # TODO: warn user if gym name already exists
 # TODO: check DDBB operation results
@@ -46,6 +52,8 @@ def delete_gym_from_gyms_list(gym_code: str) -> None:
     walls_collection = db['walls']
     wall_to_delete = {'id': gym_code}
     walls_collection.delete_one(wall_to_delete)
+    # let the running application know that the list of gyms has changed
+    catalog.bump_version(db)
 
 
 def delete_gym_folder(gym_code: str) -> None:
@@ -0,0 +1,82 @@
+import gzip
+import zlib
+from typing import Iterable, Iterator
+
+from flask import request
+from werkzeug.wrappers.response import Response
+
+from src.config import *
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, responses are gzipped without it
+    brotli = None
+
+GZIP = 'gzip'
+BROTLI = 'br'
+# Supported content codings, by order of preference
+ENCODINGS = (BROTLI, GZIP) if brotli is not None else (GZIP,)
+
+
+def get_etag_variants(etag: str) -> list[str]:
+    """
+    ETags the response with the given ETag may have been
+    sent with, one per content coding
+    """
+    return [etag] + [f'{etag}-{encoding}' for encoding in ENCODINGS]
+
+
+def _compress(data: bytes, encoding: str) -> bytes:
+    if encoding == BROTLI:
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def _compress_stream(chunks: Iterable[bytes], encoding: str) -> Iterator[bytes]:
+    if encoding == BROTLI:
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        compress, finish = compressor.process, compressor.finish
+    else:
+        # wbits=31 writes the gzip header and trailer
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+        compress, finish = compressor.compress, compressor.flush
+    for chunk in chunks:
+        compressed = compress(chunk)
+        if compressed:
+            yield compressed
+    yield finish()
+
+
+def compress_response(response: Response) -> Response:
+    """
+    Compress the body of a response with the content coding preferred
+    by the client, if it is of one of COMPRESSIBLE_MIMETYPES and at
+    least COMPRESSION_MIN_SIZE bytes long. Streamed bodies are
+    compressed as they are sent, whatever their size.
+    """
+    if response.status_code == 304:
+        response.vary.add('Accept-Encoding')
+        return response
+    if (response.mimetype not in COMPRESSIBLE_MIMETYPES
+            or response.status_code < 200
+            or response.status_code == 204
+            or response.direct_passthrough
+            or 'Content-Encoding' in response.headers):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = request.accept_encodings.best_match(ENCODINGS)
+    if encoding is None:
+        return response
+    if response.is_streamed:
+        response.response = _compress_stream(response.iter_encoded(), encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < COMPRESSION_MIN_SIZE:
+            return response
+        response.set_data(_compress(data, encoding))
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag is not None:
+        response.set_etag(f'{etag}-{encoding}', weak)
+    return response
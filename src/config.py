@@ -1,3 +1,4 @@
+import os
 from sys import argv
 
 CREDS = 'creds.txt'
@@ -7,7 +8,55 @@ CREDS_LOCAL = 'creds.local.txt'
 PORT = 5050
 
 DB_NAME = 'RocoLib'
+# MongoDB connection pool, one per worker process
+MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', 50))
+MONGO_MIN_POOL_SIZE = int(os.environ.get('MONGO_MIN_POOL_SIZE', 0))
+MONGO_MAX_IDLE_TIME_MS = int(os.environ.get('MONGO_MAX_IDLE_TIME_MS', 60000))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(
+    os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', 10000))
+MONGO_CONNECT_TIMEOUT_MS = int(os.environ.get('MONGO_CONNECT_TIMEOUT_MS', 30000))
+# Seconds between checks of the gym catalog version, which the
+# admin scripts increase when they add or remove a gym
+CATALOG_CHECK_INTERVAL = int(os.environ.get('CATALOG_CHECK_INTERVAL', 5))
+# Seconds the home page stats are cached for
+STATS_CACHE_TTL = int(os.environ.get('STATS_CACHE_TTL', 300))
+# Seconds the logged in users are cached for by each process, and
+# maximum number of cached users
+USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', 30))
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 1024))
+# Seconds an API auth token is valid for
+AUTH_TOKEN_EXPIRATION = int(os.environ.get('AUTH_TOKEN_EXPIRATION', 600))
+# Maximum number of verified API tokens cached by each process
+TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE', 4096))
 WALLS_PATH = 'images/walls/'
+# Maximum number of points of a batch hold hit-test request
+HOLDS_AT_MAX_POINTS = 500
+# Maximum number of boulders of a batch create request
+BOULDER_BATCH_MAX_SIZE = 500
+# Maximum page size of the paginated problem lists of the API
+LIST_MAX_PAGE_SIZE = 500
+# Characters of the problem lists of the API encoded before sending
+# them, as they are streamed instead of built in memory
+JSON_STREAM_CHUNK_SIZE = 16384
+# Responses of these types are compressed with brotli, if it is
+# installed, or gzip when the client accepts it. Smaller ones are not
+# worth the CPU time. Static files, such as stylesheets and scripts,
+# are sent as they are: the web server or CDN in front compresses them.
+COMPRESSIBLE_MIMETYPES = (
+    'text/html', 'application/json', 'application/msgpack'
+)
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', 1024))
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 4
+# Cache-Control header of the read-only API responses, by view name.
+# They all carry an ETag, so clients can revalidate them cheaply.
+DEFAULT_API_CACHE_CONTROL = 'no-cache'
+API_CACHE_CONTROL = {
+    'get_gyms': 'public, max-age=300',
+    'get_gym_walls': 'public, max-age=300',
+    'get_gym_pretty_name': 'public, max-age=3600',
+    'get_gym_wall_name': 'public, max-age=3600',
+}
 ITEMS = 'Items'
 
 DOCKER_ENV = "False"
@@ -15,6 +64,16 @@ if len(argv) > 1 and str(argv[1]) == "docker":
     DOCKER_ENV = "True"
 
 DEBUG = True
+# Level of the application log, which has a line per request at INFO
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+# Directory where each worker process writes its metrics, so that any
+# of them can serve the metrics of all (see src/metrics.py), and
+# seconds between writes. Metrics are only kept in memory if unset.
+METRICS_DIR = os.environ.get('METRICS_DIR', '')
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 1))
+# Bearer token the clients of /metrics and /metrics/db must send. The
+# metrics are not served if unset.
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
 API_VERSION = 'v1'
 SWAGGER_URL = f'/api/{API_VERSION}/docs'
 API_URL = f'/api/{API_VERSION}/docs/swagger.json'
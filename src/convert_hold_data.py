@@ -0,0 +1,74 @@
+"""
+Convert the hold JSON files of the walls to the binary format
+described in src/hold_format.py.
+
+Run from the project root:
+
+    python -m src.convert_hold_data [--gym GYM] [--check]
+
+Every `static/images/walls/<gym>/<section>.json` gets a
+`<section>.holds` file next to it, which get_hold_data reads instead
+of the JSON file from then on. The JSON files are left untouched.
+"""
+import argparse
+import glob
+import json
+import os
+
+from src import hold_format
+from src.config import WALLS_PATH
+
+STATIC_FOLDER = 'static'
+
+
+def convert(json_filename: str) -> str:
+    """
+    Write the binary file of a hold JSON file, checking that it
+    decodes to the same polygons
+    """
+    with open(json_filename) as f:
+        polygons = json.load(f)['holds']
+    holds_filename = hold_format.get_holds_filename(json_filename)
+    hold_format.dump(polygons, holds_filename)
+    if hold_format.load(holds_filename).to_lists() != polygons:
+        os.remove(holds_filename)
+        raise hold_format.HoldFormatError(f'Round trip failed for {json_filename}')
+    return holds_filename
+
+
+def check(json_filename: str) -> bool:
+    """
+    Check that the binary file of a hold JSON file is up to date
+    """
+    holds_filename = hold_format.get_holds_filename(json_filename)
+    if not os.path.isfile(holds_filename):
+        return False
+    with open(json_filename) as f:
+        polygons = json.load(f)['holds']
+    return hold_format.load(holds_filename).to_lists() == polygons
+
+
+def main(gym: str, check_only: bool) -> int:
+    pattern = os.path.join(STATIC_FOLDER, WALLS_PATH, gym or '*', '*.json')
+    outdated = 0
+    for json_filename in sorted(glob.glob(pattern)):
+        if check_only:
+            up_to_date = check(json_filename)
+            outdated += not up_to_date
+            print(f"{'ok' if up_to_date else 'OUTDATED'}\t{json_filename}")
+            continue
+        holds_filename = convert(json_filename)
+        print(
+            f'{json_filename} ({os.path.getsize(json_filename)} bytes) -> '
+            f'{holds_filename} ({os.path.getsize(holds_filename)} bytes)'
+        )
+    return 1 if outdated else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert hold JSON files to the binary format')
+    parser.add_argument('-g', '--gym', help='Only convert the walls of this gym', type=str)
+    parser.add_argument('--check', help='Only check that the binary files are up to date',
+                        action='store_true')
+    args = parser.parse_args()
+    raise SystemExit(main(args.gym, args.check))
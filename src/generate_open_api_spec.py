@@ -1,7 +1,9 @@
 import json
 from api.blueprint import circuit_create, get_auth_token, get_boulder_by_id, get_boulder_by_name
 from api.blueprint import get_gym_boulders, get_gym_pretty_name, get_gym_wall_name
+from api.blueprint import get_holds_at, get_holds_at_batch
 from api.blueprint import get_gyms, get_gym_walls, boulder_create, test_auth, new_user
+from api.blueprint import boulder_batch_create
 from api.blueprint import get_user_ticklist, rate_boulder, mark_boulder_as_done
 from api.blueprint import get_user_preferences, get_gym_circuits, get_circuit_by_id, get_circuit_by_name
 
@@ -28,6 +30,8 @@ def generate_api_docs(app) -> None:
     from api.schemas import GymIDParameter
     from api.schemas import CreateBoulderRequestBody
     from api.schemas import CreateBoulderResponseBody
+    from api.schemas import CreateBoulderBatchRequestBody
+    from api.schemas import CreateBoulderBatchResponseBody
     from api.schemas import AuthenticationRequestBody
     from api.schemas import AuthenticationResponseBody
     from api.schemas import SignUpRequestBody
@@ -40,6 +44,14 @@ def generate_api_docs(app) -> None:
     from api.schemas import MarkDoneBoulderRequestBody
     from api.schemas import MarkDoneBoulderResponseBody
     from api.schemas import UserPreferencesResponseBody
+    from api.schemas import PointXParameter
+    from api.schemas import PointYParameter
+    from api.schemas import BoulderListRequestArgs
+    from api.schemas import CircuitListRequestArgs
+    from api.schemas import HoldPolygonSchema
+    from api.schemas import HoldsAtResponseBody
+    from api.schemas import HoldsAtBatchRequestBody
+    from api.schemas import HoldsAtBatchResponseBody
     from api.schemas import ErrorResponse
 
     spec.components.schema("Gyms", schema=GymListSchema)
@@ -49,10 +61,26 @@ def generate_api_docs(app) -> None:
     spec.components.schema("Circuits", schema=GymCircuitListSchema)
     spec.components.schema("GymName", schema=GymNameSchema)
     spec.components.schema("WallName", schema=WallNameSchema)
+    spec.components.schema("HoldPolygon", schema=HoldPolygonSchema)
+    spec.components.schema("HoldsAtResponseBody", schema=HoldsAtResponseBody)
+    spec.components.schema("HoldsAtBatchRequestBody",
+                           schema=HoldsAtBatchRequestBody)
+    spec.components.schema("HoldsAtBatchResponseBody",
+                           schema=HoldsAtBatchResponseBody)
+    spec.components.schema("PointXParameter", schema=PointXParameter)
+    spec.components.schema("PointYParameter", schema=PointYParameter)
+    spec.components.schema("BoulderListRequestArgs",
+                           schema=BoulderListRequestArgs)
+    spec.components.schema("CircuitListRequestArgs",
+                           schema=CircuitListRequestArgs)
     spec.components.schema(
         "CreateBoulder", schema=CreateBoulderRequestBody)
     spec.components.schema("CreateBoulderResponse",
                            schema=CreateBoulderResponseBody)
+    spec.components.schema("CreateBoulderBatch",
+                           schema=CreateBoulderBatchRequestBody)
+    spec.components.schema("CreateBoulderBatchResponse",
+                           schema=CreateBoulderBatchResponseBody)
     spec.components.schema(
         "CreateCircuit", schema=CreateCircuitRequestBody)
     spec.components.schema("CreateCircuitResponse",
@@ -92,6 +120,8 @@ def generate_api_docs(app) -> None:
         spec.path(view=get_gym_walls)
         spec.path(view=get_gym_pretty_name)
         spec.path(view=get_gym_wall_name)
+        spec.path(view=get_holds_at)
+        spec.path(view=get_holds_at_batch)
         spec.path(view=get_gym_circuits)
         spec.path(view=get_circuit_by_id)
         spec.path(view=get_circuit_by_name)
@@ -99,6 +129,7 @@ def generate_api_docs(app) -> None:
         spec.path(view=get_boulder_by_id)
         spec.path(view=get_boulder_by_name)
         spec.path(view=boulder_create)
+        spec.path(view=boulder_batch_create)
         spec.path(view=circuit_create)
         spec.path(view=new_user)
         spec.path(view=get_auth_token)
@@ -0,0 +1,120 @@
+import json
+import os
+import threading
+from typing import NamedTuple, Optional
+
+from flask import current_app
+from jinja2.utils import htmlsafe_json_dumps
+from markupsafe import Markup
+
+from src import hold_format
+from src import metrics
+
+
+class HoldData(NamedTuple):
+    """
+    Hold polygons of a wall, both parsed and serialized
+    the way the `tojson` template filter would do it
+    """
+    # parsed JSON file, only when read from it
+    data: Optional[dict]
+    json: Markup
+    # flat arrays, only when read from a binary `.holds` file
+    polygons: Optional[hold_format.HoldPolygons]
+    source: str
+    mtime_ns: int
+    size: int
+
+    def get_points(self, index: int) -> list[list[int]]:
+        """
+        Points of a hold polygon as [x, y] lists
+        """
+        if self.polygons is not None:
+            return self.polygons.points(index)
+        return self.data['holds'][index]
+
+    def to_dict(self) -> dict:
+        """
+        Hold data as stored in the JSON files. When read from a binary
+        file, the nested lists are built on every call.
+        """
+        if self.polygons is not None:
+            return {'holds': self.polygons.to_lists()}
+        return self.data
+
+
+# Hold data of every wall file read by this process, keyed by filename
+_store: dict[str, HoldData] = {}
+_lock = threading.Lock()
+
+
+def _stat(filename: str) -> Optional[os.stat_result]:
+    try:
+        return os.stat(filename)
+    except OSError:
+        return None
+
+
+def _load(source: str, stat: os.stat_result) -> HoldData:
+    data, polygons = None, None
+    if source.endswith(hold_format.HOLDS_EXTENSION):
+        # served from the flat arrays, whose JSON has no characters
+        # to escape for HTML
+        polygons = hold_format.load(source)
+        serialized = Markup(f'{{"holds": {polygons.to_json()}}}')
+    else:
+        with open(source) as f:
+            data = json.load(f)
+        serialized = htmlsafe_json_dumps(data, dumps=current_app.json.dumps)
+    return HoldData(
+        data=data,
+        json=serialized,
+        polygons=polygons,
+        source=source,
+        mtime_ns=stat.st_mtime_ns,
+        size=stat.st_size,
+    )
+
+
+def _is_current(hold_data: Optional[HoldData], source: str, stat: os.stat_result) -> bool:
+    return hold_data is not None and (hold_data.source, hold_data.mtime_ns, hold_data.size) == (
+        source, stat.st_mtime_ns, stat.st_size)
+
+
+def get(filename: str) -> Optional[HoldData]:
+    """
+    Get the hold data of a wall JSON file, or None if there is no
+    such file. If the file has been converted to the binary format
+    (see src/hold_format.py), the binary file is read instead, unless
+    the JSON file has been modified since. Each file is only read
+    again when it changes on disk.
+
+    The returned data is shared and must not be modified.
+    """
+    source, stat = filename, _stat(filename)
+    holds_filename = hold_format.get_holds_filename(filename)
+    holds_stat = _stat(holds_filename)
+    if holds_stat is not None and (stat is None or holds_stat.st_mtime_ns >= stat.st_mtime_ns):
+        source, stat = holds_filename, holds_stat
+    if stat is None:
+        _store.pop(filename, None)
+        return None
+    hold_data = _store.get(filename)
+    hit = _is_current(hold_data, source, stat)
+    if not hit:
+        with _lock:
+            hold_data = _store.get(filename)
+            hit = _is_current(hold_data, source, stat)
+            if not hit:
+                hold_data = _load(source, stat)
+                _store[filename] = hold_data
+    metrics.count_cache_lookup('hold_data', hit)
+    return hold_data
+
+
+def clear() -> None:
+    """
+    Forget every file read so far
+    """
+    with _lock:
+        _store.clear()
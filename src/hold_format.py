@@ -0,0 +1,176 @@
+"""
+Binary format of the hold polygons of a wall.
+
+The JSON files produced by the hold detection store every point as a
+nested [x, y] list, which makes Python build thousands of small lists
+when parsing them. A `.holds` file stores the same polygons as two flat
+little-endian arrays that can be read without copying:
+
+    header   16 bytes   magic b'RHLD', version (uint16),
+                        coordinate size in bytes (uint16, 2 or 4),
+                        number of polygons (uint32), number of points (uint32)
+    offsets  int32[polygons + 1]
+             polygon i is made of points offsets[i] to offsets[i + 1]
+    coords   int16 or int32[points * 2]
+             x and y of every point, one after the other
+
+With NumPy, the arrays can be loaded as:
+
+    offsets = np.frombuffer(buf, '<i4', polygons + 1, HEADER_SIZE)
+    coords = np.frombuffer(buf, f'<i{coord_size}', points * 2,
+                           HEADER_SIZE + 4 * (polygons + 1)).reshape(-1, 2)
+"""
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from array import array
+from typing import Union
+
+HOLDS_EXTENSION = '.holds'
+MAGIC = b'RHLD'
+VERSION = 1
+HEADER = struct.Struct('<4sHHII')
+HEADER_SIZE = HEADER.size
+OFFSET_TYPECODE = 'i'
+COORD_TYPECODES = {2: 'h', 4: 'i'}
+INT16_RANGE = range(-2 ** 15, 2 ** 15)
+
+Polygons = list[list[list[int]]]
+
+
+class HoldFormatError(ValueError):
+    """
+    The file is not a valid hold polygons file
+    """
+
+
+class HoldPolygons:
+    """
+    Hold polygons backed by flat arrays of offsets and coordinates
+    """
+
+    def __init__(self, offsets: Union[memoryview, array], coords: Union[memoryview, array]) -> None:
+        self.offsets = offsets
+        self.coords = coords
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def polygon(self, index: int) -> Union[memoryview, array]:
+        """
+        Flat x, y coordinates of the points of a polygon
+        """
+        return self.coords[2 * self.offsets[index]:2 * self.offsets[index + 1]]
+
+    def points(self, index: int) -> list[list[int]]:
+        """
+        Points of a polygon as [x, y] lists, as stored in the JSON files
+        """
+        coords = self.polygon(index).tolist()
+        return [[coords[i], coords[i + 1]] for i in range(0, len(coords), 2)]
+
+    def to_json(self) -> str:
+        """
+        Polygons serialized as the JSON of their nested [x, y] lists,
+        with the separators of json.dumps, without building the lists
+        """
+        coords = self.coords.tolist()
+        offsets = self.offsets.tolist()
+        return '[' + ', '.join(
+            '[' + ', '.join(f'[{coords[i]}, {coords[i + 1]}]' for i in range(2 * start, 2 * end, 2)) + ']'
+            for start, end in zip(offsets, offsets[1:])
+        ) + ']'
+
+    def to_lists(self) -> Polygons:
+        """
+        Polygons as nested [x, y] lists, as stored in the JSON files
+        """
+        coords = self.coords.tolist()
+        offsets = self.offsets.tolist()
+        return [
+            [[coords[i], coords[i + 1]] for i in range(2 * start, 2 * end, 2)]
+            for start, end in zip(offsets, offsets[1:])
+        ]
+
+
+def get_holds_filename(json_filename: str) -> str:
+    """
+    Path of the binary file that goes with a hold JSON file
+    """
+    root = json_filename[:-len('.json')] if json_filename.endswith('.json') else json_filename
+    return root + HOLDS_EXTENSION
+
+
+def dumps(polygons: Polygons) -> bytes:
+    """
+    Encode a list of polygons of [x, y] points
+    """
+    offsets = array(OFFSET_TYPECODE, [0])
+    flat = []
+    for polygon in polygons:
+        for x, y in polygon:
+            flat.append(x)
+            flat.append(y)
+        offsets.append(len(flat) // 2)
+    coord_size = 2 if all(value in INT16_RANGE for value in flat) else 4
+    coords = array(COORD_TYPECODES[coord_size], flat)
+    if sys.byteorder != 'little':
+        offsets.byteswap()
+        coords.byteswap()
+    header = HEADER.pack(MAGIC, VERSION, coord_size, len(polygons), len(flat) // 2)
+    return header + offsets.tobytes() + coords.tobytes()
+
+
+def loads(buffer) -> HoldPolygons:
+    """
+    Decode hold polygons from a buffer. On little-endian machines
+    the arrays are views on the buffer, not copies.
+    """
+    view = memoryview(buffer)
+    if len(view) < HEADER_SIZE:
+        raise HoldFormatError('File too short')
+    magic, version, coord_size, polygons, points = HEADER.unpack_from(view)
+    if magic != MAGIC or version != VERSION or coord_size not in COORD_TYPECODES:
+        raise HoldFormatError('Unknown file format')
+    coords_start = HEADER_SIZE + 4 * (polygons + 1)
+    coords_end = coords_start + coord_size * 2 * points
+    if len(view) != coords_end:
+        raise HoldFormatError('Unexpected file size')
+    offsets = view[HEADER_SIZE:coords_start]
+    coords = view[coords_start:coords_end]
+    if sys.byteorder == 'little':
+        return HoldPolygons(
+            offsets.cast(OFFSET_TYPECODE), coords.cast(COORD_TYPECODES[coord_size]))
+    swapped_offsets = array(OFFSET_TYPECODE, offsets.tobytes())
+    swapped_coords = array(COORD_TYPECODES[coord_size], coords.tobytes())
+    swapped_offsets.byteswap()
+    swapped_coords.byteswap()
+    return HoldPolygons(swapped_offsets, swapped_coords)
+
+
+def load(filename: str) -> HoldPolygons:
+    """
+    Memory-map a hold polygons file
+    """
+    with open(filename, 'rb') as f:
+        # the map stays open for as long as the arrays are referenced
+        return loads(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+
+def dump(polygons: Polygons, filename: str) -> None:
+    """
+    Write a hold polygons file. The file is replaced as a whole, as
+    workers may have the previous one mapped: rewriting it in place
+    would crash them when they read past its new end.
+    """
+    data = dumps(polygons)
+    with tempfile.NamedTemporaryFile(
+            'wb', dir=os.path.dirname(os.path.abspath(filename)), suffix='.tmp', delete=False) as f:
+        f.write(data)
+    try:
+        os.replace(f.name, filename)
+    except OSError:
+        os.remove(f.name)
+        raise
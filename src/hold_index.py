@@ -0,0 +1,100 @@
+import math
+import statistics
+import threading
+from typing import Optional
+
+from src.hold_data_store import HoldData
+
+# Cells are this many times the median side of the hold bounding boxes,
+# so that most holds fall in one to four cells
+CELL_SIZE_FACTOR = 2
+
+
+def _contains(polygon: list[int], x: float, y: float) -> bool:
+    """
+    Even-odd test of a point against a polygon given as
+    flat x, y coordinates
+    """
+    inside = False
+    x1, y1 = polygon[-2], polygon[-1]
+    for i in range(0, len(polygon), 2):
+        x2, y2 = polygon[i], polygon[i + 1]
+        if (y2 > y) != (y1 > y) and x < (x1 - x2) * (y - y2) / (y1 - y2) + x2:
+            inside = not inside
+        x1, y1 = x2, y2
+    return inside
+
+
+class HoldIndex:
+    """
+    Grid of buckets over the hold polygons of a wall. Each bucket
+    holds the polygons whose bounding box overlaps it, so finding the
+    hold under a point only tests the few polygons of one bucket.
+    """
+
+    def __init__(self, polygons: list[list[int]]) -> None:
+        """
+        :param polygons: flat x, y coordinates of every polygon
+        :type polygons: list[list[int]]
+        """
+        self.polygons = polygons
+        self.boxes = [
+            (min(p[0::2]), min(p[1::2]), max(p[0::2]), max(p[1::2])) if p else None
+            for p in polygons
+        ]
+        sides = [max(box[2] - box[0], box[3] - box[1]) for box in self.boxes if box]
+        self.cell_size = max(1, CELL_SIZE_FACTOR * statistics.median(sides)) if sides else 1
+        self.buckets: dict[tuple[int, int], list[int]] = {}
+        for index, box in enumerate(self.boxes):
+            if box is None:
+                continue
+            min_x, min_y, max_x, max_y = (math.floor(v / self.cell_size) for v in box)
+            for cell_x in range(min_x, max_x + 1):
+                for cell_y in range(min_y, max_y + 1):
+                    self.buckets.setdefault((cell_x, cell_y), []).append(index)
+
+    @classmethod
+    def from_hold_data(cls, hold_data: HoldData) -> 'HoldIndex':
+        if hold_data.polygons is not None:
+            polygons = hold_data.polygons
+            return cls([polygons.polygon(i).tolist() for i in range(len(polygons))])
+        return cls([
+            [value for point in polygon for value in point]
+            for polygon in hold_data.data.get('holds', [])
+        ])
+
+    def find(self, x: float, y: float) -> list[int]:
+        """
+        Indexes of the polygons that contain a point
+        """
+        cell = (math.floor(x / self.cell_size), math.floor(y / self.cell_size))
+        hits = []
+        for index in self.buckets.get(cell, ()):
+            min_x, min_y, max_x, max_y = self.boxes[index]
+            if min_x <= x <= max_x and min_y <= y <= max_y and _contains(self.polygons[index], x, y):
+                hits.append(index)
+        return hits
+
+
+# Index of every wall, keyed by hold data filename, along with
+# the hold data it was built from
+_indexes: dict[str, tuple[HoldData, HoldIndex]] = {}
+_lock = threading.Lock()
+
+
+def get(filename: str, hold_data: Optional[HoldData]) -> Optional[HoldIndex]:
+    """
+    Get the index of the hold data of a wall file, building it
+    again whenever the file has been reloaded
+    """
+    if hold_data is None:
+        _indexes.pop(filename, None)
+        return None
+    entry = _indexes.get(filename)
+    if entry is None or entry[0] is not hold_data:
+        with _lock:
+            entry = _indexes.get(filename)
+            if entry is None or entry[0] is not hold_data:
+                entry = (hold_data, HoldIndex.from_hold_data(hold_data))
+                _indexes[filename] = entry
+    return entry[1]
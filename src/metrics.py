@@ -0,0 +1,424 @@
+"""
+Prometheus-style metrics of the application, served at /metrics in the
+text exposition format without any external agent or client library.
+
+Metrics are declared at module level where they are recorded, and their
+values are kept in memory by each process. When METRICS_DIR is set, as
+gunicorn.conf.py does for its workers, every process also writes a
+snapshot of its values to that directory at most every
+METRICS_FLUSH_INTERVAL seconds, and the process that serves /metrics
+merges the snapshots of every worker: counters and histograms are
+added, and gauges are reported per worker, labelled with its pid. The
+counters and histograms of dead workers are kept in an archive so
+that the totals never go backwards while the server is up.
+"""
+import json
+import math
+import os
+import threading
+import time
+from typing import Callable, Iterable, Optional
+
+from src.config import *
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# Upper bounds of the histogram buckets, in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+ARCHIVE_FILENAME = 'archive.json'
+
+Labels = tuple[str, ...]
+
+# Declared metrics, by name
+_registry: dict[str, '_Metric'] = {}
+# Functions that update the metrics maintained elsewhere before they are read
+_collectors: list[Callable[[], None]] = []
+_lock = threading.Lock()
+
+
+class _Metric():
+    """
+    Values of a metric, by label values
+    """
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values: dict[Labels, object] = {}
+        with _lock:
+            if name in _registry:
+                raise ValueError(f'Metric {name} is already declared')
+            _registry[name] = self
+
+    def _get_key(self, labels: dict[str, object]) -> Labels:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'Metric {self.name} takes the labels {self.labelnames}')
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._get_key(labels)
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+        _schedule_flush()
+
+    def set_total(self, value: float, **labels) -> None:
+        """
+        Set the total of a counter maintained elsewhere, for
+        instance by a cache that keeps its own statistics
+        """
+        key = self._get_key(labels)
+        with _lock:
+            self.values[key] = value
+        _schedule_flush()
+
+
+class Gauge(_Metric):
+    """
+    Value of a process. Gauges are reported per process, with a
+    pid label, as the values of different workers cannot be added.
+    """
+    kind = 'gauge'
+
+    def set(self, value: float, **labels) -> None:
+        key = self._get_key(labels)
+        with _lock:
+            self.values[key] = value
+        _schedule_flush()
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._get_key(labels)
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+        _schedule_flush()
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    """
+    Distribution of observed values. The value of each label set is
+    the count of each bucket, non cumulative, followed by the sum and
+    the count of the observations.
+    """
+    kind = 'histogram'
+
+    def __init__(
+            self,
+            name: str,
+            documentation: str,
+            labelnames: Iterable[str] = (),
+            buckets: Iterable[float] = DEFAULT_BUCKETS) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._get_key(labels)
+        index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+        with _lock:
+            counts = self.values.get(key)
+            if counts is None:
+                counts = self.values[key] = [0] * (len(self.buckets) + 3)
+            counts[index] += 1
+            counts[-2] += value
+            counts[-1] += 1
+        _schedule_flush()
+
+
+def register_collector(collector: Callable[[], None]) -> None:
+    """
+    Register a function that updates some metrics
+    every time they are read
+    """
+    _collectors.append(collector)
+
+
+def get_registry() -> dict[str, _Metric]:
+    return dict(_registry)
+
+
+def _collect() -> None:
+    for collector in _collectors:
+        collector()
+
+
+def _dump(kind: str, values: dict[Labels, object]) -> dict:
+    return {'kind': kind, 'values': [[list(key), value] for key, value in values.items()]}
+
+
+def _snapshot() -> dict[str, dict]:
+    """
+    Kind and values of every metric of this process, with the values
+    as lists of label values and value pairs, so that it can be dumped
+    as JSON and merged by a process that does not declare the metrics
+    """
+    with _lock:
+        return {
+            name: _dump(metric.kind, metric.values)
+            for name, metric in _registry.items()
+            if metric.values
+        }
+
+
+def _add(value, other):
+    if isinstance(value, list):
+        return [a + b for a, b in zip(value, other)]
+    return value + other
+
+
+def _merge(totals: dict[str, dict[Labels, object]], snapshot: dict[str, dict]) -> None:
+    """
+    Add the counters and histograms of a snapshot to the totals
+    """
+    for name, metric in snapshot.items():
+        if metric['kind'] == 'gauge':
+            continue
+        merged = totals.setdefault(name, {})
+        for key, value in metric['values']:
+            key = tuple(key)
+            merged[key] = _add(merged[key], value) if key in merged else value
+
+
+# Multi-process mode. Each process writes its snapshot to <pid>.json.
+# The flusher thread is started lazily by each process, so that a
+# forked worker gets its own.
+_flush_pid: Optional[int] = None
+_flush_event = threading.Event()
+_flush_lock = threading.Lock()
+
+
+def get_directory() -> str:
+    """
+    Directory shared by the worker processes, or an empty string
+    when metrics are only kept in memory
+    """
+    return METRICS_DIR
+
+
+def _get_filename(directory: str, pid: int) -> str:
+    return os.path.join(directory, f'{pid}.json')
+
+
+def _write(filename: str, data) -> None:
+    temporary = f'{filename}.tmp'
+    with open(temporary, 'w') as f:
+        json.dump(data, f)
+    os.replace(temporary, filename)
+
+
+def _read(filename: str):
+    try:
+        with open(filename) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def flush() -> None:
+    """
+    Write the snapshot of this process to the metrics directory
+    """
+    directory = get_directory()
+    if directory:
+        _collect()
+        # every change made from now on is written on the next flush
+        _flush_event.clear()
+        with _flush_lock:
+            _write(_get_filename(directory, os.getpid()), _snapshot())
+
+
+def _flush_periodically() -> None:
+    while True:
+        _flush_event.wait()
+        time.sleep(METRICS_FLUSH_INTERVAL)
+        try:
+            flush()
+        except OSError:
+            pass
+
+
+def _schedule_flush() -> None:
+    global _flush_pid
+    if not get_directory():
+        return
+    if _flush_pid != os.getpid():
+        with _lock:
+            if _flush_pid != os.getpid():
+                _flush_pid = os.getpid()
+                threading.Thread(target=_flush_periodically, name='metrics-flush', daemon=True).start()
+    _flush_event.set()
+
+
+def mark_process_dead(pid: int, directory: Optional[str] = None) -> None:
+    """
+    Move the counters and histograms of a dead worker to the
+    archive and forget its gauges. Only the gunicorn master
+    calls this, when it reaps a worker.
+    """
+    directory = directory or get_directory()
+    if not directory:
+        return
+    filename = _get_filename(directory, pid)
+    snapshot = _read(filename)
+    if snapshot is not None:
+        archive_filename = os.path.join(directory, ARCHIVE_FILENAME)
+        archive = _read(archive_filename) or {}
+        totals: dict[str, dict[Labels, object]] = {}
+        _merge(totals, archive)
+        _merge(totals, snapshot)
+        kinds = {name: metric['kind'] for name, metric in {**snapshot, **archive}.items()}
+        _write(archive_filename, {name: _dump(kinds[name], values) for name, values in totals.items()})
+    try:
+        os.remove(filename)
+    except FileNotFoundError:
+        pass
+
+
+def clear_directory(directory: Optional[str] = None) -> None:
+    """
+    Remove the snapshots left by a previous run of the server
+    """
+    directory = directory or get_directory()
+    if not directory:
+        return
+    os.makedirs(directory, exist_ok=True)
+    for filename in os.listdir(directory):
+        if filename.endswith('.json') or filename.endswith('.json.tmp'):
+            os.remove(os.path.join(directory, filename))
+
+
+def collect() -> dict[str, dict[Labels, object]]:
+    """
+    Values of every metric, by label values, added up across the
+    worker processes in multi-process mode. Gauges carry the pid
+    of their process as an additional label value.
+    """
+    _collect()
+    directory = get_directory()
+    if not directory:
+        snapshots = {os.getpid(): _snapshot()}
+        totals: dict[str, dict[Labels, object]] = {}
+        _merge(totals, snapshots[os.getpid()])
+    else:
+        flush()
+        snapshots, totals = {}, {}
+        _merge(totals, _read(os.path.join(directory, ARCHIVE_FILENAME)) or {})
+        for filename in os.listdir(directory):
+            pid, extension = os.path.splitext(filename)
+            if extension == '.json' and pid.isdigit():
+                snapshot = _read(os.path.join(directory, filename))
+                if snapshot is not None:
+                    snapshots[int(pid)] = snapshot
+                    _merge(totals, snapshot)
+    for pid, snapshot in snapshots.items():
+        for name, metric in snapshot.items():
+            if metric['kind'] == 'gauge':
+                gauges = totals.setdefault(name, {})
+                for key, value in metric['values']:
+                    gauges[(*key, str(pid))] = value
+    return totals
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str]) -> str:
+    labels = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return f'{{{labels}}}' if labels else ''
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def render() -> str:
+    """
+    Every metric in the Prometheus text exposition format
+    """
+    totals = collect()
+    lines = []
+    for name, metric in sorted(_registry.items()):
+        lines.append(f'# HELP {name} {metric.documentation}')
+        lines.append(f'# TYPE {name} {metric.kind}')
+        labelnames = metric.labelnames + (('pid',) if metric.kind == 'gauge' else ())
+        for key, value in sorted(totals.get(name, {}).items()):
+            if metric.kind != 'histogram':
+                lines.append(f'{name}{_format_labels(labelnames, key)} {_format_value(value)}')
+                continue
+            cumulative = 0
+            for bound, count in zip((*metric.buckets, math.inf), value):
+                cumulative += count
+                labels = _format_labels((*labelnames, 'le'), (*key, _format_value(bound)))
+                lines.append(f'{name}_bucket{labels} {_format_value(cumulative)}')
+            lines.append(f'{name}_sum{_format_labels(labelnames, key)} {_format_value(value[-2])}')
+            lines.append(f'{name}_count{_format_labels(labelnames, key)} {_format_value(value[-1])}')
+    return '\n'.join(lines) + '\n'
+
+
+# Shared by every in-process cache of the application
+CACHE_REQUESTS = Counter(
+    'rocolib_cache_requests_total', 'Lookups of the in-process caches, by cache and result', ('cache', 'result'))
+
+
+def count_cache_lookup(cache: str, hit: bool) -> None:
+    """
+    Count a lookup of one of the in-process caches
+    """
+    CACHE_REQUESTS.inc(cache=cache, result='hit' if hit else 'miss')
+
+
+# Worker level gauges, reported by every process
+WORKER_START_TIME = Gauge('rocolib_worker_start_time_seconds', 'Start time of the worker since the epoch')
+WORKER_CPU_TIME = Gauge('rocolib_worker_cpu_seconds', 'CPU time used by the worker')
+WORKER_RESIDENT_MEMORY = Gauge('rocolib_worker_resident_memory_bytes', 'Resident memory of the worker')
+WORKER_THREADS = Gauge('rocolib_worker_threads', 'Threads of the worker')
+_started_at = time.time()
+
+
+def _get_resident_memory() -> Optional[int]:
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        # not on Linux
+        return None
+
+
+def _collect_worker_gauges() -> None:
+    WORKER_START_TIME.set(_started_at)
+    WORKER_CPU_TIME.set(time.process_time())
+    WORKER_THREADS.set(threading.active_count())
+    resident_memory = _get_resident_memory()
+    if resident_memory is not None:
+        WORKER_RESIDENT_MEMORY.set(resident_memory)
+
+
+def _reset_after_fork() -> None:
+    """
+    Start a forked worker from scratch, as the values inherited
+    from its parent are already reported by the parent
+    """
+    global _started_at, _lock, _flush_lock, _flush_event
+    # the parent may have held the locks while forking, and
+    # nothing would ever release them in the child
+    _lock = threading.Lock()
+    _flush_lock = threading.Lock()
+    _flush_event = threading.Event()
+    _started_at = time.time()
+    for metric in _registry.values():
+        metric.values.clear()
+
+
+register_collector(_collect_worker_gauges)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
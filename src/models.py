@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import hashlib
 import uuid
 from abc import ABC, abstractmethod
 from datetime import datetime
@@ -11,7 +12,8 @@ from itsdangerous import URLSafeTimedSerializer as Serializer
 from pymongo.database import Database
 from werkzeug.security import check_password_hash, generate_password_hash
 
-from db import mongodb_controller
+from db import mongodb_controller, user_cache
+from src.config import AUTH_TOKEN_EXPIRATION
 from src.typing import Data
 
 TICKLIST = "ticklist"
@@ -55,7 +57,6 @@ class User(UserMixin, BaseModel):
         self.password: str = None
         self.is_admin: bool = False
         self.preferences: UserPreferences = None
-        self.ticklist: list[Union[TickListProblem, Data]] = []
 
         # initial_data is a tuple of args. Here we are
         # assuming that when building a user object a
@@ -64,7 +65,8 @@ class User(UserMixin, BaseModel):
         for arg in initial_data:
             for key in arg:
                 if key == TICKLIST:
-                    self.load_ticklist(arg[key])
+                    # ticklists are stored in their own collection
+                    continue
                 elif key == USER_PREFERENCES:
                     if isinstance(arg[key], UserPreferences):
                         self.preferences = arg[key]
@@ -103,23 +105,21 @@ class User(UserMixin, BaseModel):
         """
         Save the current user data to the database
         """
-        # Serialize ticklist problems
-        self.ticklist = [problem.serialize() for problem in self.ticklist]
         user_preferences = self.preferences
         if not user_preferences:
             user_preferences = UserPreferences(user_id=self.id)
         # save user data and user prefs separately
         mongodb_controller.save_user(self.serialize(), database)
         mongodb_controller.save_user_preferences(user_preferences.serialize(), database)
-        # deserialize ticklist problems
-        self.load_ticklist(self.ticklist)
 
-    def load_ticklist(self, ticklist_data: list[Data]) -> None:
+    def get_ticklist(self, database: Database) -> list[TickListProblem]:
         """
-        Overwrite the ticklist attribute with new TickListProblems
-        created using the data given
+        Get the problems of the user's ticklist
         """
-        self.ticklist = [TickListProblem(problem) for problem in ticklist_data]
+        return [
+            TickListProblem(problem)
+            for problem in mongodb_controller.get_ticklist(self.id, database)
+        ]
 
     @staticmethod
     def get_user_preferences(
@@ -134,70 +134,106 @@ class User(UserMixin, BaseModel):
         return UserPreferences(**_user_prefs)
 
     @staticmethod
-    def get_by_id(user_id: str, database: Database) -> Union[User, None]:
+    def from_data(user_data: Data, user_prefs: Data) -> Union[User, None]:
         """
-        Return a User object if the user id is found in the database.
-
-        Otherwise, return None.
+        Build a User object from its data and preferences as read from the
+        database. Return None if there is no user data.
         """
-        user_data = mongodb_controller.get_user_data_by_id(user_id, database)
         if not bool(user_data):
             return None
 
-        user_data[USER_PREFERENCES] = User.get_user_preferences(user_id, database)
+        if bool(user_prefs):
+            user_data[USER_PREFERENCES] = UserPreferences(**user_prefs)
+        else:
+            user_data[USER_PREFERENCES] = UserPreferences(user_id=user_data["id"])
 
         return User(user_data)
 
+    @staticmethod
+    def get_by_id(user_id: str, database: Database) -> Union[User, None]:
+        """
+        Return a User object if the user id is found in the database.
+
+        Otherwise, return None.
+        """
+        return User.from_data(
+            *mongodb_controller.get_user_data_with_preferences("id", user_id, database)
+        )
+
+    @staticmethod
+    def get_cached_by_id(user_id: str, database: Database) -> Union[User, None]:
+        """
+        Same as get_by_id, but the user data may come from the per-process
+        user cache, which is invalidated every time a user is saved.
+        """
+        return User.from_data(*mongodb_controller.get_cached_user_data(user_id, database))
+
     @staticmethod
     def get_user_by_email(email: str, database: Database) -> Union[User, None]:
         """
         Return a User object if the user email is found in the database.
         Otherwise, return None.
         """
-        user_data = mongodb_controller.get_user_data_by_email(email, database)
-        if not user_data:
-            return None
-
-        user_data[USER_PREFERENCES] = User.get_user_preferences(
-            user_data["id"], database
+        return User.from_data(
+            *mongodb_controller.get_user_data_with_preferences("email", email, database)
         )
 
-        return User(user_data)
-
     @staticmethod
     def get_user_by_username(name: str, database: Database) -> Union[User, None]:
         """
         Return a User object if the user email is found in the database.
         Otherwise, return None.
         """
-        user_data = mongodb_controller.get_user_data_by_username(name, database)
-        if not user_data:
-            return None
-
-        user_data[USER_PREFERENCES] = User.get_user_preferences(
-            user_data["id"], database
+        return User.from_data(
+            *mongodb_controller.get_user_data_with_preferences("name", name, database)
         )
 
-        return User(user_data)
-
-    def generate_auth_token(self, app: Any, expiration: int = 600):
-        s = Serializer(app.secret_key, expires_in=expiration)
+    def generate_auth_token(self, app: Any) -> str:
+        """
+        Generate a signed API token for the user, valid for
+        AUTH_TOKEN_EXPIRATION seconds
+        """
+        s = Serializer(app.secret_key)
         return s.dumps({"id": self.id})
 
     @staticmethod
     def verify_auth_token(token: str, app: Any, database: Database) -> User:
+        """
+        Return the User of a valid API token, or None if the token
+        is invalid, has expired or its user does not exist.
+
+        Verified tokens are cached by digest until they expire (see
+        db/user_cache.py), so repeated calls with the same token
+        neither check its signature nor query the database.
+        """
+        digest = hashlib.sha256(token.encode()).hexdigest()
+        cached = user_cache.get_token(database.name, digest)
+        if cached is not None:
+            return User.from_data(*cached)
+        generation = user_cache.get_generation()
         s = Serializer(app.secret_key)
         try:
-            data = s.loads(token)
+            data, signed_at = s.loads(
+                token, max_age=AUTH_TOKEN_EXPIRATION, return_timestamp=True
+            )
         except SignatureExpired:
             return None  # valid token, but expired
         except BadSignature:
             return None  # invalid token
-        user_data = mongodb_controller.get_user_data_by_id(data["id"], database)
-        user_data[USER_PREFERENCES] = User.get_user_preferences(data["id"], database)
-        if not user_data:
+        user_data, user_prefs = mongodb_controller.get_user_data_with_preferences(
+            "id", data["id"], database
+        )
+        if not bool(user_data):
             return None
-        return User(user_data)
+        user_cache.put_token(
+            database.name,
+            digest,
+            data["id"],
+            (user_data, user_prefs),
+            signed_at.timestamp() + AUTH_TOKEN_EXPIRATION,
+            generation,
+        )
+        return User.from_data(user_data, user_prefs)
 
     def __repr__(self):
         return "<User {} ({})>".format(self.email, self.name)
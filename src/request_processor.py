@@ -23,16 +23,12 @@ def handle_home_request(request, session, db):
         session["gym"] = session.get("user_default_gym")
         session["first_load"] = False
 
-    gyms = db_controller.get_gyms(db)
+    current_gym = utils.get_current_gym(session, db)
     return render_template(
         "home.html",
-        gyms=gyms,
-        selected=utils.get_current_gym(session, db),
-        current_gym=[
-            gym["name"]
-            for gym in gyms
-            if gym["id"] == utils.get_current_gym(session, db)
-        ][0],
+        gyms=db_controller.get_gyms(db),
+        selected=current_gym,
+        current_gym=db_controller.get_gym_pretty_name(current_gym, db),
         stats=utils.get_stats(db),
     )
 
@@ -74,9 +70,7 @@ def handle_explore_boulders(request, session, db, current_user):
     gym_walls = db_controller.get_gym_walls(gym, db)
 
     if current_user.is_authenticated:
-        done_boulders = [
-            boulder.iden for boulder in current_user.ticklist if boulder.is_done
-        ]
+        done_boulders = db_controller.get_done_boulder_ids(current_user.id, gym, db)
         for boulder in boulders:
             boulder["is_done"] = 1 if boulder["_id"] in done_boulders else 0
 
@@ -124,9 +118,7 @@ def handle_change_gym_problem_list_request(request, session, db, current_user):
     gym_walls = db_controller.get_gym_walls(gym, db)
 
     if current_user.is_authenticated:
-        done_boulders = [
-            boulder.iden for boulder in current_user.ticklist if boulder.is_done
-        ]
+        done_boulders = db_controller.get_done_boulder_ids(current_user.id, gym, db)
         for boulder in boulders:
             boulder["is_done"] = 1 if boulder["_id"] in done_boulders else 0
 
@@ -146,16 +138,9 @@ def process_rate_boulder_request(request, session, db):
         boulder_name = request.form.get("boulder_name")
         boulder_rating = request.form.get("boulder_rating")
         gym = request.form.get("gym", utils.get_current_gym(session, db))
-        boulder = db_controller.get_boulder_by_name(
-            gym=gym, name=boulder_name, database=db
-        )
         # Update stats
-        boulder["rating"] = (
-            boulder["rating"] * boulder["raters"] + int(boulder_rating)
-        ) / (boulder["raters"] + 1)
-        boulder["raters"] += 1
-        db_controller.update_boulder_by_id(
-            gym=gym, boulder_id=boulder["_id"], boulder_data=boulder, database=db
+        db_controller.rate_boulder_by_name(
+            gym=gym, name=boulder_name, rating=int(boulder_rating), database=db
         )
         return redirect(url_for("load_boulder", gym=gym, name=boulder_name))
     return abort(400)
@@ -177,7 +162,7 @@ def process_load_circuit_request(request, session, db, current_user, static_fold
             abort(404)
 
         # get hold data
-        hold_data = utils.get_hold_data(
+        hold_data_json = utils.get_hold_data_json(
             utils.get_current_gym(session, db), circuit["section"], static_folder
         )
 
@@ -193,7 +178,7 @@ def process_load_circuit_request(request, session, db, current_user, static_fold
             circuit_data=circuit,
             scroll=request.args.get("scroll", 0),
             origin=request.form.get("origin", "explore_circuit"),
-            hold_data=hold_data,
+            hold_data_json=hold_data_json,
             hold_detection=utils.get_hold_detection_active(current_user),
             list_id=request_data.get("list_id"),
             is_user_list=request_data.get("is_user_list"),
@@ -221,7 +206,7 @@ def process_load_boulder_request(request, session, db, current_user, static_fold
             abort(404)
 
         # get hold data
-        hold_data = utils.get_hold_data(
+        hold_data_json = utils.get_hold_data_json(
             utils.get_current_gym(session, db), boulder["section"], static_folder
         )
 
@@ -237,7 +222,7 @@ def process_load_boulder_request(request, session, db, current_user, static_fold
             boulder_data=boulder,
             scroll=request.args.get("scroll", 0),
             origin=request.form.get("origin", "explore_boulders"),
-            hold_data=hold_data,
+            hold_data_json=hold_data_json,
             hold_detection=utils.get_hold_detection_active(current_user),
             list_id=request_data.get("list_id"),
             is_user_list=request_data.get("is_user_list"),
@@ -273,7 +258,7 @@ def process_load_next_problem_request(
     )
 
     # get hold data
-    hold_data = utils.get_hold_data(
+    hold_data_json = utils.get_hold_data_json(
         utils.get_current_gym(session, db), boulder["section"], static_folder
     )
 
@@ -288,7 +273,7 @@ def process_load_next_problem_request(
         origin=request.form.get(
             "origin", "explore_boulders" if not is_user_list else "tick_list"
         ),
-        hold_data=hold_data,
+        hold_data_json=hold_data_json,
         hold_detection=utils.get_hold_detection_active(current_user),
         list_id=request.args.get("list_id"),  # default values atm
         is_user_list=is_user_list,
@@ -322,7 +307,7 @@ def process_load_previous_problem_request(
     )
 
     # get hold data
-    hold_data = utils.get_hold_data(
+    hold_data_json = utils.get_hold_data_json(
         utils.get_current_gym(session, db), boulder["section"], static_folder
     )
 
@@ -336,7 +321,7 @@ def process_load_previous_problem_request(
         origin=request.form.get(
             "origin", "explore_boulders" if not is_user_list else "tick_list"
         ),
-        hold_data=hold_data,
+        hold_data_json=hold_data_json,
         hold_detection=utils.get_hold_detection_active(current_user),
         list_id=request.args.get("list_id"),  # default values atm
         is_user_list=is_user_list,
@@ -357,7 +342,7 @@ def process_random_problem_request(request, session, db, current_user, static_fo
     )
 
     # get hold data
-    hold_data = utils.get_hold_data(
+    hold_data_json = utils.get_hold_data_json(
         utils.get_current_gym(session, db), boulder["section"], static_folder
     )
 
@@ -368,7 +353,7 @@ def process_random_problem_request(request, session, db, current_user, static_fo
         boulder_data=boulder,
         scroll=0,
         origin=request.form.get("origin", ""),
-        hold_data=hold_data,
+        hold_data_json=hold_data_json,
         hold_detection=utils.get_hold_detection_active(current_user),
         list_id=boulder["gym"],
         is_user_list=False,
@@ -386,11 +371,8 @@ def process_wall_section_request(
     elif request.args.get("options", "") == "circuit":
         template = "create_circuit.html"
 
-    if not session.get("walls_radius", ""):
-        session["walls_radius"] = db_controller.get_walls_radius_all(db)
-
     # load hold data
-    hold_data = utils.get_hold_data(
+    hold_data_json = utils.get_hold_data_json(
         utils.get_current_gym(session, db), wall_section, static_folder
     )
 
@@ -408,9 +390,9 @@ def process_wall_section_request(
         ),
         section=wall_section,
         radius=utils.get_wall_radius(
-            session, db, utils.get_current_gym(session, db) + "/" + wall_section
+            db, utils.get_current_gym(session, db) + "/" + wall_section
         ),
-        hold_data=hold_data,
+        hold_data_json=hold_data_json,
         hold_detection=hold_detection,
     )
 
@@ -470,21 +452,17 @@ def process_ticklist_request(request, session, db, current_user):
         boulder_id = boulder.get("_id", "")
         if "add_boulder_to_tick_list" in request.form:
             # Just add boulder to ticklist, it hasn't been climbed yet
-            current_user.ticklist = ticklist_handler.add_boulder_to_ticklist(
+            ticklist_handler.add_boulder_to_ticklist(
                 data, boulder_id, current_user, db
             )
         elif "mark_boulder_as_done" in request.form:
             # Add boulder to ticklist if not present, mark as done or add new climbed date
-            current_user.ticklist = ticklist_handler.add_boulder_to_ticklist(
+            ticklist_handler.add_boulder_to_ticklist(
                 data, boulder_id, current_user, db, mark_as_done=True
             )
             # update number of repetitions
-            boulder["repetitions"] += 1
-            db_controller.update_boulder_by_id(
-                gym=data.get("gym"),
-                boulder_id=boulder_id,
-                boulder_data=boulder,
-                database=db,
+            db_controller.add_boulder_repetition_by_id(
+                gym=data.get("gym"), boulder_id=boulder_id, database=db
             )
         # if the request origin is the explore boulders page, go back to it
         if (
@@ -504,9 +482,7 @@ def process_ticklist_request(request, session, db, current_user):
 
 def process_delete_ticklist_problem_request(request, db, current_user):
     if request.method == "POST":
-        current_user.ticklist = ticklist_handler.delete_problem_from_ticklist(
-            request, current_user, db
-        )
+        ticklist_handler.delete_problem_from_ticklist(request, current_user, db)
         return redirect(url_for("tick_list"))
     return abort(400)
 
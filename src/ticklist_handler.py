@@ -10,14 +10,7 @@ from werkzeug.wrappers.request import Request
 from werkzeug.local import LocalProxy
 
 
-def get_wall_radius(wall_path: str, database: Database) -> float:
-    """
-    Wall path is expected to be: 'gym/wall'
-    """
-    return mongodb_controller.get_walls_radius_all(database)[wall_path]
-
-
-def delete_problem_from_ticklist(request: Request, current_user: LocalProxy, database: Database):
+def delete_problem_from_ticklist(request: Request, current_user: LocalProxy, database: Database) -> bool:
     """
     Delete a problem from a user's ticklist
     """
@@ -35,72 +28,64 @@ def delete_problem_from_ticklist(request: Request, current_user: LocalProxy, dat
         'section': boulder_data.get('section')
     }
     # update user's ticklist
-    return [
-        TickListProblem(p) for p in mongodb_controller.delete_boulder_in_ticklist(boulder, current_user.id, database)
-    ]
+    return mongodb_controller.delete_boulder_in_ticklist(boulder, current_user.id, database)
 
 
 def load_user_ticklist(current_user, database: Database):
     """
     Load a user's ticklist
+
+    Boulders are fetched with one query per gym and the walls of each
+    gym are read only once, regardless of the size of the ticklist.
     """
-    # get boulders in ticklist and extra required values
-    walls_cache = dict()
-    wall_name_cache = dict()
-    gym_name_cache = dict()
+    boulders = mongodb_controller.get_ticklist_boulders(
+        current_user.get_ticklist(database), database)
+    if not boulders:
+        return [], []
+
+    gym_names = {
+        gym['id']: gym.get('name', '') for gym in mongodb_controller.get_gyms(database)
+    }
+    # one walls lookup per gym: {gym: {section: wall}}
+    gym_walls = {}
+    for gym in set(boulder['gym'] for boulder in boulders):
+        gym_walls[gym] = {
+            wall['image']: wall for wall in mongodb_controller.get_gym_walls(gym, database)
+        }
+    show_latest_walls_only = current_user.preferences.show_latest_walls_only
 
     added_sections = []
-    
+
     boulder_list = []
     walls_list = []
 
-    for ticklist_boulder in current_user.ticklist:
-        # replace individual queries by a single group query?
-        boulder = mongodb_controller.get_ticklist_boulder(ticklist_boulder, database)
-        if boulder:
-            # try to get walls from the cache
-            walls = walls_cache.get(
-                boulder['gym'], 
-                [
-                    wall['image'] for wall in mongodb_controller.get_gym_walls(
-                        boulder['gym'],
-                        database,
-                        current_user.preferences.show_latest_walls_only
-                    )
-                ]
-            )
-            walls_cache[boulder['gym']] = walls # update cache
-            # filter by valid subset of walls
-            if boulder['section'] in walls:
-                boulder['feet'] = FEET_MAPPINGS[boulder['feet']]
-                boulder['safe_name'] = secure_filename(boulder['name'])
-                boulder['radius'] = get_wall_radius(
-                    boulder['gym'] + '/' + boulder['section'], database)
-                boulder['color'] = BOULDER_COLOR_MAP[boulder['difficulty']]
-                if boulder['section'] not in added_sections:
-                    added_sections.append(boulder['section'])
-                    gym_name = gym_name_cache.get(boulder['gym'], mongodb_controller.get_gym_pretty_name(boulder['gym'], database))
-                    wall_name = wall_name_cache.get(
-                        f'{boulder["gym"]}-{boulder["section"]}',
-                        mongodb_controller.get_wall_name(boulder['gym'], boulder['section'], database)
-                    )
-                    # update caches
-                    gym_name_cache[boulder['gym']] = gym_name
-                    wall_name_cache[f'{boulder["gym"]}-{boulder["section"]}'] = wall_name
-                    walls_list.append({
-                        'gym_name': gym_name,
-                        'image': boulder['section'],
-                        'name': wall_name
-                    })
+    for boulder in boulders:
+        wall = gym_walls[boulder['gym']].get(boulder['section'])
+        # filter by valid subset of walls
+        if not wall or (show_latest_walls_only and wall.get('latest') is not True):
+            continue
+        boulder['feet'] = FEET_MAPPINGS[boulder['feet']]
+        boulder['safe_name'] = secure_filename(boulder['name'])
+        boulder['radius'] = wall['radius']
+        boulder['color'] = BOULDER_COLOR_MAP[boulder['difficulty']]
+        if boulder['section'] not in added_sections:
+            added_sections.append(boulder['section'])
+            walls_list.append({
+                'gym_name': gym_names.get(boulder['gym'], ''),
+                'image': boulder['section'],
+                'name': wall.get('name', '')
+            })
 
-                boulder_list.append(boulder)
+        boulder_list.append(boulder)
 
     return boulder_list, walls_list
 
 
-def add_boulder_to_ticklist(request_data, boulder_id, current_user, database: Database, mark_as_done=False) -> list[TickListProblem]:
+def add_boulder_to_ticklist(request_data, boulder_id, current_user, database: Database, mark_as_done=False) -> TickListProblem:
     """
     Add a boulder to a user's ticklist
+
+    Return the updated ticklist problem
     """
     # needed values: gym, id, section, is_done
     boulder = {
@@ -110,11 +95,11 @@ def add_boulder_to_ticklist(request_data, boulder_id, current_user, database: Da
         'section': request_data.get('section')
     }
     # update user's ticklist
-    return [
-        TickListProblem(p) for p in mongodb_controller.put_boulder_in_ticklist(
+    return TickListProblem(
+        mongodb_controller.put_boulder_in_ticklist(
             boulder,
             current_user.id,
             database,
             mark_as_done
         )
-    ]
+    )
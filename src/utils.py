@@ -2,19 +2,25 @@ import datetime
 import json
 import math
 import os
+import threading
 from typing import Tuple, Union
 from urllib import parse as urlparse
 
-import pymongo
+from cachetools import TTLCache, cached
+from cachetools.keys import hashkey
 from flask import url_for
 from flask.globals import g, session
-from flask.sessions import SessionMixin
 from flask.wrappers import Request
+from markupsafe import Markup
 from pymongo.database import Database
 from werkzeug.local import LocalProxy
 from werkzeug.utils import secure_filename
 
+from db import catalog as gym_catalog
+from db import connection_manager
+from db import wall_index
 from db import mongodb_controller as db_controller
+from src import hold_data_store, hold_index, metrics
 from src.config import *
 from src.models import User
 from src.typing import Data
@@ -90,19 +96,13 @@ def get_creds(file: str) -> Union[str, None]:
 
 def get_db_connection() -> Database:
     """
-    Opens a new database connection if there is none yet for the
-    current application context.
+    Get the database handle for the current application context.
+
+    The handle is backed by the pooled client of the current process,
+    so no new connection is opened per request.
     """
     if "database" not in g:
-        client = pymongo.MongoClient(
-            get_creds(get_creds_file()),
-            connectTimeoutMS=30000,
-            socketTimeoutMS=None,
-            # socketKeepAlive=True,
-            connect=False,
-            maxPoolsize=1,
-        )
-        g.database = client[DB_NAME]
+        g.database = connection_manager.get_database(get_creds(get_creds_file()))
     return g.database
 
 
@@ -121,8 +121,7 @@ def make_boulder_data_valid_js(data: str) -> Data:
 def get_current_gym(session, db):
     if session.get("gym", ""):
         return session["gym"]
-    gyms = db_controller.get_gyms(db)
-    return gyms[0]["id"]
+    return gym_catalog.get_catalog(db).gyms[0]["id"]
 
 
 def get_wall_image(
@@ -147,40 +146,48 @@ def get_wall_json(
     )
 
 
+@cached(
+    cache=TTLCache(maxsize=1, ttl=STATS_CACHE_TTL),
+    key=lambda database: hashkey(database.name),
+    lock=threading.Lock(),
+    info=True,
+)
 def get_stats(database: Database) -> dict[str, int]:
     """
     Get current app stats from DDBB: Number of problems, routes and Gyms.
+
+    Counts come from the collections metadata and are cached for
+    STATS_CACHE_TTL seconds, so most requests do not hit the DDBB.
     """
     gyms = db_controller.get_gyms(database)
-    total_gyms = len(gyms)
     total_boulders = 0
     total_routes = 0
     for gym in gyms:
-        try:
-            total_boulders += len(
-                db_controller.get_boulders(gym.get("id", ""), database)[ITEMS]
-            )
-        except Exception:
-            pass
-        try:
-            total_routes += len(
-                db_controller.get_routes(gym.get("id", ""), database)[ITEMS]
-            )
-        except Exception:
-            pass
+        total_boulders += db_controller.count_boulders(gym.get("id", ""), database)
+        total_routes += db_controller.count_routes(gym.get("id", ""), database)
+
+    return {"Boulders": total_boulders, "Routes": total_routes, "Gyms": len(gyms)}
 
-    return {"Boulders": total_boulders, "Routes": total_routes, "Gyms": total_gyms}
+
+def _collect_stats_cache_lookups() -> None:
+    """
+    Report the lookups of the stats cache, which counts them itself
+    """
+    info = get_stats.cache_info()
+    metrics.CACHE_REQUESTS.set_total(info.hits, cache="stats", result="hit")
+    metrics.CACHE_REQUESTS.set_total(info.misses, cache="stats", result="miss")
+
+
+metrics.register_collector(_collect_stats_cache_lookups)
 
 
-def get_wall_radius(session: SessionMixin, database: Database, wall_path=None) -> float:
+def get_wall_radius(database: Database, wall_path=None) -> float:
     """
     Gets the radius of the circe used to mark holds for
     a specific wall.
     Wall path is expected to be: 'gym/wall'.
     """
-    if session.get("walls_radius", "") and session["walls_radius"].get(wall_path, ""):
-        return session["walls_radius"][wall_path]
-    return db_controller.get_walls_radius_all(database)[wall_path]
+    return wall_index.get_walls(database)[wall_path].radius
 
 
 def get_circuits_list(
@@ -197,7 +204,7 @@ def get_circuits_list(
 
     sections = set([b["section"] for b in data[ITEMS]])
     radius = {
-        section: get_wall_radius(session, database, gym + "/" + section)
+        section: get_wall_radius(database, gym + "/" + section)
         for section in sections
     }
     return map_and_complete_boulder_data(data[ITEMS], radius)
@@ -222,7 +229,7 @@ def get_boulders_list(
     )
     sections = set([b["section"] for b in data[ITEMS]])
     radius = {
-        section: get_wall_radius(session, database, gym + "/" + section)
+        section: get_wall_radius(database, gym + "/" + section)
         for section in sections
     }
     return map_and_complete_boulder_data(data[ITEMS], radius)
@@ -292,8 +299,10 @@ def load_data(request: Request) -> Tuple[dict, bool]:
     """
     # Handle the different content types
     # request.get_data()  # required?
-    if request.json:
-        return request.json, False
+    # request.json raises if the body is not JSON, as it is with forms
+    json_data = request.get_json(silent=True)
+    if json_data:
+        return json_data, False
     elif request.form:
         return request.form, True
     elif request.data:
@@ -474,6 +483,8 @@ def get_hold_data(gym: str, section: str, static_folder_path: str) -> dict:
     """
     Get the computed hold polygon data for a given wall
 
+    The data is shared between requests and must not be modified.
+
     :param gym: code of the gym the wall belongs to
     :type gym: str
     :param section: wall section from which to get the hold data
@@ -483,13 +494,60 @@ def get_hold_data(gym: str, section: str, static_folder_path: str) -> dict:
     :return: the hols data for the specified wall
     :rtype: dict
     """
-    # get hold data
+    hold_data = hold_data_store.get(
+        get_wall_json(gym, section, WALLS_PATH, static_folder_path)
+    )
+    return hold_data.to_dict() if hold_data else None
+
+
+def get_hold_data_json(gym: str, section: str, static_folder_path: str) -> Markup:
+    """
+    Get the computed hold polygon data for a given wall, serialized
+    to be embedded in a template as `tojson` would do it
+
+    :param gym: code of the gym the wall belongs to
+    :type gym: str
+    :param section: wall section from which to get the hold data
+    :type section: str
+    :param static_folder_path: path to the folder with the static assets
+    :type static_folder_path: str
+    :return: the hold data for the specified wall as JSON
+    :rtype: Markup
+    """
+    hold_data = hold_data_store.get(
+        get_wall_json(gym, section, WALLS_PATH, static_folder_path)
+    )
+    return hold_data.json if hold_data else Markup("null")
+
+
+def find_holds_at(
+    gym: str, section: str, static_folder_path: str, points: list[Tuple[float, float]]
+) -> Union[list[list[Data]], None]:
+    """
+    Find the hold polygons of a wall that contain each of the given
+    points, expressed in pixels of the wall image
+
+    :param gym: code of the gym the wall belongs to
+    :type gym: str
+    :param section: wall section where the points are
+    :type section: str
+    :param static_folder_path: path to the folder with the static assets
+    :type static_folder_path: str
+    :param points: x, y coordinates of the points
+    :type points: list[Tuple[float, float]]
+    :return: for every point, the index and polygon of the holds that contain it,
+        or None if the wall has no hold data
+    :rtype: Union[list[list[Data]], None]
+    """
     filename = get_wall_json(gym, section, WALLS_PATH, static_folder_path)
-    hold_data = None
-    if os.path.exists(filename):
-        with open(filename) as f:
-            hold_data = json.load(f)
-    return hold_data
+    hold_data = hold_data_store.get(filename)
+    index = hold_index.get(filename, hold_data)
+    if index is None:
+        return None
+    return [
+        [dict(index=i, polygon=hold_data.get_points(i)) for i in index.find(x, y)]
+        for x, y in points
+    ]
 
 
 def load_full_boulder_data(
@@ -513,9 +571,7 @@ def load_full_boulder_data(
     """
     boulder["feet"] = FEET_MAPPINGS[boulder["feet"]]
     boulder["safe_name"] = secure_filename(boulder["name"])
-    boulder["radius"] = get_wall_radius(
-        session, db, gym_code + "/" + boulder["section"]
-    )
+    boulder["radius"] = get_wall_radius(db, gym_code + "/" + boulder["section"])
     boulder["color"] = BOULDER_COLOR_MAP[boulder["difficulty"]]
     boulder["gym"] = gym_code
     wall_image = get_wall_image(gym_code, boulder["section"], WALLS_PATH)
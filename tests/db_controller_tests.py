@@ -194,6 +194,19 @@ class QueryBuilderTests(unittest.TestCase):
         self.assertEqual(
             TEST_VALUE_STR, raw_query[ROOT_KEY][0][TEST_FIELD][CONTAINS_TEXT_KEY])
 
+    def test_any_of_query(self):
+        # Given
+        sub_queries = [{TEST_FIELD: TEST_INT_VAL}, {TEST_FIELD: TEST_VALUE_STR}]
+        any_of_query = self.query_builder.any_of(sub_queries)
+        # When
+        raw_query = any_of_query.query
+        # Then
+        self.assertEqual(dict, type(raw_query))
+        self.assertIn(ROOT_KEY, raw_query.keys())
+        self.assertEqual(list, type(raw_query[ROOT_KEY]))
+        self.assertIn(ANY_OF_KEY, raw_query[ROOT_KEY][0].keys())
+        self.assertListEqual(sub_queries, raw_query[ROOT_KEY][0][ANY_OF_KEY])
+
     def test_chain_queries(self):
         # Given
         chained_query = self.query_builder.contained_in(
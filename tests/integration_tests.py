@@ -1,19 +1,38 @@
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+import gzip
+import json
+import os
+import shutil
 import unittest
-from application import app
+from unittest.mock import patch
+from application import app, ensure_indexes
 
 from api.schemas import BoulderFields
+from bson.objectid import ObjectId
+from itsdangerous import URLSafeTimedSerializer as Serializer
+import msgpack
+from pymongo.errors import OperationFailure
+import db.mongodb_controller as mongodb_controller
+from db import catalog as gym_catalog
+from db import indexes
+from db import instrumentation
+from db import migrate_ticklists
+from db import user_cache
+from src import compression
 from src.config import CREDS, CREDS_LOCAL
+from src.models import User
 from tests.tests_config import TEST_GYM_NAME, TEST_GYM_CODE, TEST_COORDINATES
 from tests.tests_config import TEST_WALL_NAME, TEST_WALL_SECTION, TEST_WALL_RADIUS, TEST_IS_PROJECT
 from tests.tests_config import TEST_CREATOR, TEST_DIFFICULTY_STRING, TEST_FEET, TEST_NAME, TEST_NOTES, TEST_HOLDS
 from tests.tests_config import TEST_DIFFICULTY_INT, TEST_USERNAME, TEST_EMAIL, TEST_PASSWORD
 
-from src.utils import set_creds_file
+from src.utils import get_stats, set_creds_file
 from tests.utils import add_user_with_ticklist, drop_users, get_db_connection
 from tests.utils import create_walls_collection, add_wall, drop_boulders, add_boulder
 
 API_VERSION = 'v1'
+METRICS_TEST_TOKEN = 'test_metrics_token'
 
 
 class BaseIntegrationTestClass(unittest.TestCase):
@@ -122,6 +141,55 @@ class APITests(BaseIntegrationTestClass):
         self.assertEqual(resp.status_code, 404)
         self.assertIn(key, resp.json.keys())
 
+    def test_get_gym_name_new_catalog_version(self):
+        """
+        Get the name of a gym listed after the gyms were loaded
+        """
+        # Given
+        NEW_GYM_CODE = 'new_gym'
+        NEW_GYM_NAME = 'New Gym'
+        key = 'name'
+        route = f'/api/{API_VERSION}/gym/{NEW_GYM_CODE}/name'
+        self.assertEqual(self.client.get(route).status_code, 404)
+        self.db['walls'].insert_one({'id': NEW_GYM_CODE, 'name': NEW_GYM_NAME})
+        gym_catalog.bump_version(self.db)
+        # When
+        resp = self.client.get(route)
+        # Then
+        self.db['walls'].delete_many({'id': NEW_GYM_CODE})
+        gym_catalog.bump_version(self.db)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json[key], NEW_GYM_NAME)
+
+    def test_catalog_of_each_database(self):
+        """
+        Get the gyms of a DDBB after reading those of another one
+        """
+        # Given
+        other_db = self.db.client[f'{self.db.name}_other']
+        other_db['walls'].insert_one({'id': 'other_gym', 'name': 'Other Gym'})
+        gym_catalog.get_catalog(self.db)
+        # When
+        other_gyms = gym_catalog.get_gyms(other_db)
+        gyms = gym_catalog.get_gyms(self.db)
+        # Then
+        self.db.client.drop_database(other_db.name)
+        gym_catalog.invalidate(other_db.name)
+        self.assertListEqual(['other_gym'], [gym['id'] for gym in other_gyms])
+        self.assertIn(TEST_GYM_CODE, [gym['id'] for gym in gyms])
+
+    def test_walls_of_unknown_gym_not_cached(self):
+        """
+        Get the walls of a gym that is not listed
+        """
+        # Given
+        catalog = gym_catalog.get_catalog(self.db)
+        # When
+        walls = gym_catalog.get_gym_walls('not_a_gym', self.db)
+        # Then
+        self.assertListEqual([], walls)
+        self.assertNotIn('not_a_gym', catalog.walls)
+
     def test_get_walls(self):
         """
         Get available walls from a gym
@@ -176,6 +244,24 @@ class APITests(BaseIntegrationTestClass):
         self.assertEqual(resp.status_code, 404)
         self.assertIn(key, resp.json.keys())
 
+    def test_get_gym_wall_name_new_wall(self):
+        """
+        Get the name of a wall section added after the walls were loaded
+        """
+        # Given
+        NEW_WALL_CODE = 'new_wall'
+        NEW_WALL_NAME = 'New Wall'
+        key = 'name'
+        route = f'/api/{API_VERSION}/gym/{TEST_GYM_CODE}/{NEW_WALL_CODE}/name'
+        self.assertEqual(self.client.get(route).status_code, 404)
+        add_wall(self.db, TEST_GYM_CODE, NEW_WALL_NAME, NEW_WALL_CODE, TEST_WALL_RADIUS)
+        # When
+        resp = self.client.get(route)
+        # Then
+        self.db[f'{TEST_GYM_CODE}_walls'].delete_many({'image': NEW_WALL_CODE})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json[key], NEW_WALL_NAME)
+
     def test_get_gym_boulders(self):
         """
         Get boulders of a given gym
@@ -701,5 +787,993 @@ class APITests(BaseIntegrationTestClass):
         # self.assertEqual(resp.json.get('boulder_id'), boulder_id)
         # self.assertTrue(resp.json.get('marked_as_done'))
 
+
+class HoldsAtTests(BaseIntegrationTestClass):
+    """
+    Tests for the hold hit-testing endpoints
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.hold_data_folder = os.path.join(app.static_folder, 'images', 'walls', TEST_GYM_CODE)
+        self.hold_data_file = os.path.join(self.hold_data_folder, f'{TEST_WALL_SECTION}.json')
+        os.makedirs(self.hold_data_folder, exist_ok=True)
+        with open(self.hold_data_file, 'w') as f:
+            json.dump({'holds': [
+                [[0, 0], [100, 0], [100, 100], [0, 100]],
+                [[200, 200], [300, 200], [250, 300]],
+            ]}, f)
+        self.route = f'/api/{API_VERSION}/gym/{TEST_GYM_CODE}/{TEST_WALL_SECTION}/holds/at'
+
+    def tearDown(self):
+        shutil.rmtree(self.hold_data_folder)
+        super().tearDown()
+
+    def test_get_holds_at(self):
+        # When
+        resp = self.client.get(self.route, query_string={'x': 50, 'y': 50})
+        # Then
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(1, len(resp.json['holds']))
+        self.assertEqual(0, resp.json['holds'][0]['index'])
+        self.assertEqual([[0, 0], [100, 0], [100, 100], [0, 100]], resp.json['holds'][0]['polygon'])
+
+    def test_get_holds_at_no_hold(self):
+        # When
+        resp = self.client.get(self.route, query_string={'x': 150, 'y': 150})
+        # Then
+        self.assertEqual(resp.status_code, 200)
+        self.assertListEqual([], resp.json['holds'])
+
+    def test_get_holds_at_bad_request(self):
+        # When
+        resp = self.client.get(self.route, query_string={'x': 'a'})
+        # Then
+        self.assertEqual(resp.status_code, 400)
+        self.assertIn('errors', resp.json.keys())
+
+    def test_get_holds_at_non_finite_point(self):
+        for value in ('inf', '-inf', 'nan'):
+            # When
+            resp = self.client.get(self.route, query_string={'x': value, 'y': 50})
+            # Then
+            self.assertEqual(resp.status_code, 400, value)
+            self.assertIn('x', resp.json['errors'])
+
+    def test_get_holds_at_invalid_wall(self):
+        # Given
+        route = f'/api/{API_VERSION}/gym/{TEST_GYM_CODE}/aaa/holds/at'
+        # When
+        resp = self.client.get(route, query_string={'x': 50, 'y': 50})
+        # Then
+        self.assertEqual(resp.status_code, 404)
+        self.assertIn('errors', resp.json.keys())
+
+    def test_get_holds_at_batch(self):
+        # When
+        resp = self.client.post(self.route, json={'points': [[50, 50], [150, 150], [250, 250]]})
+        # Then
+        self.assertEqual(resp.status_code, 200)
+        points = resp.json['points']
+        self.assertListEqual([[50, 50], [150, 150], [250, 250]], [[p['x'], p['y']] for p in points])
+        self.assertListEqual([[0], [], [1]], [[h['index'] for h in p['holds']] for p in points])
+
+    def test_get_holds_at_batch_bad_request(self):
+        # When
+        resp = self.client.post(self.route, json={'points': [[50, 50, 50]]})
+        # Then
+        self.assertEqual(resp.status_code, 400)
+        self.assertIn('errors', resp.json.keys())
+
+
+class BoulderCountersTests(BaseIntegrationTestClass):
+    """
+    Tests for the atomic updates of boulder ratings and repetitions
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.boulder_id = mongodb_controller.get_boulder_by_name(
+            TEST_GYM_CODE, TEST_NAME, self.db)['_id']
+
+    def test_rate_boulder(self):
+        # Given
+        route = f'/api/{API_VERSION}/boulders/{TEST_GYM_CODE}/{self.boulder_id}/rate'
+        # When
+        responses = [self.client.post(route, json={'rating': rating}) for rating in (5, 2)]
+        # Then
+        self.assertListEqual([200, 200], [resp.status_code for resp in responses])
+        boulder = self.db[f'{TEST_GYM_CODE}_boulders'].find_one({'name': TEST_NAME})
+        self.assertEqual(2, boulder['raters'])
+        self.assertEqual(7, boulder['rating_sum'])
+        self.assertEqual(3.5, boulder['rating'])
+
+    def test_rate_boulder_not_found(self):
+        # Given
+        route = f'/api/{API_VERSION}/boulders/{TEST_GYM_CODE}/{"0" * 24}/rate'
+        # When
+        resp = self.client.post(route, json={'rating': 5})
+        # Then
+        self.assertEqual(resp.status_code, 404)
+        self.assertIn('errors', resp.json.keys())
+
+    def test_missing_boulder_keeps_version(self):
+        # Given
+        version = mongodb_controller.get_problems_version(TEST_GYM_CODE, 'boulders', self.db)
+        # When
+        mongodb_controller.rate_boulder_by_id(TEST_GYM_CODE, '0' * 24, 5, self.db)
+        mongodb_controller.rate_boulder_by_name(TEST_GYM_CODE, 'missing', 5, self.db)
+        mongodb_controller.add_boulder_repetition_by_id(TEST_GYM_CODE, '0' * 24, self.db)
+        # Then
+        self.assertEqual(
+            version, mongodb_controller.get_problems_version(TEST_GYM_CODE, 'boulders', self.db))
+        mongodb_controller.add_boulder_repetition_by_id(TEST_GYM_CODE, self.boulder_id, self.db)
+        self.assertEqual(
+            version + 1, mongodb_controller.get_problems_version(TEST_GYM_CODE, 'boulders', self.db))
+
+    def test_rate_boulder_without_rating_sum(self):
+        # Given
+        self.db[f'{TEST_GYM_CODE}_boulders'].update_one(
+            {'name': TEST_NAME}, {'$set': {'rating': 4, 'raters': 3}})
+        # When
+        mongodb_controller.rate_boulder_by_name(TEST_GYM_CODE, TEST_NAME, 0, self.db)
+        # Then
+        boulder = self.db[f'{TEST_GYM_CODE}_boulders'].find_one({'name': TEST_NAME})
+        self.assertEqual(4, boulder['raters'])
+        self.assertEqual(12, boulder['rating_sum'])
+        self.assertEqual(3, boulder['rating'])
+
+    def test_concurrent_ratings_and_repetitions(self):
+        # Given
+        ratings = [rating % 6 for rating in range(200)]
+
+        def rate(rating):
+            mongodb_controller.rate_boulder_by_id(TEST_GYM_CODE, self.boulder_id, rating, self.db)
+            mongodb_controller.add_boulder_repetition_by_id(TEST_GYM_CODE, self.boulder_id, self.db)
+        # When
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            list(executor.map(rate, ratings))
+        # Then
+        boulder = self.db[f'{TEST_GYM_CODE}_boulders'].find_one({'name': TEST_NAME})
+        self.assertEqual(len(ratings), boulder['raters'])
+        self.assertEqual(sum(ratings), boulder['rating_sum'])
+        self.assertAlmostEqual(sum(ratings) / len(ratings), boulder['rating'])
+        self.assertEqual(len(ratings), boulder['repetitions'])
+
+
+class ProblemListPaginationTests(BaseIntegrationTestClass):
+    """
+    Tests for the pagination and projection of the problem lists
+    """
+
+    def setUp(self):
+        super().setUp()
+        drop_boulders(self.db, TEST_GYM_CODE)
+        self.boulder_ids = [
+            str(_id) for _id in self.db[f'{TEST_GYM_CODE}_boulders'].insert_many([
+                {'name': f'{TEST_NAME}_{index}', 'holds': TEST_HOLDS, 'feet': TEST_FEET,
+                 'section': TEST_WALL_SECTION, 'difficulty': TEST_DIFFICULTY_INT}
+                for index in range(7)
+            ]).inserted_ids
+        ]
+        self.route = f'/api/{API_VERSION}/boulders/{TEST_GYM_CODE}/list'
+
+    def test_get_boulders_by_pages(self):
+        # Given
+        pages = []
+        query = {'limit': 3}
+        # When
+        while True:
+            resp = self.client.get(self.route, query_string=query)
+            self.assertEqual(resp.status_code, 200)
+            pages.append([boulder['_id'] for boulder in resp.json['boulders']])
+            if 'next' not in resp.json:
+                break
+            query['after'] = resp.json['next']
+        # Then
+        self.assertListEqual([3, 3, 1], [len(page) for page in pages])
+        self.assertListEqual(self.boulder_ids, [_id for page in pages for _id in page])
+
+    def test_get_all_boulders_without_limit(self):
+        # When
+        resp = self.client.get(self.route)
+        # Then
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(len(self.boulder_ids), len(resp.json['boulders']))
+        self.assertNotIn('next', resp.json)
+
+    def test_get_boulders_fields(self):
+        # When
+        resp = self.client.get(self.route, query_string={'fields': 'name,section', 'limit': 2})
+        # Then
+        self.assertEqual(resp.status_code, 200)
+        for boulder in resp.json['boulders']:
+            self.assertSetEqual({'_id', 'name', 'section', 'repetitions'}, set(boulder.keys()))
+
+    def test_get_boulders_summary(self):
+        # When
+        resp = self.client.get(self.route, query_string={'summary': 'true'})
+        # Then
+        self.assertEqual(resp.status_code, 200)
+        for boulder in resp.json['boulders']:
+            self.assertNotIn('holds', boulder)
+            self.assertIn('name', boulder)
+
+    def test_get_boulders_bad_request(self):
+        # When
+        responses = [
+            self.client.get(self.route, query_string=query)
+            for query in ({'limit': 0}, {'limit': 'all'}, {'fields': 'name,password'}, {'after': 'first'})
+        ]
+        # Then
+        for resp in responses:
+            self.assertEqual(resp.status_code, 400)
+            self.assertIn('errors', resp.json.keys())
+
+    def test_get_circuits_by_pages(self):
+        # Given
+        self.db[f'{TEST_GYM_CODE}_circuits'].drop()
+        self.db[f'{TEST_GYM_CODE}_circuits'].insert_many(
+            [{'name': f'{TEST_NAME}_{index}', 'holds': TEST_HOLDS} for index in range(3)])
+        route = f'/api/{API_VERSION}/circuits/{TEST_GYM_CODE}/list'
+        # When
+        first_page = self.client.get(route, query_string={'limit': 2, 'summary': 'true'})
+        second_page = self.client.get(
+            route, query_string={'limit': 2, 'after': first_page.json['next']})
+        # Then
+        self.assertEqual(2, len(first_page.json['circuits']))
+        self.assertNotIn('holds', first_page.json['circuits'][0])
+        self.assertEqual(1, len(second_page.json['circuits']))
+        self.assertNotIn('next', second_page.json)
+        self.db[f'{TEST_GYM_CODE}_circuits'].drop()
+
+
+class ConditionalRequestTests(BaseIntegrationTestClass):
+    """
+    Tests for the ETag and Cache-Control headers of the read-only API
+    """
+
+    def setUp(self):
+        super().setUp()
+        drop_boulders(self.db, TEST_GYM_CODE)
+        self.boulder_id = str(self.db[f'{TEST_GYM_CODE}_boulders'].insert_one(
+            {'name': TEST_NAME, 'holds': TEST_HOLDS, 'feet': TEST_FEET,
+             'section': TEST_WALL_SECTION, 'difficulty': TEST_DIFFICULTY_INT}
+        ).inserted_id)
+        self.route = f'/api/{API_VERSION}/boulders/{TEST_GYM_CODE}/list'
+
+    def test_not_modified_boulders(self):
+        # Given
+        first = self.client.get(self.route)
+        # When
+        second = self.client.get(self.route, headers={'If-None-Match': first.headers['ETag']})
+        # Then
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(b'', second.data)
+        self.assertEqual(first.headers['ETag'], second.headers['ETag'])
+        self.assertEqual('no-cache', second.headers['Cache-Control'])
+
+    def test_modified_boulders(self):
+        # Given
+        first = self.client.get(self.route)
+        mongodb_controller.rate_boulder_by_id(TEST_GYM_CODE, self.boulder_id, 5, self.db)
+        # When
+        second = self.client.get(self.route, headers={'If-None-Match': first.headers['ETag']})
+        # Then
+        self.assertEqual(second.status_code, 200)
+        self.assertNotEqual(first.headers['ETag'], second.headers['ETag'])
+        self.assertEqual(5, second.json['boulders'][0]['rating'])
+
+    def test_etag_depends_on_query(self):
+        # When
+        first = self.client.get(self.route)
+        second = self.client.get(self.route, query_string={'summary': 'true'})
+        # Then
+        self.assertNotEqual(first.headers['ETag'], second.headers['ETag'])
+
+    def test_not_modified_gyms(self):
+        # Given
+        route = f'/api/{API_VERSION}/gym/list'
+        first = self.client.get(route)
+        # When
+        second = self.client.get(route, headers={'If-None-Match': first.headers['ETag']})
+        # Then
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual('public, max-age=300', first.headers['Cache-Control'])
+        self.assertEqual('public, max-age=300', second.headers['Cache-Control'])
+
+    def test_errors_are_not_tagged(self):
+        # When
+        resp = self.client.get(f'/api/{API_VERSION}/boulders/{TEST_GYM_CODE}/{ObjectId()}')
+        # Then
+        self.assertEqual(resp.status_code, 404)
+        self.assertNotIn('ETag', resp.headers)
+        self.assertNotIn('Cache-Control', resp.headers)
+
+
+class CompressionTests(BaseIntegrationTestClass):
+    """
+    Tests for the compression of the responses
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.route = f'/api/{API_VERSION}/boulders/{TEST_GYM_CODE}/list'
+
+    def test_gzip_boulder_list(self):
+        # Given
+        plain = self.client.get(self.route)
+        # When
+        resp = self.client.get(self.route, headers={'Accept-Encoding': 'gzip'})
+        # Then
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual('gzip', resp.headers['Content-Encoding'])
+        self.assertIn('Accept-Encoding', resp.headers['Vary'])
+        self.assertEqual(plain.json, json.loads(gzip.decompress(resp.data)))
+        self.assertEqual(plain.headers['ETag'][:-1] + '-gzip"', resp.headers['ETag'])
+
+    @unittest.skipIf(compression.brotli is None, 'brotli is not installed')
+    def test_brotli_boulder_list(self):
+        # Given
+        plain = self.client.get(self.route)
+        # When
+        resp = self.client.get(self.route, headers={'Accept-Encoding': 'gzip, br'})
+        # Then
+        self.assertEqual('br', resp.headers['Content-Encoding'])
+        self.assertEqual(plain.json, json.loads(compression.brotli.decompress(resp.data)))
+
+    def test_not_compressed(self):
+        # Given
+        route = f'/api/{API_VERSION}/gym/{TEST_GYM_CODE}/name'
+        # When
+        small = self.client.get(route, headers={'Accept-Encoding': 'gzip'})
+        not_accepted = self.client.get(self.route)
+        # Then
+        self.assertNotIn('Content-Encoding', small.headers)
+        self.assertNotIn('Content-Encoding', not_accepted.headers)
+        self.assertIn('Accept-Encoding', not_accepted.headers['Vary'])
+
+    def test_not_modified_compressed(self):
+        # Given
+        headers = {'Accept-Encoding': 'gzip'}
+        first = self.client.get(self.route, headers=headers)
+        # When
+        second = self.client.get(
+            self.route, headers=dict(headers, **{'If-None-Match': first.headers['ETag']}))
+        # Then
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(first.headers['ETag'], second.headers['ETag'])
+
+
+class MessagePackTests(BaseIntegrationTestClass):
+    """
+    Tests for the MessagePack encoded responses
+    """
+    headers = {'Accept': 'application/msgpack'}
+
+    def test_get_boulders(self):
+        # Given
+        route = f'/api/{API_VERSION}/boulders/{TEST_GYM_CODE}/list'
+        plain = self.client.get(route)
+        # When
+        resp = self.client.get(route, headers=self.headers)
+        # Then
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual('application/msgpack', resp.mimetype)
+        self.assertIn('Accept', resp.headers['Vary'])
+        self.assertEqual(plain.json, msgpack.unpackb(resp.data))
+        self.assertNotEqual(plain.headers['ETag'], resp.headers['ETag'])
+
+    def test_get_boulders_by_pages(self):
+        # Given
+        route = f'/api/{API_VERSION}/boulders/{TEST_GYM_CODE}/list'
+        self.db[f'{TEST_GYM_CODE}_boulders'].insert_one(
+            {'name': TEST_NAME, 'holds': TEST_HOLDS, 'section': TEST_WALL_SECTION})
+        # When
+        resp = self.client.get(route, query_string={'limit': 1}, headers=self.headers)
+        # Then
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual({'boulders', 'next'}, set(msgpack.unpackb(resp.data).keys()))
+
+    def test_get_gyms(self):
+        # When
+        resp = self.client.get(f'/api/{API_VERSION}/gym/list', headers=self.headers)
+        # Then
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(TEST_GYM_NAME, msgpack.unpackb(resp.data)['gyms'][0]['name'])
+
+    def test_errors(self):
+        # When
+        resp = self.client.get(
+            f'/api/{API_VERSION}/gym/aaa/name', headers={'Accept': 'application/x-msgpack'})
+        # Then
+        self.assertEqual(resp.status_code, 404)
+        self.assertEqual('application/msgpack', resp.mimetype)
+        self.assertIn('gym_id', msgpack.unpackb(resp.data)['errors'])
+
+
+class BoulderBatchCreateTests(BaseIntegrationTestClass):
+    """
+    Tests for the creation of several boulders at once
+    """
+
+    def setUp(self):
+        super().setUp()
+        drop_boulders(self.db, TEST_GYM_CODE)
+        self.route = f'/api/{API_VERSION}/boulders/{TEST_GYM_CODE}/{TEST_WALL_SECTION}/create/batch'
+
+    def get_boulder_data(self, name):
+        fields = BoulderFields()
+        return {
+            fields.creator: TEST_CREATOR,
+            fields.difficulty: TEST_DIFFICULTY_STRING,
+            fields.feet: TEST_FEET,
+            fields.name: name,
+            fields.notes: TEST_NOTES,
+            fields.holds: TEST_HOLDS,
+            fields.is_project: TEST_IS_PROJECT
+        }
+
+    def test_create_boulders(self):
+        # Given
+        boulders = [self.get_boulder_data(f'{TEST_NAME}_{index}') for index in range(3)]
+        # When
+        resp = self.client.post(self.route, json={'boulders': boulders})
+        # Then
+        self.assertEqual(resp.status_code, 201)
+        self.assertEqual(3, resp.json['created'])
+        self.assertListEqual([0, 1, 2], [result['index'] for result in resp.json['results']])
+        for result, boulder in zip(resp.json['results'], boulders):
+            stored = mongodb_controller.get_boulder_by_id(TEST_GYM_CODE, result['_id'], self.db)
+            self.assertEqual(boulder['name'], stored['name'])
+            self.assertEqual(TEST_WALL_SECTION, stored['section'])
+            self.assertEqual(TEST_DIFFICULTY_STRING, stored['difficulty'])
+
+    def test_create_boulders_partially(self):
+        # Given
+        missing_name = self.get_boulder_data(TEST_NAME)
+        del missing_name['name']
+        boulders = [
+            self.get_boulder_data(TEST_NAME),
+            missing_name,
+            dict(self.get_boulder_data(TEST_NAME), difficulty='purple'),
+        ]
+        # When
+        resp = self.client.post(self.route, json={'boulders': boulders})
+        # Then
+        results = resp.json['results']
+        self.assertEqual(resp.status_code, 207)
+        self.assertEqual(1, resp.json['created'])
+        self.assertTrue(results[0]['created'])
+        self.assertFalse(results[1]['created'])
+        self.assertIn('name', results[1]['errors'])
+        self.assertFalse(results[2]['created'])
+        self.assertIn('difficulty', results[2]['errors'])
+        self.assertEqual(1, self.db[f'{TEST_GYM_CODE}_boulders'].count_documents({}))
+
+    def test_create_invalid_boulders(self):
+        # Given
+        boulders = [{'name': TEST_NAME}, {}]
+        # When
+        resp = self.client.post(self.route, json={'boulders': boulders})
+        # Then
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(0, resp.json['created'])
+        self.assertEqual(0, self.db[f'{TEST_GYM_CODE}_boulders'].count_documents({}))
+
+    def test_create_boulders_bad_request(self):
+        # When
+        responses = [
+            self.client.post(self.route, json={}),
+            self.client.post(self.route, json={'boulders': []}),
+            self.client.post(self.route, json={'boulders': 'boulder'}),
+        ]
+        # Then
+        for resp in responses:
+            self.assertEqual(resp.status_code, 400)
+            self.assertIn('boulders', resp.json['errors'])
+
+    def test_create_boulders_no_wall_section(self):
+        # Given
+        route = f'/api/{API_VERSION}/boulders/{TEST_GYM_CODE}/blabla/create/batch'
+        # When
+        resp = self.client.post(route, json={'boulders': [self.get_boulder_data(TEST_NAME)]})
+        # Then
+        self.assertEqual(resp.status_code, 404)
+        self.assertIn('wall_section', resp.json['errors'])
+
+    def test_put_boulders_write_errors(self):
+        # Given
+        boulder_id = ObjectId()
+        boulders = [
+            dict(self.get_boulder_data(TEST_NAME), _id=boulder_id),
+            dict(self.get_boulder_data(TEST_NAME), _id=boulder_id),
+            self.get_boulder_data(TEST_NAME),
+        ]
+        # When
+        results = mongodb_controller.put_boulders(boulders, TEST_GYM_CODE, self.db)
+        # Then
+        self.assertEqual((str(boulder_id), None), results[0])
+        self.assertIsNone(results[1][0])
+        self.assertIsNotNone(results[1][1])
+        self.assertIsNotNone(results[2][0])
+        self.assertEqual(2, self.db[f'{TEST_GYM_CODE}_boulders'].count_documents({}))
+
+
+class TicklistTests(BaseIntegrationTestClass):
+    """
+    Tests for the ticklist entries collection
+    """
+
+    def setUp(self):
+        super().setUp()
+        # the users are dropped along with the ticklist index, which
+        # processes only ensure once
+        indexes.ensure_collection_indexes(mongodb_controller.TICKLIST_COLLECTION, self.db)
+        self.user_id = self.db['users'].find_one({'name': TEST_USERNAME})['id']
+        self.boulder = {
+            'gym': TEST_GYM_CODE,
+            'iden': mongodb_controller.get_boulder_by_name(TEST_GYM_CODE, TEST_NAME, self.db)['_id'],
+            'section': TEST_WALL_SECTION,
+            'is_done': True
+        }
+
+    def get_entries(self):
+        return list(self.db[mongodb_controller.TICKLIST_COLLECTION].find({'user_id': self.user_id}))
+
+    def test_mark_boulder_as_done_again(self):
+        # When
+        entry = mongodb_controller.put_boulder_in_ticklist(
+            self.boulder, self.user_id, self.db, mark_as_done_clicked=True)
+        # Then
+        self.assertEqual(1, len(self.get_entries()))
+        self.assertTrue(entry['is_done'])
+        self.assertEqual(2, len(entry['date_climbed']))
+        self.assertNotIn('user_id', entry)
+
+    def test_add_boulder_keeps_done_status(self):
+        # When
+        entry = mongodb_controller.put_boulder_in_ticklist(
+            dict(self.boulder, is_done=False), self.user_id, self.db)
+        # Then
+        self.assertEqual(1, len(self.get_entries()))
+        self.assertTrue(entry['is_done'])
+        self.assertEqual(1, len(entry['date_climbed']))
+
+    def test_delete_boulder(self):
+        # When
+        deleted = mongodb_controller.delete_boulder_in_ticklist(self.boulder, self.user_id, self.db)
+        deleted_again = mongodb_controller.delete_boulder_in_ticklist(self.boulder, self.user_id, self.db)
+        # Then
+        self.assertTrue(deleted)
+        self.assertFalse(deleted_again)
+        self.assertListEqual([], self.get_entries())
+
+    def test_user_ticklist_not_embedded(self):
+        # When
+        user = self.db['users'].find_one({'id': self.user_id})
+        ticklist = User.get_by_id(self.user_id, self.db).get_ticklist(self.db)
+        # Then
+        self.assertNotIn('ticklist', user)
+        self.assertListEqual([self.boulder['iden']], [problem.iden for problem in ticklist])
+
+    def test_concurrent_ticks(self):
+        # Given
+        boulders = [dict(self.boulder, iden=str(ObjectId())) for _ in range(50)]
+
+        def tick(boulder):
+            mongodb_controller.put_boulder_in_ticklist(
+                boulder, self.user_id, self.db, mark_as_done_clicked=True)
+        # When
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(tick, boulders + boulders))
+        # Then
+        entries = self.get_entries()
+        self.assertEqual(len(boulders) + 1, len(entries))
+        self.assertTrue(all(
+            len(entry['date_climbed']) == 2 for entry in entries if entry['iden'] != self.boulder['iden']))
+
+    def test_migrate_embedded_ticklist(self):
+        # Given
+        ticked = str(ObjectId())
+        self.db['users'].update_one({'id': self.user_id}, {'$set': {'ticklist': [
+            {'iden': self.boulder['iden'], 'gym': TEST_GYM_CODE, 'section': TEST_WALL_SECTION,
+             'is_done': True, 'date_climbed': '2021-01-01'},
+            {'iden': ticked, 'gym': TEST_GYM_CODE, 'section': TEST_WALL_SECTION, 'is_done': False},
+        ]}})
+        # When
+        users, entries = migrate_ticklists.migrate(self.db)
+        migrated_again = migrate_ticklists.migrate(self.db)
+        # Then
+        self.assertEqual((1, 2), (users, entries))
+        self.assertEqual((0, 0), migrated_again)
+        self.assertNotIn('ticklist', self.db['users'].find_one({'id': self.user_id}))
+        ticklist = mongodb_controller.get_ticklist(self.user_id, self.db)
+        self.assertListEqual([self.boulder['iden'], ticked], [entry['iden'] for entry in ticklist])
+        self.assertEqual('2021-01-01', ticklist[0]['date_climbed'][0])
+        self.assertEqual(2, len(ticklist[0]['date_climbed']))
+        self.assertFalse(ticklist[1]['is_done'])
+
+    def test_migrate_half_migrated_ticklist(self):
+        # Given
+        self.db['users'].update_one({'id': self.user_id}, {'$set': {'ticklist': [
+            {'iden': self.boulder['iden'], 'gym': TEST_GYM_CODE, 'section': TEST_WALL_SECTION,
+             'is_done': True, 'date_climbed': ['2021-01-01', '2021-02-01']},
+        ]}})
+        user = self.db['users'].find_one({'id': self.user_id})
+        updates = migrate_ticklists.get_entry_updates(user['id'], user['ticklist'])
+        self.db[mongodb_controller.TICKLIST_COLLECTION].bulk_write(updates, ordered=True)
+        # When
+        users, entries = migrate_ticklists.migrate(self.db)
+        # Then
+        self.assertEqual((1, 1), (users, entries))
+        self.assertNotIn('ticklist', self.db['users'].find_one({'id': self.user_id}))
+        ticklist = mongodb_controller.get_ticklist(self.user_id, self.db)
+        self.assertEqual(['2021-01-01', '2021-02-01'], ticklist[0]['date_climbed'][:2])
+        self.assertEqual(3, len(ticklist[0]['date_climbed']))
+
+
+class IndexTests(BaseIntegrationTestClass):
+    """
+    Tests for the index registry
+    """
+
+    def test_required_indexes_of_listed_gyms(self):
+        # When
+        required = indexes.get_required_indexes(self.db)
+        # Then
+        self.assertIn(f'{TEST_GYM_CODE}_boulders', required)
+        self.assertIn(f'{TEST_GYM_CODE}_circuits', required)
+        self.assertIn(mongodb_controller.TICKLIST_COLLECTION, required)
+
+    def test_ensure_indexes(self):
+        # When
+        indexes.ensure_indexes(self.db, [TEST_GYM_CODE])
+        indexes.ensure_indexes(self.db, [TEST_GYM_CODE])
+        # Then
+        self.assertListEqual([], indexes.get_missing_indexes(self.db, [TEST_GYM_CODE]))
+
+    def test_missing_indexes(self):
+        # Given
+        indexes.ensure_indexes(self.db, [TEST_GYM_CODE])
+        self.db[f'{TEST_GYM_CODE}_boulders'].drop_indexes()
+        # When
+        missing = indexes.get_missing_indexes(self.db, [TEST_GYM_CODE])
+        # Then
+        self.assertEqual(
+            len(indexes.GYM_COLLECTION_INDEXES['boulders']), len(missing))
+        self.assertTrue(all(
+            collection == f'{TEST_GYM_CODE}_boulders' for collection, _ in missing))
+
+    def test_ensure_gym_indexes_creates_collections(self):
+        # Given
+        gym = 'index_test_gym'
+        # When
+        indexes.ensure_gym_indexes(gym, self.db)
+        missing = indexes.get_missing_indexes(self.db, [gym])
+        # Then
+        self.assertIn(f'{gym}_boulders', self.db.list_collection_names())
+        self.assertListEqual([], [collection for collection, _ in missing if collection.startswith(gym)])
+        self.db.drop_collection(f'{gym}_boulders')
+        self.db.drop_collection(f'{gym}_circuits')
+
+    def test_ensure_gym_indexes_once(self):
+        # Given
+        indexes.reset_indexes_once()
+        indexes.ensure_gym_indexes_once(TEST_GYM_CODE, self.db)
+        self.db[f'{TEST_GYM_CODE}_boulders'].drop_indexes()
+        # When
+        indexes.ensure_gym_indexes_once(TEST_GYM_CODE, self.db)
+        missing_before_reset = indexes.get_missing_indexes(self.db, [TEST_GYM_CODE])
+        indexes.reset_indexes_once()
+        indexes.ensure_gym_indexes_once(TEST_GYM_CODE, self.db)
+        missing_after_reset = indexes.get_missing_indexes(self.db, [TEST_GYM_CODE])
+        # Then
+        boulders = f'{TEST_GYM_CODE}_boulders'
+        self.assertEqual(
+            len(indexes.GYM_COLLECTION_INDEXES['boulders']),
+            len([collection for collection, _ in missing_before_reset if collection == boulders]))
+        self.assertNotIn(boulders, [collection for collection, _ in missing_after_reset])
+
+
+    def test_ensure_indexes_at_startup(self):
+        # Given
+        indexes.reset_indexes_once()
+        self.db[f'{TEST_GYM_CODE}_boulders'].drop_indexes()
+        # When
+        ensure_indexes()
+        # Then
+        self.assertListEqual([], indexes.get_missing_indexes(self.db, [TEST_GYM_CODE]))
+
+    def test_index_failures_logged(self):
+        # Given
+        indexes.reset_indexes_once()
+        error = OperationFailure('Index build failed: duplicate key')
+        # When
+        with patch.object(type(self.db['walls']), 'create_indexes', side_effect=error), \
+                self.assertLogs('db.indexes', 'WARNING') as logs:
+            indexes.ensure_gym_indexes_once(TEST_GYM_CODE, self.db)
+        indexes.reset_indexes_once()
+        # Then
+        self.assertIn('duplicate key', logs.output[0])
+
+
+class UserLoadingTests(BaseIntegrationTestClass):
+    """
+    Tests for the user and preferences single query fetch
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.user_id = self.db['users'].find_one({'name': TEST_USERNAME})['id']
+        self.db['user_preferences'].update_one(
+            {'user_id': self.user_id}, {'$set': {'default_gym': TEST_GYM_CODE}})
+
+    def test_get_user_data_with_preferences(self):
+        # When
+        user_data, user_prefs = mongodb_controller.get_user_data_with_preferences(
+            'email', TEST_EMAIL, self.db)
+        # Then
+        self.assertEqual(TEST_USERNAME, user_data['name'])
+        self.assertNotIn('user_preferences', user_data)
+        self.assertIsInstance(user_data['_id'], str)
+        self.assertEqual(TEST_GYM_CODE, user_prefs['default_gym'])
+
+    def test_user_without_preferences(self):
+        # Given
+        self.db['user_preferences'].delete_many({'user_id': self.user_id})
+        # When
+        user = User.get_user_by_username(TEST_USERNAME, self.db)
+        # Then
+        self.assertEqual(self.user_id, user.preferences.user_id)
+        self.assertEqual('', user.preferences.default_gym)
+
+    def test_user_factories(self):
+        # When
+        users = [
+            User.get_by_id(self.user_id, self.db),
+            User.get_user_by_email(TEST_EMAIL, self.db),
+            User.get_user_by_username(TEST_USERNAME, self.db),
+        ]
+        # Then
+        for user in users:
+            self.assertEqual(self.user_id, user.id)
+            self.assertEqual(TEST_GYM_CODE, user.preferences.default_gym)
+
+    def test_verify_auth_token_is_cached(self):
+        # Given
+        user_cache.invalidate()
+        token = User.get_by_id(self.user_id, self.db).generate_auth_token(app)
+        User.verify_auth_token(token, app, self.db)
+        self.db['users'].update_one({'id': self.user_id}, {'$set': {'name': 'not read'}})
+        # When
+        user = User.verify_auth_token(token, app, self.db)
+        # Then
+        self.assertEqual(TEST_USERNAME, user.name)
+
+    def test_saving_user_invalidates_token(self):
+        # Given
+        user_cache.invalidate()
+        user = User.get_by_id(self.user_id, self.db)
+        token = user.generate_auth_token(app)
+        User.verify_auth_token(token, app, self.db)
+        user.preferences.default_gym = 'other_gym'
+        # When
+        user.save(self.db)
+        verified_user = User.verify_auth_token(token, app, self.db)
+        # Then
+        self.assertEqual('other_gym', verified_user.preferences.default_gym)
+
+    def test_token_verified_during_save_is_not_cached(self):
+        # Given
+        user_cache.invalidate()
+        user = User.get_by_id(self.user_id, self.db)
+        token = user.generate_auth_token(app)
+        User.verify_auth_token(token, app, self.db)
+        user.preferences.default_gym = 'other_gym'
+        invalidate = user_cache.invalidate
+
+        def invalidate_and_verify(*args, **kwargs):
+            invalidate(*args, **kwargs)
+            User.verify_auth_token(token, app, self.db)
+
+        # When
+        with patch.object(user_cache, 'invalidate', side_effect=invalidate_and_verify):
+            user.save(self.db)
+        verified_user = User.verify_auth_token(token, app, self.db)
+        # Then
+        self.assertEqual('other_gym', verified_user.preferences.default_gym)
+
+    def test_verify_expired_auth_token(self):
+        # Given
+        user_cache.invalidate()
+        token = User.get_by_id(self.user_id, self.db).generate_auth_token(app)
+        # When
+        with patch('src.models.AUTH_TOKEN_EXPIRATION', -1):
+            user = User.verify_auth_token(token, app, self.db)
+        # Then
+        self.assertIsNone(user)
+
+    def test_verify_auth_token_unknown_user(self):
+        # Given
+        token = Serializer(app.secret_key).dumps({'id': 'unknown'})
+        # When
+        user = User.verify_auth_token(token, app, self.db)
+        # Then
+        self.assertIsNone(user)
+
+
+class UserCacheTests(BaseIntegrationTestClass):
+    """
+    Tests for the per-process cache of the logged in users
+    """
+
+    def setUp(self):
+        super().setUp()
+        user_cache.invalidate()
+        self.user_id = self.db['users'].find_one({'name': TEST_USERNAME})['id']
+
+    def test_user_is_cached(self):
+        # Given
+        User.get_cached_by_id(self.user_id, self.db)
+        self.db['user_preferences'].update_one(
+            {'user_id': self.user_id}, {'$set': {'default_gym': TEST_GYM_CODE}})
+        # When
+        user = User.get_cached_by_id(self.user_id, self.db)
+        # Then
+        self.assertEqual(TEST_USERNAME, user.name)
+        self.assertEqual('', user.preferences.default_gym)
+
+    def test_saving_user_invalidates_cache(self):
+        # Given
+        user = User.get_cached_by_id(self.user_id, self.db)
+        user.preferences.default_gym = TEST_GYM_CODE
+        # When
+        user.save(self.db)
+        cached_user = User.get_cached_by_id(self.user_id, self.db)
+        # Then
+        self.assertEqual(TEST_GYM_CODE, cached_user.preferences.default_gym)
+
+    def test_load_during_save_is_not_cached(self):
+        # Given
+        user = User.get_cached_by_id(self.user_id, self.db)
+        user.preferences.default_gym = TEST_GYM_CODE
+        invalidate = user_cache.invalidate
+
+        def invalidate_and_load(user_id=None):
+            invalidate(user_id)
+            # another request loads the user as soon as the cache is invalidated
+            User.get_cached_by_id(self.user_id, self.db)
+
+        # When
+        with patch.object(user_cache, 'invalidate', side_effect=invalidate_and_load):
+            user.save(self.db)
+        cached_user = User.get_cached_by_id(self.user_id, self.db)
+        # Then
+        self.assertEqual(TEST_GYM_CODE, cached_user.preferences.default_gym)
+
+    def test_unknown_user(self):
+        # When
+        user = User.get_cached_by_id('unknown', self.db)
+        # Then
+        self.assertIsNone(user)
+
+
+class StatsTests(BaseIntegrationTestClass):
+    """
+    Home page stats
+    """
+
+    def test_get_stats(self):
+        # Given
+        get_stats.cache_clear()
+        gyms = list(self.db['walls'].find())
+        boulders = sum(
+            len(list(self.db[f"{gym['id']}_boulders"].find())) for gym in gyms)
+        routes = sum(
+            len(list(self.db[f"{gym['id']}_routes"].find())) for gym in gyms)
+        # When
+        stats = get_stats(self.db)
+        # Then
+        self.assertDictEqual(
+            stats, {'Boulders': boulders, 'Routes': routes, 'Gyms': len(gyms)})
+
+    def test_get_stats_is_cached(self):
+        # Given
+        get_stats.cache_clear()
+        stats = get_stats(self.db)
+        add_boulder(self.db, TEST_GYM_CODE, {'name': 'not counted yet'})
+        # When
+        cached_stats = get_stats(self.db)
+        # Then
+        self.assertDictEqual(stats, cached_stats)
+
+
+class InstrumentationTests(BaseIntegrationTestClass):
+    """
+    DDBB commands attributed to the requests that send them
+    """
+
+    def test_server_timing_in_debug_mode(self):
+        # Given
+        with patch.dict(app.config, {'DEBUG': True}):
+            # When
+            resp = self.client.get(f'/api/{API_VERSION}/gym/list')
+        # Then
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn('db;dur=', resp.headers['Server-Timing'])
+
+    def test_no_server_timing_in_production(self):
+        # When
+        resp = self.client.get(f'/api/{API_VERSION}/gym/list')
+        # Then
+        self.assertNotIn('Server-Timing', resp.headers)
+
+    def test_database_metrics(self):
+        # Given
+        instrumentation.reset_totals()
+        for _ in range(2):
+            self.client.get(f'/api/{API_VERSION}/gym/list')
+        # When
+        with patch('application.METRICS_TOKEN', METRICS_TEST_TOKEN):
+            resp = self.client.get('/metrics/db', headers={'Authorization': f'Bearer {METRICS_TEST_TOKEN}'})
+        # Then
+        self.assertEqual(resp.status_code, 200)
+        totals = resp.json['endpoints']['api_blueprint.get_gyms']
+        self.assertEqual(totals['requests'], 2)
+        self.assertEqual(
+            {'requests', 'commands', 'duration_ms', 'documents', 'errors'}, set(totals))
+
+
+class MetricsTests(BaseIntegrationTestClass):
+    """
+    Prometheus-style metrics endpoint
+    """
+
+    def test_metrics(self):
+        # Given
+        self.client.get(f'/api/{API_VERSION}/gym/list')
+        self.client.get('/contact', headers={'Accept-Language': 'en'})
+        # When
+        with patch('application.METRICS_TOKEN', METRICS_TEST_TOKEN):
+            resp = self.client.get('/metrics', headers={'Authorization': f'Bearer {METRICS_TEST_TOKEN}'})
+        # Then
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.mimetype, 'text/plain')
+        metrics = resp.get_data(as_text=True)
+        self.assertIn(
+            'rocolib_request_duration_seconds_count{endpoint="api_blueprint.get_gyms",'
+            'route="/api/v1/gym/list",method="GET"}', metrics)
+        self.assertIn('rocolib_requests_total{endpoint="show_contact",method="GET",status="200"}', metrics)
+        self.assertIn('rocolib_template_render_duration_seconds_count{template="contact.html"}', metrics)
+        self.assertIn('rocolib_mongo_function_duration_seconds_count{function="get_gyms"}', metrics)
+        self.assertIn('rocolib_cache_requests_total{cache="catalog",', metrics)
+        self.assertIn(f'rocolib_worker_start_time_seconds{{pid="{os.getpid()}"}}', metrics)
+
+    def test_metrics_without_token(self):
+        # When
+        with patch('application.METRICS_TOKEN', METRICS_TEST_TOKEN):
+            responses = [
+                self.client.get(route, headers=headers)
+                for route in ('/metrics', '/metrics/db')
+                for headers in ({}, {'Authorization': 'Bearer wrong'})
+            ]
+        # Then
+        for resp in responses:
+            self.assertEqual(resp.status_code, 401)
+
+    def test_metrics_disabled(self):
+        # When
+        with patch('application.METRICS_TOKEN', ''):
+            responses = [
+                self.client.get(route, headers={'Accept-Language': 'en'})
+                for route in ('/metrics', '/metrics/db')
+            ]
+        # Then
+        for resp in responses:
+            self.assertEqual(resp.status_code, 404)
+
+
 if __name__ == '__main__':
     unittest.main()
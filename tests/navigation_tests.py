@@ -0,0 +1,149 @@
+import itertools
+import random
+import unittest
+from datetime import datetime, timedelta
+
+import db.mongodb_controller as mongodb_controller
+from db import catalog as gym_catalog
+from db.indexes import ensure_gym_indexes
+from db.mongodb_controller import SORTING_FIELD_MAP
+from tests.tests_config import TEST_CREATOR, TEST_FEET, TEST_HOLDS, TEST_NOTES
+from tests.tests_config import TEST_NAVIGATION_GYM_CODE, TEST_NAVIGATION_USER_ID
+from tests.utils import get_db_connection
+
+NUMBER_OF_BOULDERS = 60
+LATEST_SECTION = 'latest_wall'
+OLD_SECTION = 'old_wall'
+
+
+def legacy_navigation_list(gym, user_id, latest_wall_set, sort_by, is_ascending, to_show, db):
+    """
+    Reference implementation: the ordered list of boulders the problem
+    view used to navigate through, built by loading the whole gym
+    """
+    query = {}
+    if latest_wall_set:
+        walls = db[f'{gym}_walls'].find({'latest': True})
+        query = {'section': {'$in': [wall['image'] for wall in walls]}}
+    boulders = list(
+        db[f'{gym}_boulders'].find(query).sort([
+            (SORTING_FIELD_MAP[sort_by], 1 if is_ascending else -1),
+            ('time', -1)
+        ])
+    )
+    if to_show == 'to_do' and user_id:
+        done_boulders = [
+            b['iden'] for b in db['ticklist_entries'].find({'user_id': user_id, 'is_done': True})
+        ]
+        boulders = [b for b in boulders if str(b['_id']) not in done_boulders]
+    return [str(b['_id']) for b in boulders]
+
+
+class KeysetNavigationTests(unittest.TestCase):
+    """
+    Check that navigating to the next/previous problem with keyset
+    queries follows exactly the order of the full list of problems
+    """
+
+    def setUp(self):
+        random.seed(NUMBER_OF_BOULDERS)
+        self.db = get_db_connection()
+        self.gym = TEST_NAVIGATION_GYM_CODE
+        self.user_id = TEST_NAVIGATION_USER_ID
+        self.drop_test_collections()
+        self.db['walls'].insert_one({'id': self.gym, 'name': self.gym})
+        self.db[f'{self.gym}_walls'].insert_many([
+            {'image': LATEST_SECTION, 'name': LATEST_SECTION, 'radius': 0.02, 'latest': True},
+            {'image': OLD_SECTION, 'name': OLD_SECTION, 'radius': 0.02, 'latest': False},
+        ])
+        gym_catalog.invalidate(self.db.name)
+        # distinct creation times so that the legacy order is deterministic
+        times = random.sample(range(100000), NUMBER_OF_BOULDERS)
+        boulders = []
+        for index, hours in enumerate(times):
+            boulder = {
+                'creator': TEST_CREATOR,
+                'difficulty': random.randint(0, 3),
+                'feet': TEST_FEET,
+                'holds': TEST_HOLDS,
+                'name': f'navigation_{index}',
+                'notes': TEST_NOTES,
+                'rating': random.choice([0, 1, 2.5, 4, 5]),
+                'raters': 1,
+                'section': random.choice([LATEST_SECTION, OLD_SECTION]),
+                'time': (datetime(2022, 1, 1) + timedelta(hours=hours)).isoformat(),
+            }
+            # old boulders do not have repetitions
+            if index % 4:
+                boulder['repetitions'] = random.randint(0, 3)
+            boulders.append(boulder)
+        self.boulder_ids = [
+            str(_id) for _id in self.db[f'{self.gym}_boulders'].insert_many(boulders).inserted_ids
+        ]
+        done_boulders = random.sample(self.boulder_ids, NUMBER_OF_BOULDERS // 4)
+        self.db['users'].insert_one({'id': self.user_id})
+        self.db['ticklist_entries'].insert_many([
+            {'user_id': self.user_id, 'iden': iden, 'gym': self.gym, 'is_done': True}
+            for iden in done_boulders
+        ])
+
+    def drop_test_collections(self):
+        self.db['walls'].delete_many({'id': self.gym})
+        self.db[f'{self.gym}_walls'].drop()
+        self.db[f'{self.gym}_boulders'].drop()
+        self.db['users'].delete_many({'id': self.user_id})
+        self.db['ticklist_entries'].delete_many({'user_id': self.user_id})
+
+    def tearDown(self):
+        self.drop_test_collections()
+        self.db.client.close()
+
+    def walk(self, start_id, navigate, *args):
+        """
+        Follow the navigation from start_id until it stops moving
+        """
+        visited = [start_id]
+        while True:
+            boulder = navigate(visited[-1], self.gym, self.user_id, *args, self.db)
+            if boulder['_id'] == visited[-1]:
+                return visited
+            visited.append(boulder['_id'])
+
+    def test_same_order_as_full_list(self):
+        combinations = itertools.product(
+            SORTING_FIELD_MAP.keys(),  # sort_by
+            (True, False),  # is_ascending
+            (True, False),  # latest_wall_set
+            ('all', 'to_do'),  # to_show
+        )
+        for sort_by, is_ascending, latest_wall_set, to_show in combinations:
+            with self.subTest(sort_by=sort_by, is_ascending=is_ascending,
+                              latest_wall_set=latest_wall_set, to_show=to_show):
+                # Given
+                args = (latest_wall_set, sort_by, is_ascending, to_show)
+                expected = legacy_navigation_list(
+                    self.gym, self.user_id, *args, self.db)
+                # When
+                forward = self.walk(
+                    expected[0], mongodb_controller.get_next_boulder, *args)
+                backward = self.walk(
+                    expected[-1], mongodb_controller.get_previous_boulder, *args)
+                # Then
+                self.assertListEqual(expected, forward)
+                self.assertListEqual(expected[::-1], backward)
+
+    def test_navigation_indexes(self):
+        # Given
+        ensure_gym_indexes(self.gym, self.db)
+        # When
+        indexes = [
+            dict(index['key']) for index in self.db[f'{self.gym}_boulders'].list_indexes()
+        ]
+        # Then
+        for field in set(SORTING_FIELD_MAP.values()) - {'_id'}:
+            for direction in (1, -1):
+                self.assertIn({field: direction, 'time': -1, '_id': 1}, indexes)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,14 @@
 import datetime
+import inspect
+import json
+import os
+import shutil
+import tempfile
 import unittest
 import random
 from genericpath import isfile
+from types import SimpleNamespace
+from unittest.mock import patch
 
 from application import app
 from marshmallow import ValidationError
@@ -112,6 +119,18 @@ class UtilsTests(unittest.TestCase):
             self.assertTrue(isinstance(d, dict))
         self.assertListEqual(processed_data, expected_data)
 
+    def test_load_data_from_form(self):
+        # Given
+        from flask import request
+        from src.utils import load_data
+        form = {'boulder_data': '{}', 'origin': 'explore_boulders'}
+        # When
+        with app.test_request_context(method='POST', data=form):
+            data, is_form = load_data(request)
+        # Then
+        self.assertTrue(is_form)
+        self.assertDictEqual(form, data.to_dict())
+
     def test_get_wall_image(self):
         # Given
         from src.utils import get_wall_image
@@ -279,6 +298,301 @@ class UtilsTests(unittest.TestCase):
             isinstance(boulder_dict_single[ITEMS][id_key], str)
         )
 
+    def test_get_hold_data_json(self):
+        # Given
+        from src.utils import get_hold_data, get_hold_data_json
+        gym, section = 'sancu', 's1'
+        # When
+        with app.test_request_context():
+            hold_data = get_hold_data(gym, section, app.static_folder)
+            hold_data_json = get_hold_data_json(gym, section, app.static_folder)
+            expected = app.jinja_env.from_string(
+                '{{ hold_data | tojson | safe}}').render(hold_data=hold_data)
+            rendered = app.jinja_env.from_string(
+                '{{ hold_data_json }}').render(hold_data_json=hold_data_json)
+        # Then
+        self.assertIsNotNone(hold_data)
+        self.assertEqual(expected, rendered)
+
+    def test_get_hold_data_json_no_file(self):
+        # Given
+        from src.utils import get_hold_data, get_hold_data_json
+        gym, section = 'sancu', 'not_a_wall'
+        # When
+        with app.test_request_context():
+            hold_data = get_hold_data(gym, section, app.static_folder)
+            hold_data_json = get_hold_data_json(gym, section, app.static_folder)
+        # Then
+        self.assertIsNone(hold_data)
+        self.assertEqual('null', hold_data_json)
+
+    def test_hold_data_reloaded_on_change(self):
+        # Given
+        from src import hold_data_store
+        with tempfile.TemporaryDirectory() as folder:
+            filename = os.path.join(folder, 'wall.json')
+            with open(filename, 'w') as f:
+                json.dump({'holds': [[[0, 0], [1, 0], [1, 1]]]}, f)
+            with app.app_context():
+                first = hold_data_store.get(filename)
+                # When
+                cached = hold_data_store.get(filename)
+                with open(filename, 'w') as f:
+                    json.dump({'holds': [[[0, 0], [2, 0], [2, 2], [0, 2]]]}, f)
+                os.utime(filename, ns=(first.mtime_ns + 10**9, first.mtime_ns + 10**9))
+                reloaded = hold_data_store.get(filename)
+        # Then
+        self.assertIs(first, cached)
+        self.assertEqual(4, len(reloaded.data['holds'][0]))
+
+
+class HoldFormatTests(unittest.TestCase):
+    """
+    Test the binary format of the hold polygons
+    """
+    def test_round_trip(self):
+        # Given
+        from src import hold_format
+        polygons = [[[0, 0], [10, 0], [10, 10]], [[3000, 4000], [3999, 4001], [3500, 4500], [3000, 4500]]]
+        # When
+        decoded = hold_format.loads(hold_format.dumps(polygons))
+        # Then
+        self.assertEqual(2, len(decoded))
+        self.assertListEqual([3000, 4000, 3999, 4001, 3500, 4500, 3000, 4500],
+                             list(decoded.polygon(1)))
+        self.assertListEqual(polygons, decoded.to_lists())
+        self.assertListEqual(polygons[1], decoded.points(1))
+        self.assertEqual(json.dumps(polygons), decoded.to_json())
+
+    def test_large_coordinates(self):
+        # Given
+        from src import hold_format
+        polygons = [[[0, 0], [70000, 0], [70000, 70000]]]
+        # When
+        encoded = hold_format.dumps(polygons)
+        # Then
+        self.assertListEqual(polygons, hold_format.loads(encoded).to_lists())
+
+    def test_invalid_file(self):
+        # Given
+        from src import hold_format
+        encoded = hold_format.dumps([[[0, 0], [1, 1], [2, 0]]])
+        # When / Then
+        with self.assertRaises(hold_format.HoldFormatError):
+            hold_format.loads(b'{"holds": []}' + bytes(8))
+        with self.assertRaises(hold_format.HoldFormatError):
+            hold_format.loads(encoded[:-1])
+
+    def test_dump_replaces_mapped_file(self):
+        # Given
+        from src import hold_format
+        polygons = [[[0, 0], [10, 0], [10, 10]], [[20, 20], [30, 20], [30, 30], [20, 30]]]
+        with tempfile.TemporaryDirectory() as folder:
+            filename = os.path.join(folder, f's1{hold_format.HOLDS_EXTENSION}')
+            hold_format.dump(polygons, filename)
+            mapped = hold_format.load(filename)
+            # When
+            hold_format.dump(polygons[:1], filename)
+            # Then
+            self.assertListEqual(polygons, mapped.to_lists())
+            self.assertListEqual(polygons[:1], hold_format.load(filename).to_lists())
+            self.assertListEqual([os.path.basename(filename)], os.listdir(folder))
+
+    def test_hold_data_read_from_binary_file(self):
+        # Given
+        from src import hold_data_store, hold_format
+        from src.convert_hold_data import convert
+        with tempfile.TemporaryDirectory() as folder:
+            filename = os.path.join(folder, 's1.json')
+            shutil.copyfile(os.path.join(app.static_folder, 'images/walls/sancu/s1.json'), filename)
+            with app.app_context():
+                from_json = hold_data_store.get(filename)
+                # When
+                convert(filename)
+                from_binary = hold_data_store.get(filename)
+        # Then
+        self.assertIsNone(from_json.polygons)
+        self.assertTrue(from_binary.source.endswith(hold_format.HOLDS_EXTENSION))
+        self.assertIsNone(from_binary.data)
+        self.assertEqual(from_json.data, from_binary.to_dict())
+        self.assertEqual(from_json.json, from_binary.json)
+        self.assertEqual(from_json.get_points(3), from_binary.get_points(3))
+
+    def test_hold_data_binary_file_older_than_json(self):
+        # Given
+        from src import hold_data_store
+        from src.convert_hold_data import convert
+        with tempfile.TemporaryDirectory() as folder:
+            filename = os.path.join(folder, 's1.json')
+            with open(filename, 'w') as f:
+                json.dump({'holds': [[[0, 0], [1, 0], [1, 1]]]}, f)
+            holds_filename = convert(filename)
+            with open(filename, 'w') as f:
+                json.dump({'holds': [[[0, 0], [2, 0], [2, 2], [0, 2]]]}, f)
+            mtime_ns = os.stat(holds_filename).st_mtime_ns + 10**9
+            os.utime(filename, ns=(mtime_ns, mtime_ns))
+            with app.app_context():
+                # When
+                hold_data = hold_data_store.get(filename)
+        # Then
+        self.assertEqual(filename, hold_data.source)
+        self.assertEqual(4, len(hold_data.get_points(0)))
+
+
+class HoldIndexTests(unittest.TestCase):
+    """
+    Test the spatial index of the hold polygons of a wall
+    """
+    def test_find(self):
+        # Given
+        from src.hold_index import HoldIndex
+        square = [0, 0, 10, 0, 10, 10, 0, 10]
+        triangle = [20, 0, 30, 0, 20, 10]
+        inner_square = [2, 2, 4, 2, 4, 4, 2, 4]
+        index = HoldIndex([square, triangle, inner_square])
+        # When / Then
+        self.assertListEqual([0], index.find(5, 5))
+        self.assertListEqual([0, 2], index.find(3, 3))
+        self.assertListEqual([1], index.find(21, 1))
+        self.assertListEqual([], index.find(29, 9))
+        self.assertListEqual([], index.find(-5, 5))
+
+    def test_same_result_as_linear_search(self):
+        # Given
+        from src import hold_data_store
+        from src.hold_index import HoldIndex, _contains
+        random.seed(0)
+        with app.app_context():
+            hold_data = hold_data_store.get(
+                f'{app.static_folder}/images/walls/sancu/s1.json')
+        index = HoldIndex.from_hold_data(hold_data)
+        points = [(random.uniform(0, 4000), random.uniform(0, 4000)) for _ in range(1000)]
+        # When
+        found = [index.find(x, y) for x, y in points]
+        # Then
+        for (x, y), hits in zip(points, found):
+            expected = [i for i, polygon in enumerate(index.polygons) if _contains(polygon, x, y)]
+            self.assertListEqual(expected, hits)
+
+
+class ConnectionManagerTests(unittest.TestCase):
+    """
+    Test the pooled database client handling
+    """
+    def tearDown(self):
+        from db import connection_manager
+        connection_manager.close_all()
+
+    def test_client_is_reused(self):
+        # Given
+        from db import connection_manager
+        uri = 'mongodb://127.0.0.1:27017'
+        # When
+        first_client = connection_manager.get_client(uri)
+        second_client = connection_manager.get_client(uri)
+        # Then
+        self.assertIs(first_client, second_client)
+
+    def test_client_per_connection_string(self):
+        # Given
+        from db import connection_manager
+        # When
+        first_client = connection_manager.get_client('mongodb://127.0.0.1:27017')
+        second_client = connection_manager.get_client('mongodb://127.0.0.1:27018')
+        # Then
+        self.assertIsNot(first_client, second_client)
+
+    def test_get_database(self):
+        # Given
+        from db import connection_manager
+        from src.config import DB_NAME
+        uri = 'mongodb://127.0.0.1:27017'
+        # When
+        database = connection_manager.get_database(uri)
+        # Then
+        self.assertEqual(database.name, DB_NAME)
+        self.assertIs(database.client, connection_manager.get_client(uri))
+
+    def test_new_client_after_fork(self):
+        # Given
+        from db import connection_manager
+        uri = 'mongodb://127.0.0.1:27017'
+        parent_client = connection_manager.get_client(uri)
+        # When
+        connection_manager._owner_pid = -1  # pretend we are in a forked child
+        child_client = connection_manager.get_client(uri)
+        # Then
+        self.assertIsNot(parent_client, child_client)
+        parent_client.close()
+
+
+class UserCacheTests(unittest.TestCase):
+    """
+    Test the per-process user cache
+    """
+    def tearDown(self):
+        from db import user_cache
+        user_cache.invalidate()
+
+    def test_cached_user_is_a_copy(self):
+        # Given
+        from db import user_cache
+        user_cache.put('db', TEST_ID, ({'id': TEST_ID}, {'user_id': TEST_ID}), user_cache.get_generation())
+        # When
+        user_data, _ = user_cache.get('db', TEST_ID)
+        user_data['name'] = TEST_NAME
+        # Then
+        self.assertDictEqual({'id': TEST_ID}, user_cache.get('db', TEST_ID)[0])
+        self.assertIsNone(user_cache.get('other_db', TEST_ID))
+
+    def test_invalidate_user(self):
+        # Given
+        from db import user_cache
+        user_cache.put('db', TEST_ID, ({'id': TEST_ID}, {}), user_cache.get_generation())
+        user_cache.put('db', 'other', ({'id': 'other'}, {}), user_cache.get_generation())
+        # When
+        user_cache.invalidate(TEST_ID)
+        # Then
+        self.assertIsNone(user_cache.get('db', TEST_ID))
+        self.assertIsNotNone(user_cache.get('db', 'other'))
+
+    def test_stale_data_is_not_cached(self):
+        # Given
+        from db import user_cache
+        generation = user_cache.get_generation()
+        # When
+        user_cache.invalidate(TEST_ID)  # the user is saved while it was being read
+        user_cache.put('db', TEST_ID, ({'id': TEST_ID}, {}), generation)
+        # Then
+        self.assertIsNone(user_cache.get('db', TEST_ID))
+
+    def test_token_cached_until_expiry(self):
+        # Given
+        import time
+        from db import user_cache
+        generation = user_cache.get_generation()
+        entry = ({'id': TEST_ID}, {})
+        # When
+        user_cache.put_token('db', 'valid', TEST_ID, entry, time.time() + 60, generation)
+        user_cache.put_token('db', 'expired', TEST_ID, entry, time.time() - 1, generation)
+        # Then
+        self.assertEqual(entry, user_cache.get_token('db', 'valid'))
+        self.assertIsNone(user_cache.get_token('db', 'expired'))
+        self.assertIsNone(user_cache.get_token('other_db', 'valid'))
+
+    def test_invalidate_user_tokens(self):
+        # Given
+        import time
+        from db import user_cache
+        generation = user_cache.get_generation()
+        user_cache.put_token('db', 'token', TEST_ID, ({'id': TEST_ID}, {}), time.time() + 60, generation)
+        user_cache.put_token('db', 'other', 'other', ({'id': 'other'}, {}), time.time() + 60, generation)
+        # When
+        user_cache.invalidate(TEST_ID)
+        # Then
+        self.assertIsNone(user_cache.get_token('db', 'token'))
+        self.assertIsNotNone(user_cache.get_token('db', 'other'))
+
 
 class BoulderCreationTests(unittest.TestCase):
 
@@ -386,5 +700,290 @@ class UserModelTests(unittest.TestCase):
         self.assertEqual(only_latest, True)
 
 
+class EncodingTests(unittest.TestCase):
+    def test_pack_serialized_data(self):
+        # Given
+        import msgpack
+        from api.encoding import get_packer
+        data = {'_id': TEST_ID, 'time': '2024-05-01T18:30:00', 'holds': [[[0, 0], [1, 1]]]}
+        # When
+        unpacked = msgpack.unpackb(get_packer().pack(data))
+        # Then
+        self.assertDictEqual(data, unpacked)
+        with self.assertRaises(TypeError):
+            get_packer().pack({'_id': ObjectId(TEST_ID)})
+
+    def test_negotiate_mimetype(self):
+        # Given
+        from api.encoding import get_mimetype
+        accept_headers = {
+            None: 'application/json',
+            '*/*': 'application/json',
+            'application/msgpack': 'application/msgpack',
+            'application/x-msgpack': 'application/msgpack',
+            'application/json;q=0.5, application/msgpack': 'application/msgpack',
+            'text/html': 'application/json',
+        }
+        for accept, expected in accept_headers.items():
+            headers = {'Accept': accept} if accept else {}
+            # When
+            with app.test_request_context(headers=headers):
+                mimetype = get_mimetype()
+            # Then
+            self.assertEqual(expected, mimetype, accept)
+
+
+class IndexRegistryTests(unittest.TestCase):
+    def test_describe_plan(self):
+        # Given
+        from db.indexes import describe_plan
+        plans = {
+            'COLLSCAN': {'stage': 'COLLSCAN'},
+            'LIMIT > FETCH > IXSCAN name_1': {
+                'stage': 'LIMIT', 'inputStage': {
+                    'stage': 'FETCH', 'inputStage': {'stage': 'IXSCAN', 'indexName': 'name_1'}}},
+            'SORT_MERGE [IXSCAN a_1, IXSCAN b_1]': {
+                'stage': 'SORT_MERGE', 'inputStages': [
+                    {'stage': 'IXSCAN', 'indexName': 'a_1'}, {'stage': 'IXSCAN', 'indexName': 'b_1'}]},
+        }
+        for expected, plan in plans.items():
+            # When
+            description = describe_plan(plan)
+            # Then
+            self.assertEqual(expected, description)
+
+    def test_describe_explanation(self):
+        # Given
+        from db.indexes import describe_explanation
+        winning_plan = {'stage': 'LIMIT', 'inputStage': {'stage': 'IXSCAN', 'indexName': 'id_1'}}
+        explanations = {
+            'find': {'queryPlanner': {'winningPlan': winning_plan}},
+            'slot based engine': {'queryPlanner': {'winningPlan': {'queryPlan': winning_plan}}},
+            'aggregate': {'stages': [{'$cursor': {'queryPlanner': {'winningPlan': winning_plan}}}]},
+        }
+        for command, explanation in explanations.items():
+            # When
+            description = describe_explanation(explanation)
+            # Then
+            self.assertEqual('LIMIT > IXSCAN id_1', description, command)
+
+    def test_navigation_indexes_cover_sorting_options(self):
+        # Given
+        from db.indexes import GYM_COLLECTION_INDEXES
+        from db.mongodb_controller import SORTING_FIELD_MAP
+        # When
+        keys = [list(index.document['key'].items()) for index in GYM_COLLECTION_INDEXES['boulders']]
+        # Then
+        for field in set(SORTING_FIELD_MAP.values()) - {'_id'}:
+            for direction in (1, -1):
+                self.assertIn([(field, direction), ('time', -1), ('_id', 1)], keys)
+
+    def test_navigation_orders_served_by_indexes(self):
+        # Given
+        from db.indexes import GYM_COLLECTION_INDEXES
+        from db.mongodb_controller import SORTING_FIELD_MAP, get_navigation_order
+        keys = [list(index.document['key'].items()) for index in GYM_COLLECTION_INDEXES['boulders']]
+        keys.append([('_id', 1)])
+        for sort_by in SORTING_FIELD_MAP:
+            for is_ascending in (True, False):
+                # When
+                order = get_navigation_order(sort_by, is_ascending)
+                reverse = [(field, -direction) for field, direction in order]
+                # Then
+                self.assertTrue(
+                    any(key[:len(order)] in (order, reverse) for key in keys), (sort_by, order))
+
+
+class InstrumentationTests(unittest.TestCase):
+    def setUp(self):
+        from db import instrumentation
+        self.instrumentation = instrumentation
+        instrumentation.reset_totals()
+
+    def tearDown(self):
+        self.instrumentation.finish('test')
+        self.instrumentation.reset_totals()
+
+    @staticmethod
+    def get_event(command_name, duration_micros, reply=None):
+        return SimpleNamespace(command_name=command_name, duration_micros=duration_micros, reply=reply or {})
+
+    def test_commands_attributed_to_request(self):
+        # Given
+        listener = self.instrumentation.listener
+        listener.succeeded(self.get_event('find', 1000))
+        stats = self.instrumentation.start()
+        # When
+        listener.succeeded(self.get_event('find', 2000, {'cursor': {'firstBatch': [{}, {}]}}))
+        listener.succeeded(self.get_event('getMore', 500, {'cursor': {'nextBatch': [{}]}}))
+        listener.succeeded(self.get_event('findAndModify', 1500, {'value': {}}))
+        listener.failed(self.get_event('update', 250))
+        # Then
+        self.assertEqual(4, stats.count)
+        self.assertEqual(4.25, stats.duration)
+        self.assertEqual(4, stats.documents)
+        self.assertEqual(1, stats.errors)
+        self.assertEqual({'count': 1, 'duration_ms': 2}, stats.to_dict()['by_command']['find'])
+
+    def test_finish_adds_to_totals(self):
+        # Given
+        for _ in range(2):
+            self.instrumentation.start()
+            self.instrumentation.listener.succeeded(self.get_event('find', 1000))
+            # When
+            stats = self.instrumentation.finish('boulders')
+        # Then
+        self.assertEqual(1, stats.count)
+        self.assertIsNone(self.instrumentation.get_current())
+        self.assertIsNone(self.instrumentation.finish('boulders'))
+        totals = self.instrumentation.get_totals()['boulders']
+        self.assertEqual(2, totals['requests'])
+        self.assertEqual(2, totals['commands'])
+        self.assertEqual(2, totals['duration_ms'])
+
+    def test_server_timing(self):
+        # Given
+        stats = self.instrumentation.start()
+        stats.add('find', 2, 3)
+        stats.add('count', 1, 0)
+        stats.add('find', 1, 0)
+        # When
+        server_timing = self.instrumentation.get_server_timing(stats)
+        # Then
+        app_timing, db_timing = server_timing.split(', ', 1)
+        self.assertTrue(app_timing.startswith('app;dur='))
+        self.assertEqual(
+            'db;dur=4.000;desc="3 commands, 3 documents", db-find;dur=3.000;desc="2", db-count;dur=1.000;desc="1"',
+            db_timing)
+
+
+class MetricsTests(unittest.TestCase):
+    """
+    Test the Prometheus-style metrics
+    """
+    @classmethod
+    def setUpClass(cls):
+        from src import metrics
+        cls.counter = metrics.Counter('test_events_total', 'Test events', ('kind',))
+        cls.gauge = metrics.Gauge('test_level', 'Test level')
+        cls.histogram = metrics.Histogram('test_duration_seconds', 'Test durations', ('kind',), buckets=(0.1, 1))
+
+    def setUp(self):
+        for metric in (self.counter, self.gauge, self.histogram):
+            metric.values.clear()
+
+    def get_lines(self, name):
+        from src import metrics
+        return [line for line in metrics.render().splitlines() if line.startswith(name)]
+
+    def test_render(self):
+        # Given
+        self.counter.inc(kind='a "quoted" kind')
+        self.counter.inc(2, kind='a "quoted" kind')
+        self.gauge.set(1.5)
+        for value in (0.05, 0.5, 5):
+            self.histogram.observe(value, kind='a')
+        # When
+        counter_lines = self.get_lines('test_events_total')
+        gauge_lines = self.get_lines('test_level')
+        histogram_lines = self.get_lines('test_duration_seconds')
+        # Then
+        self.assertEqual(['test_events_total{kind="a \\"quoted\\" kind"} 3'], counter_lines)
+        self.assertEqual([f'test_level{{pid="{os.getpid()}"}} 1.5'], gauge_lines)
+        self.assertEqual([
+            'test_duration_seconds_bucket{kind="a",le="0.1"} 1',
+            'test_duration_seconds_bucket{kind="a",le="1"} 2',
+            'test_duration_seconds_bucket{kind="a",le="+Inf"} 3',
+            'test_duration_seconds_sum{kind="a"} 5.55',
+            'test_duration_seconds_count{kind="a"} 3',
+        ], histogram_lines)
+
+    def test_wrong_labels(self):
+        with self.assertRaises(ValueError):
+            self.counter.inc(other='a')
+
+    def test_updates_schedule_flush(self):
+        # Given
+        from src import metrics
+        with patch.object(metrics, '_schedule_flush') as schedule_flush:
+            # When
+            self.counter.inc(kind='a')
+            self.counter.set_total(5, kind='b')
+            self.gauge.set(1)
+            self.histogram.observe(0.5, kind='a')
+        # Then
+        self.assertEqual(4, schedule_flush.call_count)
+
+    def test_processes_are_aggregated(self):
+        # Given
+        from src import metrics
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        worker = {
+            'test_events_total': {'kind': 'counter', 'values': [[['a'], 2]]},
+            'test_level': {'kind': 'gauge', 'values': [[[], 7]]},
+            'test_duration_seconds': {'kind': 'histogram', 'values': [[['a'], [1, 0, 0, 0.05, 1]]]},
+        }
+        dead_worker = {
+            'test_events_total': {'kind': 'counter', 'values': [[['a'], 5], [['b'], 1]]},
+            'test_level': {'kind': 'gauge', 'values': [[[], 9]]},
+        }
+        for pid, snapshot in ((1, worker), (2, dead_worker)):
+            with open(os.path.join(directory, f'{pid}.json'), 'w') as f:
+                json.dump(snapshot, f)
+        self.counter.inc(kind='a')
+        self.gauge.set(3)
+        with patch.object(metrics, 'METRICS_DIR', directory):
+            # When
+            metrics.mark_process_dead(2)
+            counter_lines = self.get_lines('test_events_total')
+            gauge_lines = self.get_lines('test_level')
+            histogram_lines = self.get_lines('test_duration_seconds_count')
+        # Then
+        self.assertFalse(os.path.exists(os.path.join(directory, '2.json')))
+        self.assertEqual(['test_events_total{kind="a"} 8', 'test_events_total{kind="b"} 1'], counter_lines)
+        self.assertEqual(
+            sorted(['test_level{pid="1"} 7', f'test_level{{pid="{os.getpid()}"}} 3']), sorted(gauge_lines))
+        self.assertEqual(['test_duration_seconds_count{kind="a"} 1'], histogram_lines)
+
+    def test_commands_attributed_to_controller_functions(self):
+        # Given
+        from db import instrumentation
+        from db import mongodb_controller
+        listener = instrumentation.listener
+        event = SimpleNamespace(command_name='find', duration_micros=1000, reply={})
+        unattributed = instrumentation.COMMAND_DURATION.values.get((instrumentation.NO_FUNCTION, 'find'), [0])[-1]
+
+        def get_items(database):
+            listener.succeeded(event)
+            return instrumentation.attribute_iterator(listener.succeeded(event) for _ in range(2))
+
+        get_items = instrumentation.instrument(get_items)
+        # When
+        for _ in get_items(None):
+            # sent outside of the function
+            listener.succeeded(event)
+        # Then
+        self.assertEqual(1, instrumentation.FUNCTION_DURATION.values[('get_items',)][-1])
+        self.assertEqual(3, instrumentation.COMMAND_DURATION.values[('get_items', 'find')][-1])
+        self.assertEqual(
+            unattributed + 2, instrumentation.COMMAND_DURATION.values[(instrumentation.NO_FUNCTION, 'find')][-1])
+        self.assertTrue(hasattr(mongodb_controller.get_gyms, '__wrapped__'))
+
+    def test_reset_after_fork(self):
+        # Given
+        from src import metrics
+        self.counter.inc(kind='a')
+        lock = metrics._lock
+        # When
+        # as if another thread of the parent held the lock when forking
+        with lock:
+            metrics._reset_after_fork()
+            self.counter.inc(kind='b')
+        # Then
+        self.assertIsNot(lock, metrics._lock)
+        self.assertEqual(['test_events_total{kind="b"} 1'], self.get_lines('test_events_total'))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -17,6 +17,9 @@ TEST_NAME = 'test'
 TEST_NOTES = ''
 TEST_HOLDS = [{'color': '#00ff00', 'x': 0, 'y': 0}]
 TEST_IS_PROJECT = True
+# Navigation
+TEST_NAVIGATION_GYM_CODE = 'test_navigation'
+TEST_NAVIGATION_USER_ID = 'test_navigation_user'
 # User
 TEST_USERNAME = 'test_username'
 TEST_EMAIL = 'test_email@email.com'
@@ -36,3 +39,4 @@ GREATER_OR_EQUAL_KEY = '$gte'
 EQUAL_KEY = '$eq'
 NOT_EQUAL_KEY = '$ne'
 CONTAINS_TEXT_KEY = '$regex'
+ANY_OF_KEY = '$or'
@@ -7,6 +7,7 @@ from tests.tests_config import DB_NAME, WALLS_COLLECTION
 import src.ticklist_handler as ticklist_handler
 from tests.tests_config import TEST_GYM_CODE, TEST_NAME, TEST_WALL_SECTION, TEST_USERNAME
 import db.mongodb_controller as mongodb_controller
+from db import catalog as gym_catalog
 from src.utils import load_data
 
 
@@ -15,6 +16,9 @@ class FakeRequest:
         self.data = data
         self.form = form
         self.json = json
+
+    def get_json(self, silent=False):
+        return self.json
     # def get_data(self):
     #     return None
 
@@ -58,6 +62,7 @@ def create_walls_collection(db, gym_name, gym_code, coordinates):
         'coordinates': coordinates
     }
     walls_collection.insert_one(wall_data)
+    gym_catalog.invalidate(db.name)
 
 
 def add_wall(db, gym_code, wall_name, wall_section, wall_radius):
@@ -74,6 +79,7 @@ def add_wall(db, gym_code, wall_name, wall_section, wall_radius):
         'latest': True
     }
     gym_collection.insert_one(wall_data)
+    gym_catalog.invalidate(db.name)
 
 
 def drop_boulders(db, gym_code):
@@ -90,6 +96,7 @@ def drop_users(db):
     """
     users_collection = db['users']
     users_collection.drop()
+    db[mongodb_controller.TICKLIST_COLLECTION].drop()
 
 
 def add_boulder(db, gym, boulder_data):